@@ -1,171 +1,410 @@
 import os
+import csv
+import io
+import json
 import logging
-import hmac
-import hashlib
-import sqlite3
+import threading
+import time
+import click
 import bot_handlers  # ✅ Import here so it's always in scope
 from datetime import datetime
-from flask import Flask, request, jsonify, render_template, abort
-import requests
-from bot_handlers import process_update, send_telegram_message, handle_command, handle_regular_message
-from config import BOT_TOKEN, WEBHOOK_URL_PATH, PAYSTACK_SECRET_KEY, TELEGRAM_INVITE_LINK
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context, g
+import broadcast
+import metrics
+import outbound
+import profiling
+import invite_pool
+import migrations
+import outbox
+import storage
+import telegram_client
+import update_dedupe
+import update_executor
+import webhook_ingest
+from bot_handlers import process_update, reply_message, send_telegram_message, handle_command, handle_regular_message
+from config import WEBHOOK_URL_PATH, OUTBOX_MAX_ATTEMPTS, INVITE_POOL_ENABLED, ALL_PAYMENTS_DEFAULT_LIMIT, ALL_PAYMENTS_MAX_LIMIT, EXPORT_CHUNK_SIZE, SEEN_REFERENCES_MAX, INVITE_LINK_TTL, UPDATE_MODE, WEBHOOK_REPLY, LAZY_INIT
+from logging_setup import configure_logging, log_payload
+from seen_cache import SeenCache
 from telegram_invite import generate_invite_link
 
 # Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Create Flask app
 app = Flask(__name__, static_folder='static')
 app.secret_key = os.environ.get("SESSION_SECRET")
 
-DB_PATH = 'payments.db'
+HTTP_SECONDS = metrics.Histogram('http_request_seconds',
+                                 'Flask request latency', ('route', 'method'))
+HTTP_REQUESTS = metrics.Counter('http_requests_total',
+                                'Flask responses by status',
+                                ('route', 'status'))
 
 
-def init_db():
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS payments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                reference TEXT UNIQUE,
-                status TEXT,
-                amount INTEGER,
-                email TEXT,
-                full_name TEXT,
-                paid_at TEXT,
-                chat_id TEXT,
-                invite_link TEXT
-            )
-        ''')
-        conn.commit()
-
-
-def save_payment(data, invite_link=None):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-
-        # Extract full_name and chat_id from metadata.custom_fields
-        full_name = None
-        chat_id = None
-        for field in data.get('metadata', {}).get('custom_fields', []):
-            if field.get('variable_name') == 'full_name':
-                full_name = field.get('value')
-            elif field.get('variable_name') == 'chat_id':
-                chat_id = field.get('value')
+@app.before_request
+def start_request_timer():
+    start_background()
+    metrics.start_flusher()
+    if profiling.ENABLED:
+        profiling.start_request()
+    g.request_start = time.perf_counter()
 
-        try:
-            c.execute(
-                '''
-                INSERT INTO payments (reference, status, amount, email, full_name, paid_at, chat_id, invite_link)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (data['reference'], data['status'], data['amount'],
-                      data['customer']['email'], full_name, data['paid_at'],
-                      chat_id, invite_link))
-            conn.commit()
-        except sqlite3.IntegrityError:
-            logger.warning(
-                f"Payment with reference {data['reference']} already saved")
 
+@app.after_request
+def record_request(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        # The endpoint name keeps the bot token in the webhook path out of
+        # the labels
+        route = request.endpoint or 'unmatched'
+        elapsed = time.perf_counter() - start
+        HTTP_SECONDS.labels(route, request.method).observe(elapsed)
+        HTTP_REQUESTS.labels(route, str(response.status_code)).inc()
+        if profiling.ENABLED:
+            profiling.finish_request(route, request.method,
+                                     response.status_code, elapsed)
+    return response
 
-def dict_factory(cursor, row):
-    return {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
 
+_db_ready = False
+_started_pid = None
+_startup_lock = threading.Lock()
 
-@app.route('/all_payments', methods=['GET'])
-def all_payments():
-    # Read optional limit and offset query params (default: all records)
-    limit = request.args.get('limit', type=int)
-    offset = request.args.get('offset', type=int, default=0)
 
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory = dict_factory
-        c = conn.cursor()
+def init_db():
+    """Bring the schema up to date and note the database's optional features"""
+    global _db_ready
+
+    conn = storage.get_connection()
+    migrations.migrate(conn)
+    storage.detect_features(conn)
+    _db_ready = True
+
+
+def start_background():
+    """Start this worker's background threads, once per process.
+
+    A forked worker inherits _db_ready from a parent that already ran
+    init_db, so it goes straight to starting its threads.
+    """
+    global _started_pid
+
+    pid = os.getpid()
+    if _started_pid == pid:
+        return
+    with _startup_lock:
+        if _started_pid == pid:
+            return
+        if not _db_ready:
+            init_db()
+        outbox.start_worker()
+        broadcast.start_runner()
+        if INVITE_POOL_ENABLED:
+            invite_pool.start_refiller()
+        if UPDATE_MODE == 'polling':
+            import polling
+            polling.start_poller()
+        _started_pid = pid
+
+
+def stop_background():
+    """Stop the threads start_background() started in this process"""
+    global _started_pid
+
+    with _startup_lock:
+        if _started_pid != os.getpid():
+            return
+        import polling
+        polling.stop_poller()
+        invite_pool.stop_refiller()
+        broadcast.stop_runner()
+        outbox.stop_worker()
+        _started_pid = None
+
+
+def warm_up():
+    """Load what the first request would, without opening connections"""
+    telegram_client.warm_up()
+    for template in app.jinja_loader.list_templates():
+        app.jinja_env.get_template(template)
+
+
+# Recently seen Paystack references, so retries are answered without a
+# database round trip
+seen_references = SeenCache(SEEN_REFERENCES_MAX)
+ingest_counters = {'inserted': 0, 'duplicates_suppressed': 0, 'cache_hits': 0}
+_ingest_lock = threading.Lock()
+
+
+def _count_ingest(name):
+    with _ingest_lock:
+        ingest_counters[name] += 1
+
+
+def save_payment_with_invite_job(data, chat_id):
+    """Persist a payment and its pending invite delivery in one transaction.
+
+    Returns False if the reference was already recorded.
+    """
+    conn = storage.get_connection()
+    with conn:
+        if storage.insert_payment(conn, data) is None:
+            return False
+        if chat_id:
+            outbox.add_invite_job(conn, data['reference'], chat_id,
+                                  data['amount'])
+    return True
 
-        base_query = """
-            SELECT id, reference, status, amount, email, full_name, paid_at, chat_id, invite_link
-            FROM payments
-            ORDER BY id DESC
-        """
 
-        # Add pagination if limit is specified
-        if limit is not None:
-            base_query += " LIMIT ? OFFSET ?"
-            c.execute(base_query, (limit, offset))
+def ingest_payment(data, chat_id):
+    """Record a charge exactly once. Returns False for a duplicate reference."""
+    reference = data['reference']
+    if seen_references.contains(reference):
+        _count_ingest('cache_hits')
+        _count_ingest('duplicates_suppressed')
+        return False
+
+    inserted = save_payment_with_invite_job(data, chat_id)
+    seen_references.add(reference)
+    _count_ingest('inserted' if inserted else 'duplicates_suppressed')
+    return inserted
+
+
+def _invite_link_terms():
+    """How the links from telegram_invite behave: join requests with a TTL"""
+    terms = "tap it to request to join; an admin will approve you"
+    if not INVITE_LINK_TTL:
+        return terms
+    if INVITE_LINK_TTL % 3600 == 0:
+        ttl = f"{INVITE_LINK_TTL // 3600} hours"
+    else:
+        ttl = f"{max(INVITE_LINK_TTL // 60, 1)} minutes"
+    return f"{terms}. It expires within {ttl}"
+
+
+def deliver_invite(job, attempts):
+    """Outbox handler: mint (once) and send the invite link for a payment"""
+    reference = job['reference']
+    chat_id = job['chat_id']
+
+    conn = storage.get_connection()
+    invite_link = storage.get_invite_link(conn, reference)
+
+    if not invite_link and INVITE_POOL_ENABLED:
+        invite_link = invite_pool.claim_invite_link(conn, reference)
+        invite_pool.wake()
+        if invite_link:
+            invite_link = storage.set_invite_link(conn, reference,
+                                                  invite_link)
         else:
-            c.execute(base_query)
+            logger.warning("Invite pool empty, minting link inline")
 
-        payments = c.fetchall()
-
-        # Format paid_at field (if exists)
-        for payment in payments:
-            paid_at = payment.get("paid_at")
-            if paid_at:
-                try:
-                    payment["paid_at"] = datetime.strptime(
-                        paid_at,
-                        "%Y-%m-%d %H:%M:%S").strftime("%b %d, %Y %I:%M %p")
-                except Exception:
-                    pass  # leave as is if format doesn't match
-
-        return jsonify({'payments': payments})
+    if not invite_link:
+        try:
+            invite_link = generate_invite_link(expire_date=(
+                int(time.time()) + INVITE_LINK_TTL if INVITE_LINK_TTL else None))
+        except Exception as e:
+            if attempts < OUTBOX_MAX_ATTEMPTS:
+                raise
+            logger.error("Failed to generate invite link: %s", e)
+        else:
+            # Keep the first link stored if another attempt beat us to it
+            invite_link = storage.set_invite_link(conn, reference,
+                                                  invite_link)
 
+    if invite_link:
+        message = f"🎉 Thank you for your payment of ₵{job['amount'] / 100:.2f}!\nHere is your invite link ({_invite_link_terms()}):\n{invite_link}"
+    else:
+        message = "✅ Payment received! But we couldn’t generate your invite link. Please contact support."
 
-@app.route('/dashboard_payments')
-def dashboard_payments():
-    return render_template('dashboard_payments.html')
+    outbound.get_dispatcher().limiter.acquire()
+    if send_telegram_message(chat_id, message) is None:
+        raise RuntimeError(f"Failed to send invite message to chat {chat_id}")
+    logger.info("Sent invite message to chat_id %s", chat_id)
 
 
-init_db()
+outbox.register_handler('deliver_invite', deliver_invite)
 
-if PAYSTACK_SECRET_KEY is None:
-    raise ValueError("PAYSTACK_SECRET_KEY not set in environment variables")
 
+def _filter_args():
+    """Dashboard filters shared by the payments list and stats endpoints"""
+    return {
+        'start': request.args.get('start') or None,
+        'end': request.args.get('end') or None,
+        'status': request.args.get('status') or None,
+        'q': (request.args.get('q') or '').strip() or None
+    }
 
-def verify_paystack_signature(request):
-    signature = request.headers.get('X-Paystack-Signature')
-    if signature is None:
-        abort(400, "Missing signature")
 
-    # Get raw request body bytes exactly as sent
-    body = request.get_data()
+@app.route('/all_payments', methods=['GET'])
+def all_payments():
+    # Pagination: pass the returned next_after_id as after_id for the next
+    # page. offset is still accepted but gets slower the deeper it goes.
+    limit = min(
+        request.args.get('limit', type=int, default=ALL_PAYMENTS_DEFAULT_LIMIT),
+        ALL_PAYMENTS_MAX_LIMIT)
+    offset = request.args.get('offset', type=int, default=0)
+    after_id = request.args.get('after_id', type=int)
+
+    payments = storage.list_payments(storage.get_connection(),
+                                     limit,
+                                     offset,
+                                     after_id=after_id,
+                                     **_filter_args())
+    next_after_id = payments[-1]['id'] if len(payments) == limit else None
+
+    # Format legacy "YYYY-MM-DD HH:MM:SS" paid_at values; Paystack's ISO
+    # timestamps are returned as stored
+    for payment in payments:
+        paid_at = payment.get("paid_at")
+        if paid_at and len(paid_at) == 19 and paid_at[10] == ' ':
+            try:
+                payment["paid_at"] = datetime.strptime(
+                    paid_at,
+                    "%Y-%m-%d %H:%M:%S").strftime("%b %d, %Y %I:%M %p")
+            except Exception:
+                pass  # leave as is if format doesn't match
+
+    return jsonify({'payments': payments, 'next_after_id': next_after_id})
+
+
+@app.route('/payments/stats', methods=['GET'])
+def payments_stats():
+    """Aggregates for the payments dashboard, computed in SQL"""
+    return jsonify(
+        storage.payment_stats(storage.get_connection(), **_filter_args()))
+
+
+@app.route('/payments/export', methods=['GET'])
+def export_payments():
+    """Stream the filtered ledger as CSV (default) or NDJSON"""
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({
+            'status': 'error',
+            'message': 'format must be csv or ndjson'
+        }), 400
+
+    filters = _filter_args()
+    conn = storage.get_connection()
+    columns = storage.EXPORT_COLUMNS
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        yield buffer.getvalue()
+        for rows in storage.iter_payment_chunks(conn, EXPORT_CHUNK_SIZE,
+                                                **filters):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            yield buffer.getvalue()
+
+    def generate_ndjson():
+        for rows in storage.iter_payment_chunks(conn, EXPORT_CHUNK_SIZE,
+                                                **filters):
+            yield ''.join(
+                json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+
+    if export_format == 'csv':
+        body, mimetype = generate_csv(), 'text/csv'
+    else:
+        body, mimetype = generate_ndjson(), 'application/x-ndjson'
+
+    return Response(stream_with_context(body),
+                    mimetype=mimetype,
+                    headers={
+                        'Content-Disposition':
+                        f'attachment; filename=payments.{export_format}',
+                        'X-Accel-Buffering': 'no'
+                    })
+
+
+@app.cli.command('rollups-rebuild')
+def rollups_rebuild_command():
+    """Recompute the revenue rollup tables from the payments table."""
+    storage.rebuild_rollups(storage.get_connection())
+    print("Payment rollups rebuilt")
+
+
+@app.cli.command('rollups-check')
+def rollups_check_command():
+    """Verify the revenue rollups against the payments table."""
+    mismatches = storage.check_rollups(storage.get_connection())
+    for mismatch in mismatches:
+        print(f"{mismatch['rollup']} {mismatch['bucket']} {mismatch['status']}: "
+              f"expected {mismatch['expected']}, found {mismatch['actual']}")
+    if mismatches:
+        raise SystemExit(f"{len(mismatches)} rollup buckets out of sync")
+    print("Payment rollups are consistent")
+
+
+@app.cli.command('reconcile')
+@click.option('--since', help="ISO date or time to start from instead of the checkpoint")
+@click.option('--until', help="ISO date or time to stop at instead of now")
+def reconcile_command(since, until):
+    """Record successful Paystack transactions whose webhook was missed."""
+    # Imported here so serving the app does not load the reconcile client
+    import reconcile
+    if not _db_ready:
+        init_db()
+    stats = reconcile.reconcile(
+        since=reconcile.from_iso(since) if since else None,
+        until=reconcile.from_iso(until) if until else None)
+    if stats is None:
+        raise SystemExit("Another reconciliation is running")
+    print(f"{stats['transactions']} transactions in {stats['pages']} pages "
+          f"({stats['from']} to {stats['to']}): {stats['inserted']} payments "
+          f"recovered, {stats['invites_queued']} invites queued "
+          f"in {stats['seconds']}s")
 
-    # Use your secret key exactly as configured in Paystack
-    secret_key = PAYSTACK_SECRET_KEY.encode('utf-8')
 
-    computed_signature = hmac.new(secret_key, body, hashlib.sha512).hexdigest()
+@app.route('/dashboard_payments')
+def dashboard_payments():
+    return render_template('dashboard_payments.html')
 
-    print(f"Received signature: {signature}")
-    print(f"Computed signature: {computed_signature}")
 
-    if not hmac.compare_digest(computed_signature, signature):
-        abort(400, "Invalid signature")
+metrics.gauge('update_queue_depth', 'Updates waiting in the update executor',
+              update_executor.queue_depth)
+metrics.gauge('outbound_queue_depth', 'Messages waiting for delivery',
+              lambda: outbound.dispatcher_stats()['queue_depth'])
+metrics.gauge('outbox_pending_jobs', 'Outbox jobs not yet done',
+              lambda: outbox.outbox_stats(storage.get_connection())['pending'],
+              merge='max')
+if INVITE_POOL_ENABLED:
+    metrics.gauge(
+        'invite_pool_available', 'Unclaimed invite links in the pool',
+        lambda: invite_pool.available_count(storage.get_connection()),
+        merge='max')
 
-    return True
+# Only the schema is prepared at import: background threads start from
+# gunicorn's post_worker_init or the first request, so a one-off `flask`
+# command never mints invite links or sends messages
+if not LAZY_INIT:
+    init_db()
 
 
 @app.route('/payment_webhook', methods=['POST'])
 def payment_webhook():
     try:
-        if not verify_paystack_signature(request):
-            logger.warning("Invalid Paystack webhook signature")
-            abort(400, "Invalid signature")
+        with profiling.span('ingest'):
+            body = webhook_ingest.read_body(request)
+            webhook_ingest.verify_paystack(
+                body, request.headers.get('X-Paystack-Signature'))
+            payload = webhook_ingest.parse(body)
+    except webhook_ingest.IngestError as e:
+        logger.warning("Rejected payment webhook: %s", e.message)
+        return jsonify({'status': 'error', 'message': e.message}), e.status
 
-        payload = request.json
-        if payload is None:
-            return jsonify({
-                'status': 'error',
-                'message': 'Invalid JSON payload'
-            }), 400
-
-        logger.debug(f"Payment webhook payload: {payload}")
-        event = payload.get('event')
-        data = payload.get('data', {})
+    try:
+        log_payload(logger, "Payment webhook payload", payload)
+        event = webhook_ingest.PaymentEvent(payload)
 
-        if event == 'charge.success':
-            reference = data.get('reference')
+        if event.event == 'charge.success':
+            reference = event.reference
+            chat_id = event.chat_id
             if not reference:
                 logger.warning("No reference found in payment data")
                 return jsonify({
@@ -173,27 +412,14 @@ def payment_webhook():
                     'message': 'No reference found'
                 }), 400
 
-            # ✅ Extract chat_id before checking duplicates
-            metadata = data.get('metadata', {})
-            chat_id = None
-            for field in metadata.get('custom_fields', []):
-                if field.get('variable_name') == 'chat_id':
-                    chat_id = field.get('value')
-                    break
-
-            # ✅ Check if reference already exists in DB
-            with sqlite3.connect(DB_PATH) as conn:
-                c = conn.cursor()
-                c.execute("SELECT 1 FROM payments WHERE reference = ?",
-                          (reference, ))
-                exists = c.fetchone()
-
-            if exists:
-                logger.info(
-                    f"Duplicate webhook ignored for reference: {reference}")
+            # ✅ Save payment and queue the invite in one transaction;
+            # the outbox worker mints and sends the link after we respond
+            if not ingest_payment(event.data, chat_id):
+                logger.info("Duplicate webhook ignored for reference: %s",
+                            reference)
                 # Optionally send a reminder if chat_id is known
                 if chat_id:
-                    send_telegram_message(
+                    reply_message(
                         chat_id,
                         "✅ We already received your payment. If you need your invite link again, please contact support."
                     )
@@ -202,29 +428,15 @@ def payment_webhook():
                     'message': 'Duplicate reference'
                 }), 200
 
-            # ✅ Generate invite link and send to user
-            invite_link = None
             if chat_id:
-                try:
-                    invite_link = generate_invite_link(
-                    )  # This uses your updated telegram_invite.py function
-                    message = f"🎉 Thank you for your payment of ₵{data['amount'] / 100:.2f}!\nHere is your invite link (valid for 5 minutes, single use):\n{invite_link}"
-                except Exception as e:
-                    logger.error(f"Failed to generate invite link: {e}")
-                    message = "✅ Payment received! But we couldn’t generate your invite link. Please contact support."
-
-                send_telegram_message(chat_id, message)
-                logger.info(f"Sent invite message to chat_id {chat_id}")
+                outbox.wake()
             else:
                 logger.warning("No chat_id found in payment metadata")
 
-            # ✅ Save payment to DB (with invite link)
-            save_payment(data, invite_link)
-
         return jsonify({'status': 'success'})
 
     except Exception as e:
-        logger.error(f"Error processing payment webhook: {e}")
+        logger.error("Error processing payment webhook: %s", e)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
@@ -242,25 +454,69 @@ def payment_form():
 @app.route(WEBHOOK_URL_PATH, methods=['POST'])
 def webhook():
     try:
-        update = request.get_json()
-        print("Received update:", update)
-        logger.debug(f"Received update: {update}")
-        process_update(update)
+        with profiling.span('ingest'):
+            view = webhook_ingest.TelegramUpdate(
+                webhook_ingest.parse(webhook_ingest.read_body(request)))
+    except webhook_ingest.IngestError as e:
+        logger.warning("Rejected Telegram update: %s", e.message)
+        return jsonify({'status': 'error', 'message': e.message}), e.status
+
+    try:
+        update = view.update
+        log_payload(logger, "Received update", update)
+
+        if update_dedupe.is_duplicate(update):
+            logger.info("Dropping duplicate update %s", view.update_id)
+            return jsonify({'status': 'duplicate'})
+
+        executor = update_executor.get_executor()
+        if (WEBHOOK_REPLY and bot_handlers.wants_webhook_reply(view.text)
+                and not outbound.has_pending(view.chat_id)):
+            # Answer in the response body and skip a sendMessage round trip,
+            # unless earlier updates for the chat are still pending on its
+            # shard, or earlier replies in the outbound queue, and must go
+            # first
+            if executor is None:
+                inline, body = True, bot_handlers.process_update_for_webhook(
+                    update)
+            else:
+                inline, body = executor.run_if_idle(
+                    view.chat_id, bot_handlers.process_update_for_webhook,
+                    update)
+            if inline:
+                if body is not None:
+                    return Response(body, mimetype='application/json')
+                return jsonify({'status': 'success'})
+
+        if executor is None:
+            process_update(update)
+        elif not executor.submit(update, view.chat_id):
+            # Shed load: Telegram redelivers the update later, so let the
+            # redelivery through the dedupe check
+            update_dedupe.release(update)
+            logger.warning("Update queue full, asking Telegram to retry")
+            return jsonify({'status': 'busy'}), 503, {'Retry-After': '1'}
         return jsonify({'status': 'success'})
     except Exception as e:
-        logger.error(f"Error processing webhook: {e}")
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+        logger.error("Error processing webhook: %s", e)
+        # Still answer 200: an error status makes Telegram redeliver the
+        # same update, which would fail the same way
+        return jsonify({'status': 'error', 'message': str(e)})
 
 
 @app.route('/set_webhook', methods=['GET'])
 def set_webhook():
+    if UPDATE_MODE == 'polling':
+        return jsonify({
+            'status': 'error',
+            'message': 'UPDATE_MODE is polling; unset it to use the webhook'
+        }), 400
+
     try:
         base_url = f"https://{request.host}"
         webhook_url = f"{base_url}{WEBHOOK_URL_PATH}"
 
-        response = requests.post(
-            f'https://api.telegram.org/bot{BOT_TOKEN}/setWebhook',
-            json={'url': webhook_url})
+        response = telegram_client.call('setWebhook', {'url': webhook_url})
 
         response_json = response.json()
         if response.status_code == 200 and response_json.get('ok'):
@@ -277,15 +533,14 @@ def set_webhook():
                 'telegram_response': response_json
             }), 400
     except Exception as e:
-        logger.error(f"Error setting webhook: {e}")
+        logger.error("Error setting webhook: %s", e)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
 @app.route('/webhook_info', methods=['GET'])
 def webhook_info():
     try:
-        response = requests.get(
-            f'https://api.telegram.org/bot{BOT_TOKEN}/getWebhookInfo')
+        response = telegram_client.call('getWebhookInfo', http_method='GET')
         if response.status_code == 200:
             return jsonify({
                 'status': 'success',
@@ -298,15 +553,14 @@ def webhook_info():
                 'telegram_response': response.json()
             }), 500
     except Exception as e:
-        logger.error(f"Error getting webhook info: {e}")
+        logger.error("Error getting webhook info: %s", e)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
 @app.route('/delete_webhook', methods=['GET'])
 def delete_webhook():
     try:
-        response = requests.get(
-            f'https://api.telegram.org/bot{BOT_TOKEN}/deleteWebhook')
+        response = telegram_client.call('deleteWebhook', http_method='GET')
         if response.status_code == 200 and response.json().get('ok'):
             return jsonify({
                 'status': 'success',
@@ -319,10 +573,95 @@ def delete_webhook():
                 'telegram_response': response.json()
             }), 500
     except Exception as e:
-        logger.error(f"Error deleting webhook: {e}")
+        logger.error("Error deleting webhook: %s", e)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+@app.route('/telegram_client_stats', methods=['GET'])
+def telegram_client_stats():
+    """Connection reuse counts for this worker's Telegram API pool"""
+    return jsonify(telegram_client.connection_stats())
+
+
+@app.route('/outbound_stats', methods=['GET'])
+def outbound_stats():
+    """Queue depth and delivery counters for this worker's dispatcher"""
+    return jsonify(outbound.dispatcher_stats())
+
+
+@app.route('/command_stats', methods=['GET'])
+def command_stats():
+    """Per-command call counts and handler latency for this worker"""
+    return jsonify(bot_handlers.router.stats())
+
+
+@app.route('/update_executor_stats', methods=['GET'])
+def update_executor_stats():
+    """Queue depths and counters for the sharded update executor"""
+    executor = update_executor.get_executor()
+    return jsonify(executor.stats() if executor else {'shards': 0})
+
+
+@app.route('/update_dedupe_stats', methods=['GET'])
+def update_dedupe_stats():
+    """Accepted and dropped Telegram updates for this worker"""
+    return jsonify(update_dedupe.dedupe_stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics merged across all live workers"""
+    return Response(metrics.render(),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/admin/slow_requests', methods=['GET'])
+def slow_requests():
+    """Recent requests slower than SLOW_REQUEST_MS, newest first"""
+    if not profiling.ENABLED:
+        return jsonify({
+            'status': 'error',
+            'message': 'Profiling is off; set SLOW_REQUEST_MS or PROFILE_SAMPLE_RATE'
+        }), 404
+    limit = request.args.get('limit', default=50, type=int)
+    return jsonify({'slow_requests': profiling.slow_requests(limit)})
+
+
+@app.route('/ingest_stats', methods=['GET'])
+def ingest_stats():
+    """Payment ingest counters and seen-reference cache usage for this worker"""
+    with _ingest_lock:
+        stats = dict(ingest_counters)
+    stats['seen_cache'] = seen_references.stats()
+    return jsonify(stats)
+
+
+@app.route('/outbox_stats', methods=['GET'])
+def outbox_stats():
+    """Job counts by status for the durable outbox"""
+    return jsonify(outbox.outbox_stats(storage.get_connection()))
+
+
+@app.route('/invite_pool_stats', methods=['GET'])
+def invite_pool_stats():
+    """Available and target sizes of the pre-minted invite link pool"""
+    return jsonify(invite_pool.pool_stats(storage.get_connection()))
+
+
+@app.route('/broadcast_stats', methods=['GET'])
+def broadcast_stats():
+    """Progress, throughput and ETA of the latest broadcasts"""
+    limit = request.args.get('limit', default=10, type=int)
+    return jsonify(broadcast.broadcast_stats(storage.get_connection(), limit))
+
+
+@app.route('/reconcile_stats', methods=['GET'])
+def reconcile_stats():
+    """Checkpoint and results of the last Paystack reconciliation run"""
+    import reconcile
+    return jsonify(reconcile.reconcile_stats(storage.get_connection()))
+
+
 @app.route('/test_bot', methods=['POST'])
 def test_bot():
     data: dict = request.get_json()  # Add type hint
@@ -346,7 +685,7 @@ def test_bot():
                 'message': 'No message provided'
             }), 400
 
-        logger.info(f"Testing bot with message: {message_text}")
+        logger.info("Testing bot with message: %s", message_text)
 
         simulated_message = {
             'message_id': 1,
@@ -369,21 +708,21 @@ def test_bot():
 
         response_tracking = {'text': None, 'sent': False}
 
-        def test_send_telegram_message(chat_id,
-                                       text,
-                                       parse_mode=None,
-                                       reply_markup=None):
+        def test_reply_message(chat_id,
+                               text,
+                               parse_mode=None,
+                               reply_markup=None):
             response_tracking['text'] = text
             response_tracking['parse_mode'] = parse_mode
             response_tracking['reply_markup'] = reply_markup
             response_tracking['sent'] = True
-            logger.info(f"Would send to Telegram: {text[:50]}...")
+            logger.info("Would send to Telegram: %s...", text[:50])
             return {'ok': True, 'result': {'message_id': 1}}
 
-        original_send = send_telegram_message
+        original_reply = reply_message
 
         try:
-            bot_handlers.send_telegram_message = test_send_telegram_message
+            bot_handlers.reply_message = test_reply_message
 
             if message_text.startswith('/'):
                 command, args = bot_handlers.extract_command(message_text)
@@ -398,7 +737,7 @@ def test_bot():
                                        int(chat_id), simulated_message)
 
         finally:
-            bot_handlers.send_telegram_message = original_send  # ✅ No more Pyright error
+            bot_handlers.reply_message = original_reply  # ✅ No more Pyright error
 
         if response_tracking['sent']:
             return jsonify({
@@ -419,9 +758,10 @@ def test_bot():
             })
 
     except Exception as e:
-        logger.error(f"Error testing bot: {e}")
+        logger.error("Error testing bot: %s", e)
         return jsonify({'status': 'error', 'message': f'Error: {str(e)}'}), 500
 
 
 if __name__ == '__main__':
+    start_background()
     app.run(host='0.0.0.0', port=5000, debug=True)
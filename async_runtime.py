@@ -0,0 +1,330 @@
+# async_runtime.py
+"""Asyncio runtime: async Bot API client, coroutine handlers and a webhook server.
+
+Run ``python async_runtime.py`` to serve the Telegram webhook from a single
+event loop instead of Flask. Commands registered with ``async def`` handlers
+run on the loop and reply through the pooled async client; sync handlers
+keep working and run on a thread pool. Needs the optional ``aiohttp``
+dependency (``pip install .[async]``).
+"""
+
+import asyncio
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import aiohttp
+    from aiohttp import web
+except ImportError:  # optional dependency
+    aiohttp = None
+    web = None
+
+import bot_handlers
+import outbound
+import update_dedupe
+import webhook_ingest
+from logging_setup import configure_logging
+from bot_handlers import extract_command, router
+from config import (ASYNC_POOL_SIZE, ASYNC_SYNC_WORKERS, ASYNC_PORT,
+                    WEBHOOK_URL_PATH, WEBHOOK_REPLY, WEBHOOK_MAX_BODY,
+                    OUTBOUND_MAX_RETRIES, TELEGRAM_CONNECT_TIMEOUT,
+                    TELEGRAM_READ_TIMEOUT)
+from telegram_client import API_URL, record_call
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTelegramClient:
+    """Bot API client over one keep-alive aiohttp connection pool.
+
+    A client belongs to the event loop it is used on. Sends take tokens from
+    the outbound dispatcher's bucket, so the bot-wide rate holds across the
+    sync and async paths, and 429 responses are retried after
+    ``retry_after``.
+    """
+
+    def __init__(self, pool_size=ASYNC_POOL_SIZE):
+        if aiohttp is None:
+            raise RuntimeError("The async runtime requires aiohttp")
+        self.pool_size = pool_size
+        self.requests = 0
+        self.rate_limited = 0
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size,
+                                             keepalive_timeout=60)
+            timeout = aiohttp.ClientTimeout(
+                sock_connect=TELEGRAM_CONNECT_TIMEOUT,
+                sock_read=TELEGRAM_READ_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=timeout)
+        return self._session
+
+    async def call(self, method, payload=None):
+        """Call a Bot API method and return the decoded response body"""
+        session = self._get_session()
+        self.requests += 1
+        start = time.perf_counter()
+        status = None
+        try:
+            async with session.post(f"{API_URL}/{method}",
+                                    json=payload) as response:
+                status = response.status
+                return await response.json(content_type=None)
+        finally:
+            record_call(method, status, time.perf_counter() - start)
+
+    async def _acquire(self, limiter):
+        delay = limiter.reserve()
+        while delay:
+            await asyncio.sleep(delay)
+            delay = limiter.reserve()
+
+    async def send_message(self, chat_id, text, parse_mode=None,
+                           reply_markup=None):
+        data = {"chat_id": chat_id, "text": text}
+        if parse_mode:
+            data['parse_mode'] = parse_mode
+        if reply_markup:
+            data['reply_markup'] = json.dumps(reply_markup)
+
+        limiter = outbound.get_dispatcher().limiter
+        for _ in range(OUTBOUND_MAX_RETRIES + 1):
+            await self._acquire(limiter)
+            try:
+                result = await self.call('sendMessage', data)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error("Exception while sending message to chat %s: %s",
+                             chat_id, e)
+                return None
+            if result.get('ok'):
+                return result
+
+            retry_after = result.get('parameters', {}).get('retry_after')
+            if result.get('error_code') != 429 or retry_after is None:
+                logger.error("Failed to send message to chat %s: %s", chat_id,
+                             result)
+                return None
+            self.rate_limited += 1
+            limiter.pause(retry_after)
+
+        logger.error("Giving up on message to chat %s after 429s", chat_id)
+        return None
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+# One client per event loop; aiohttp sessions cannot be shared across loops
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    """Return the client for the running event loop, creating it on first use"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncTelegramClient()
+    return client
+
+
+async def reply(chat_id, text, parse_mode=None, reply_markup=None):
+    """Send a message from a coroutine handler"""
+    return await get_client().send_message(chat_id, text, parse_mode,
+                                           reply_markup)
+
+
+class AsyncRuntime:
+    """Process updates on the event loop.
+
+    Commands with coroutine handlers are awaited directly. Everything else
+    goes through ``bot_handlers.process_update`` on a thread pool, so
+    existing sync handlers behave exactly as they do under Flask.
+    """
+
+    def __init__(self, sync_workers=ASYNC_SYNC_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=sync_workers,
+                                            thread_name_prefix="async-sync")
+        self.in_flight = 0
+        self.processed = 0
+        self.async_commands = 0
+
+    async def process_update(self, update):
+        self.in_flight += 1
+        try:
+            message = update.get('message')
+            if message:
+                command, args = extract_command(message.get('text', ''))
+                if command and router.is_async(command):
+                    self.async_commands += 1
+                    return await self._run_command(command, args, message)
+
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor,
+                                              bot_handlers.process_update,
+                                              update)
+        except Exception as e:
+            logger.error("Error processing update: %s", e)
+            return None
+        finally:
+            self.in_flight -= 1
+            self.processed += 1
+
+    async def process_update_for_webhook(self, update):
+        """Process a simple command and return its reply as a response body"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, bot_handlers.process_update_for_webhook, update)
+
+    async def is_duplicate(self, update):
+        # The shared check writes to the database, so keep it off the loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor,
+                                          update_dedupe.is_duplicate, update)
+
+    async def _run_command(self, command, args, message):
+        chat_id = message.get('chat', {}).get('id')
+        user_id = message.get('from', {}).get('id')
+        if not chat_id:
+            logger.error("No chat ID found in message")
+            return None
+
+        logger.info("Received command /%s from user %s", command, user_id)
+        try:
+            return await router.get(command)(chat_id, user_id, message, args)
+        except Exception as e:
+            logger.error("Error handling command %s: %s", command, e)
+            await reply(
+                chat_id,
+                f"Error processing command /{command}. Please try again later."
+            )
+            return None
+
+    def stats(self):
+        stats = {
+            'pid': os.getpid(),
+            'in_flight': self.in_flight,
+            'processed': self.processed,
+            'async_commands': self.async_commands
+        }
+        client = _clients.get(asyncio.get_running_loop())
+        if client is not None:
+            stats['telegram_requests'] = client.requests
+            stats['telegram_rate_limited'] = client.rate_limited
+        return stats
+
+    async def close(self):
+        self._executor.shutdown(wait=True)
+        client = _clients.get(asyncio.get_running_loop())
+        if client is not None:
+            await client.close()
+
+
+# Background loop for coroutine handlers reached from sync code (the Flask
+# webhook, the update executor, the poller). One per worker process.
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop():
+    global _loop, _loop_pid
+
+    pid = os.getpid()
+    if _loop is None or _loop_pid != pid:
+        with _loop_lock:
+            if _loop is None or _loop_pid != pid:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever,
+                                 name="async-runtime",
+                                 daemon=True).start()
+                _loop = loop
+                _loop_pid = pid
+    return _loop
+
+
+def run_coroutine(coro, timeout=None):
+    """Run `coro` on this process's background loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result(timeout)
+
+
+@atexit.register
+def _shutdown():
+    if _loop is None or _loop_pid != os.getpid():
+        return
+    client = _clients.get(_loop)
+    if client is not None:
+        run_coroutine(client.close(), timeout=5)
+    _loop.call_soon_threadsafe(_loop.stop)
+
+
+def create_app(runtime=None):
+    """aiohttp application serving the Telegram webhook"""
+    if web is None:
+        raise RuntimeError("The async runtime requires aiohttp")
+    runtime = runtime or AsyncRuntime()
+
+    async def webhook(request):
+        # client_max_size answers 413 for bodies over WEBHOOK_MAX_BODY
+        try:
+            view = webhook_ingest.TelegramUpdate(
+                webhook_ingest.parse(await request.read()))
+        except webhook_ingest.IngestError as e:
+            return web.json_response({
+                'status': 'error',
+                'message': e.message
+            }, status=e.status)
+        update = view.update
+        if await runtime.is_duplicate(update):
+            return web.json_response({'status': 'duplicate'})
+        # An inline reply would overtake replies still queued for the chat
+        if (WEBHOOK_REPLY and bot_handlers.wants_webhook_reply(view.text)
+                and not outbound.has_pending(view.chat_id)):
+            body = await runtime.process_update_for_webhook(update)
+            if body is not None:
+                return web.Response(body=body,
+                                    content_type='application/json')
+            return web.json_response({'status': 'success'})
+        await runtime.process_update(update)
+        return web.json_response({'status': 'success'})
+
+    async def runtime_stats(request):
+        return web.json_response(runtime.stats())
+
+    async def start_background(app):
+        # The Flask app's startup path: migrations, feature detection, and
+        # the outbox worker that delivers the invites this runtime queues.
+        # Importing app also registers the outbox job handlers.
+        import app as flask_app
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, flask_app.start_background)
+
+    async def stop_background(app):
+        import app as flask_app
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, flask_app.stop_background)
+
+    async def close_runtime(app):
+        await runtime.close()
+
+    app = web.Application(client_max_size=WEBHOOK_MAX_BODY)
+    app.router.add_post(WEBHOOK_URL_PATH, webhook)
+    app.router.add_get('/async_stats', runtime_stats)
+    app.on_startup.append(start_background)
+    app.on_cleanup.append(stop_background)
+    app.on_cleanup.append(close_runtime)
+    return app
+
+
+if __name__ == '__main__':
+    configure_logging()
+    web.run_app(create_app(), port=ASYNC_PORT)
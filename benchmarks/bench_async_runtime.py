@@ -0,0 +1,154 @@
+"""Compare the Flask sync webhook path with the asyncio runtime.
+
+Usage: python benchmarks/bench_async_runtime.py [--updates 500] [--latency 0.05]
+                                                [--threads 8] [--concurrency 500]
+
+Starts a fake Bot API on localhost that answers sendMessage after `latency`
+seconds. The sync scenario posts updates to the Flask webhook from
+`threads` request threads (like a gunicorn gthread worker), with a handler
+that sends its reply inline. The async scenario feeds the same updates to
+one AsyncRuntime with `concurrency` in flight and an ``async def`` handler.
+Requires aiohttp.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+PORT = free_port()
+TMP = tempfile.mkdtemp()
+for name, value in (("TELEGRAM_GROUP_ID", "-1"), ("TELEGRAM_BOT_TOKEN",
+                                                   "0:bench"),
+                    ("PAYSTACK_SECRET_KEY", "sk_bench"),
+                    ("TELEGRAM_API_BASE_URL", f"http://127.0.0.1:{PORT}"),
+                    ("DB_PATH", os.path.join(TMP, "bench.db")),
+                    ("UPDATE_WORKERS", "0"), ("INVITE_POOL_ENABLED", "false"),
+                    ("OUTBOUND_GLOBAL_RATE", "1000000")):
+    os.environ.setdefault(name, value)
+
+
+def start_fake_telegram(latency):
+    """Serve a minimal Bot API on PORT from a background event loop"""
+
+    async def method(request):
+        await asyncio.sleep(latency)
+        return web.json_response({'ok': True, 'result': {}})
+
+    app = web.Application()
+    app.router.add_post('/{token}/{method}', method)
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    async def serve():
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', PORT).start()
+        ready.set()
+
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(serve(), loop)
+    ready.wait()
+
+
+def update(i, command):
+    return {
+        'update_id': i,
+        'message': {
+            'message_id': i,
+            'chat': {'id': 1000 + i},
+            'from': {'id': 1000 + i, 'first_name': 'Bench'},
+            'text': f"/{command}"
+        }
+    }
+
+
+def report(label, elapsed, latencies):
+    latencies.sort()
+    n = len(latencies)
+    p50 = latencies[n // 2] * 1000
+    p99 = latencies[min(int(n * 0.99), n - 1)] * 1000
+    print(f"{label:<22} {n / elapsed:>8.0f} updates/s   "
+          f"p50 {p50:8.1f} ms  p99 {p99:8.1f} ms   "
+          f"threads {threading.active_count()}")
+
+
+def run_sync(updates, threads):
+    import app
+    client = app.app.test_client()
+    latencies = []
+
+    def post(u):
+        start = time.perf_counter()
+        client.post(app.WEBHOOK_URL_PATH, json=u)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(post, [update(i, 'bench_sync') for i in range(updates)]))
+    report(f"flask sync ({threads} thr)", time.perf_counter() - start,
+           latencies)
+
+
+async def run_async(updates, concurrency):
+    import async_runtime
+    runtime = async_runtime.AsyncRuntime()
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def process(u):
+        async with limit:
+            start = time.perf_counter()
+            await runtime.process_update(u)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(process(update(i, 'bench_async')) for i in range(updates)))
+    report(f"asyncio ({concurrency} in flight)", time.perf_counter() - start,
+           latencies)
+    await runtime.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=500)
+    args = parser.parse_args()
+
+    start_fake_telegram(args.latency)
+
+    import async_runtime
+    from bot_handlers import router, send_telegram_message
+
+    @router.command('bench_sync')
+    def bench_sync(chat_id, user_id, message, args=''):
+        send_telegram_message(chat_id, "pong")
+
+    @router.command('bench_async')
+    async def bench_async(chat_id, user_id, message, args=''):
+        await async_runtime.reply(chat_id, "pong")
+
+    run_sync(args.updates, args.threads)
+    asyncio.run(run_async(args.updates, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""Time a broadcast against a local fake Bot API, with a restart halfway.
+
+Usage: python benchmarks/bench_broadcast.py [--recipients 20000] [--rate 1000]
+                                            [--workers 32] [--latency 0.02]
+                                            [--blocked-every 50]
+                                            [--rate-429 0.001]
+
+Runs against a throwaway database holding one payment per recipient chat,
+with an embedded fake Bot API (benchmarks/fake_telegram.py) that answers
+403 for every --blocked-every'th chat. The runner is stopped once half the
+chats are handled and a fresh one resumes the broadcast from its
+checkpoint. Reports throughput, the time the same broadcast would take at
+Telegram's 30 messages per second, and how many chats got the message twice
+because of the restart (at most one batch).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegram  # noqa: E402
+
+TELEGRAM_RATE = 30
+
+
+class BroadcastTelegram(FakeTelegram):
+    """Fake Bot API counting messages per chat, with some chats blocked"""
+
+    def __init__(self, blocked_every=0, **kwargs):
+        super().__init__(**kwargs)
+        self.blocked_every = blocked_every
+        self.received = Counter()
+
+    def respond(self, method, payload):
+        if method != 'sendMessage':
+            return super().respond(method, payload)
+        chat_id = int(payload['chat_id'])
+        if self.blocked_every and chat_id % self.blocked_every == 0:
+            status, body = 403, {
+                'ok': False,
+                'error_code': 403,
+                'description': 'Forbidden: bot was blocked by the user'
+            }
+            time.sleep(self.latency)
+        else:
+            status, body = super().respond(method, payload)
+        if status != 429:
+            with self._lock:
+                self.received[chat_id] += 1
+        return status, body
+
+
+def payment(i):
+    return {
+        'reference': f"BCAST{i}",
+        'status': 'success',
+        'amount': 5000,
+        'paid_at': '2025-05-17T17:44:29.000Z',
+        'customer': {
+            'email': f"user{i}@example.com"
+        },
+        'metadata': {
+            'custom_fields': [{
+                'variable_name': 'chat_id',
+                'value': str(100000 + i)
+            }]
+        }
+    }
+
+
+def wait_for(predicate, interval=0.1):
+    while not predicate():
+        time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipients', type=int, default=20000)
+    parser.add_argument('--rate', type=float, default=1000)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--blocked-every', type=int, default=50)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = BroadcastTelegram(blocked_every=args.blocked_every,
+                             latency=args.latency,
+                             rate_429=args.rate_429).start()
+    tmp = tempfile.mkdtemp(prefix="bench-broadcast-")
+    os.environ.update({
+        "TELEGRAM_GROUP_ID": "-1",
+        "TELEGRAM_BOT_TOKEN": "0:bench",
+        "PAYSTACK_SECRET_KEY": "sk_bench",
+        "TELEGRAM_API_BASE_URL": fake.url,
+        "TELEGRAM_POOL_SIZE": str(args.workers),
+        "OUTBOUND_GLOBAL_RATE": str(args.rate),
+        "DB_PATH": os.path.join(tmp, "payments.db"),
+        "METRICS_DIR": os.path.join(tmp, "metrics"),
+        "LOG_LEVEL": "WARNING",
+    })
+
+    import broadcast
+    import migrations
+    import storage
+
+    conn = storage.get_connection()
+    migrations.migrate(conn)
+    storage.detect_features(conn)
+    with conn:
+        storage.insert_payments(conn,
+                                [payment(i) for i in range(args.recipients)])
+    # A second payment from some chats must not make them a second recipient
+    with conn:
+        storage.insert_payments(conn, [
+            dict(payment(i), reference=f"BCAST{i}-again")
+            for i in range(0, args.recipients, 10)
+        ])
+
+    def make_runner():
+        return broadcast.BroadcastRunner(poll_interval=0.2,
+                                         rate=args.rate,
+                                         workers=args.workers,
+                                         batch_size=args.batch_size)
+
+    def state():
+        return broadcast.progress(broadcast.get_broadcast(conn,
+                                                          broadcast_id))
+
+    broadcast_id, total = broadcast.create_broadcast(
+        conn, "Benchmark announcement")
+    start = time.perf_counter()
+    runner = make_runner()
+    runner.start()
+    wait_for(lambda: state()['handled'] >= total // 2)
+    runner.stop(timeout=60)
+    stopped_at = state()['handled']
+
+    runner = make_runner()
+    runner.start()
+    wait_for(lambda: state()['status'] != 'running')
+    elapsed = time.perf_counter() - start
+    runner.stop()
+    fake.stop()
+
+    final = state()
+    duplicates = sum(1 for count in fake.received.values() if count > 1)
+    print(f"recipients          {total}")
+    print(f"restarted at        {stopped_at}")
+    print(f"sent                {final['sent']}")
+    print(f"blocked             {final['blocked']}")
+    print(f"failed              {final['failed']}")
+    print(f"duplicates          {duplicates}")
+    print(f"seconds             {elapsed:.2f}")
+    print(f"messages/s          {total / elapsed:.0f}")
+    print(f"at {TELEGRAM_RATE} msg/s        "
+          f"{total / TELEGRAM_RATE / 60:.1f} min")
+
+    assert final['status'] == 'done', final['status']
+    assert final['handled'] == total, (final['handled'], total)
+    assert len(fake.received) == total, (len(fake.received), total)
+    assert duplicates <= args.batch_size, duplicates
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Time a reconciliation run against a local fake Paystack API.
+
+Usage: python benchmarks/bench_reconcile.py [--transactions 20000]
+                                            [--recorded 0.9] [--latency 0.05]
+                                            [--concurrency 8] [--rate-429 0.01]
+
+Runs against a throwaway migrated database with an embedded fake API
+(benchmarks/fake_paystack.py). A --recorded fraction of the successful
+transactions is inserted first, as if their webhooks had arrived. The first
+run covers the whole window and must recover exactly the rest, with one
+invite job each; the second starts from its checkpoint and must find
+nothing new. Reports pages, transactions and seconds for both.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_paystack import FakePaystack  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--transactions', type=int, default=20000)
+    parser.add_argument('--recorded', type=float, default=0.9)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = FakePaystack(transactions=args.transactions,
+                        latency=args.latency,
+                        rate_429=args.rate_429).start()
+    tmp = tempfile.mkdtemp(prefix="bench-reconcile-")
+    os.environ.update({
+        "TELEGRAM_GROUP_ID": "-1",
+        "TELEGRAM_BOT_TOKEN": "0:bench",
+        "PAYSTACK_SECRET_KEY": "sk_bench",
+        "PAYSTACK_API_BASE_URL": fake.url,
+        "RECONCILE_CONCURRENCY": str(args.concurrency),
+        "DB_PATH": os.path.join(tmp, "payments.db"),
+        "METRICS_DIR": os.path.join(tmp, "metrics"),
+    })
+
+    import migrations
+    import outbox
+    import reconcile
+    import storage
+
+    conn = storage.get_connection()
+    migrations.migrate(conn)
+    storage.detect_features(conn)
+
+    successful = [t for t in fake.transactions if t['status'] == 'success']
+    recorded = successful[:int(len(successful) * args.recorded)]
+    with conn:
+        storage.insert_payments(conn,
+                                [reconcile.payment_data(t) for t in recorded])
+    expected = len(successful) - len(recorded)
+
+    print(f"{'run':<13}{'pages':>7}{'transactions':>14}{'inserted':>10}"
+          f"{'seconds':>9}")
+    first = reconcile.reconcile(since=0)
+    second = reconcile.reconcile()
+    for label, stats in (('full', first), ('incremental', second)):
+        print(f"{label:<13}{stats['pages']:>7}{stats['transactions']:>14}"
+              f"{stats['inserted']:>10}{stats['seconds']:>9.2f}")
+    fake.stop()
+
+    count = conn.execute("SELECT COUNT(*) FROM payments").fetchone()[0]
+    jobs = outbox.outbox_stats(conn)['pending']
+    assert first['inserted'] == expected, (first['inserted'], expected)
+    assert first['invites_queued'] == expected, first['invites_queued']
+    assert second['inserted'] == 0, second['inserted']
+    assert count == len(successful), (count, len(successful))
+    assert jobs == expected, (jobs, expected)
+    print(f"{expected} payments recovered, {jobs} invite jobs queued, "
+          f"{len(successful)} payments recorded")
+
+
+if __name__ == '__main__':
+    main()
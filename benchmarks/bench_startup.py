@@ -0,0 +1,133 @@
+"""Measure cold start: from importing the app to its first response.
+
+Usage: python benchmarks/bench_startup.py [--runs 5]
+
+Every run is a fresh interpreter against a throwaway database:
+
+  eager         importing main runs init_db; the first request starts the
+                background threads
+  lazy          LAZY_INIT=true; the first request does both
+  preload-fork  a parent imports, migrates and warms up once, then forks, as
+                gunicorn --preload does; timed in the child from the fork
+
+Each mode runs on a fresh database, which needs the schema migrations, and
+on an already migrated one, which only needs the version check. Reports the
+median time to import and to the first response, in milliseconds.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMP = tempfile.mkdtemp(prefix="bench-startup-")
+
+MODES = ('eager', 'lazy', 'preload-fork')
+
+
+def child_env(mode, db_path):
+    env = dict(os.environ)
+    env.update({
+        "TELEGRAM_GROUP_ID": "-1",
+        "TELEGRAM_BOT_TOKEN": "0:bench",
+        "PAYSTACK_SECRET_KEY": "sk_bench",
+        # Nothing listens there; the benchmark must not reach Telegram
+        "TELEGRAM_API_BASE_URL": "http://127.0.0.1:9",
+        "INVITE_POOL_ENABLED": "false",
+        "DB_PATH": db_path,
+        "METRICS_DIR": os.path.join(TMP, "metrics"),
+        "LOG_LEVEL": "WARNING",
+        "LAZY_INIT": "false" if mode == 'eager' else "true",
+        "PYTHONPATH": ROOT,
+    })
+    return env
+
+
+def first_response(app_module):
+    response = app_module.app.test_client().get('/')
+    assert response.status_code == 200, response.status_code
+
+
+def run_child(mode):
+    """Runs inside the measured interpreter; prints one JSON result line"""
+    if mode != 'preload-fork':
+        start = time.perf_counter()
+        import main  # noqa: F401
+        import app
+        imported = time.perf_counter()
+        first_response(app)
+        done = time.perf_counter()
+        result = {'import_ms': (imported - start) * 1000,
+                  'first_response_ms': (done - start) * 1000}
+        print(json.dumps(result), flush=True)
+        return
+
+    import main  # noqa: F401
+    import app
+    app.init_db()
+    app.warm_up()
+    app.storage.close_connection()
+
+    read_fd, write_fd = os.pipe()
+    start = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        first_response(app)
+        done = time.perf_counter()
+        os.write(write_fd, json.dumps({
+            'import_ms': 0.0,
+            'first_response_ms': (done - start) * 1000
+        }).encode())
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as pipe:
+        print(pipe.read(), flush=True)
+    os.waitpid(pid, 0)
+
+
+def measure(mode, db_path):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', mode],
+        env=child_env(mode, db_path),
+        capture_output=True,
+        text=True,
+        check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    migrated_db = os.path.join(TMP, "migrated.db")
+    measure('eager', migrated_db)
+
+    print(f"{'mode':<14}{'database':<10}{'import ms':>11}"
+          f"{'first response ms':>20}")
+    for mode in MODES:
+        for database in ('fresh', 'migrated'):
+            results = []
+            for i in range(args.runs):
+                db_path = (os.path.join(TMP, f"{mode}-{i}.db")
+                           if database == 'fresh' else migrated_db)
+                results.append(measure(mode, db_path))
+            import_ms = statistics.median(r['import_ms'] for r in results)
+            first_ms = statistics.median(r['first_response_ms']
+                                         for r in results)
+            print(f"{mode:<14}{database:<10}{import_ms:>11.1f}"
+                  f"{first_ms:>20.1f}")
+
+
+if __name__ == '__main__':
+    main()
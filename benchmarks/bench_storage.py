@@ -0,0 +1,126 @@
+"""Compare connect-per-call SQLite access with the pooled storage layer.
+
+Usage: python benchmarks/bench_storage.py [--rows 2000] [--readers 2]
+
+Runs against a throwaway database in a temp directory. Each scenario inserts
+payments the way the webhook does while reader threads run the dashboard's
+list query, and reports write throughput and read latency.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+for name, value in (("TELEGRAM_GROUP_ID", "-1"), ("TELEGRAM_BOT_TOKEN",
+                                                   "0:bench"),
+                    ("PAYSTACK_SECRET_KEY", "sk_bench")):
+    os.environ.setdefault(name, value)
+
+import storage  # noqa: E402
+
+LIST_QUERY = """
+    SELECT id, reference, status, amount, email, full_name, paid_at, chat_id, invite_link
+    FROM payments ORDER BY id DESC LIMIT 50
+"""
+
+
+def payment(i):
+    return {
+        'reference': f"BENCH{i}",
+        'status': 'success',
+        'amount': 5000,
+        'paid_at': '2025-05-17T17:44:29.000Z',
+        'customer': {
+            'email': f"user{i}@example.com"
+        },
+        'metadata': {
+            'custom_fields': [{
+                'variable_name': 'full_name',
+                'value': f"User {i}"
+            }, {
+                'variable_name': 'chat_id',
+                'value': str(i)
+            }]
+        }
+    }
+
+
+def legacy_insert(db_path, data):
+    with sqlite3.connect(db_path) as conn:
+        storage.insert_payment(conn, data)
+        conn.commit()
+
+
+def legacy_read(db_path):
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(LIST_QUERY).fetchall()
+
+
+def pooled_insert(db_path, data):
+    conn = storage.get_connection(db_path)
+    with conn:
+        storage.insert_payment(conn, data)
+
+
+def pooled_read(db_path):
+    storage.get_connection(db_path).execute(LIST_QUERY).fetchall()
+
+
+def run(label, db_path, insert, read, rows, readers):
+    conn = sqlite3.connect(db_path)
+    storage.init_schema(conn)
+    conn.commit()
+    conn.close()
+
+    stop = threading.Event()
+    read_times = []
+
+    def reader():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                read(db_path)
+            except sqlite3.OperationalError:
+                continue
+            read_times.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    for t in threads:
+        t.start()
+
+    start = time.perf_counter()
+    for i in range(rows):
+        insert(db_path, payment(i))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    for t in threads:
+        t.join()
+
+    read_times.sort()
+    p50 = read_times[len(read_times) // 2] * 1000 if read_times else 0
+    p99 = read_times[int(len(read_times) * 0.99)] * 1000 if read_times else 0
+    print(f"{label:<18} {rows / elapsed:>10.0f} writes/s   "
+          f"reads {len(read_times):>7}  p50 {p50:6.2f} ms  p99 {p99:6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--readers', type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        run("connect-per-call", os.path.join(tmp, "legacy.db"), legacy_insert,
+            legacy_read, args.rows, args.readers)
+        run("pooled (WAL)", os.path.join(tmp, "pooled.db"), pooled_insert,
+            pooled_read, args.rows, args.readers)
+
+
+if __name__ == '__main__':
+    main()
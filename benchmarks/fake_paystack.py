@@ -0,0 +1,214 @@
+"""Local stand-in for Paystack's transaction list API, for benchmarks.
+
+Usage: python benchmarks/fake_paystack.py [--port 8098] [--transactions 20000]
+                                          [--latency 0.05] [--rate-429 0.01]
+
+Point the app at it with PAYSTACK_API_BASE_URL=http://127.0.0.1:<port>.
+GET /transaction serves `transactions` deterministic transactions created
+evenly over the last `span` seconds, newest first, filtered by status, from
+and to and paged with page and perPage like the real API. Every tenth one
+failed, and every other one carries its metadata as a JSON string, as
+transactions created from the dashboard do. A `rate_429` fraction of calls
+gets a 429 with Retry-After. Call counts are printed on exit and are
+available from ``FakePaystack.stats()`` when it is embedded.
+"""
+import argparse
+import bisect
+import json
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+def transaction(i, created):
+    status = 'failed' if i % 10 == 9 else 'success'
+    metadata = {
+        'custom_fields': [{
+            'display_name': 'Full Name',
+            'variable_name': 'full_name',
+            'value': f"Customer {i}"
+        }, {
+            'display_name': 'Chat ID',
+            'variable_name': 'chat_id',
+            'value': str(100000 + i)
+        }]
+    }
+    when = datetime.fromtimestamp(created, timezone.utc).strftime(
+        '%Y-%m-%dT%H:%M:%S.000Z')
+    return {
+        'id': 1000000 + i,
+        'status': status,
+        'reference': f"FAKE{i:08d}",
+        'amount': 5000 + (i % 7) * 100,
+        'currency': 'NGN',
+        'paid_at': when if status == 'success' else None,
+        'paidAt': when if status == 'success' else None,
+        'created_at': when,
+        'createdAt': when,
+        'channel': 'card',
+        'metadata': json.dumps(metadata) if i % 2 else metadata,
+        'customer': {
+            'id': 2000000 + i,
+            'email': f"customer{i}@example.com"
+        }
+    }
+
+
+def parse_time(value, default):
+    if not value:
+        return default
+    return datetime.fromisoformat(value).timestamp()
+
+
+class FakePaystack:
+
+    def __init__(self,
+                 host='127.0.0.1',
+                 port=0,
+                 transactions=20000,
+                 span=7 * 86400,
+                 secret_key='sk_bench',
+                 latency=0.05,
+                 jitter=0.0,
+                 rate_429=0.0,
+                 retry_after=1):
+        self.secret_key = secret_key
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+        # Oldest first, so a from/to window is a bisect away
+        end = int(time.time()) - 60
+        step = span / max(transactions, 1)
+        self.transactions = [
+            transaction(i, end - span + i * step) for i in range(transactions)
+        ]
+        self._created = [end - span + i * step for i in range(transactions)]
+
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                status, body, headers = fake.respond(
+                    url.path, query, self.headers.get('Authorization'))
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def respond(self, path, query, authorization):
+        time.sleep(self.latency + random.random() * self.jitter)
+        with self._lock:
+            self.calls[path] += 1
+            limited = self.rate_429 and random.random() < self.rate_429
+            if limited:
+                self.calls['rate_limited'] += 1
+        if authorization != f"Bearer {self.secret_key}":
+            return 401, {'status': False, 'message': 'Invalid key'}, {}
+        if limited:
+            return 429, {
+                'status': False,
+                'message': 'Too many requests'
+            }, {
+                'Retry-After': str(self.retry_after)
+            }
+        if path.rstrip('/') != '/transaction':
+            return 404, {'status': False, 'message': 'Not found'}, {}
+
+        since = parse_time(query.get('from'), float('-inf'))
+        until = parse_time(query.get('to'), float('inf'))
+        lo = bisect.bisect_left(self._created, since)
+        hi = bisect.bisect_right(self._created, until)
+        matches = self.transactions[lo:hi]
+        if query.get('status'):
+            matches = [t for t in matches if t['status'] == query['status']]
+        matches.reverse()
+
+        per_page = int(query.get('perPage') or 50)
+        page = int(query.get('page') or 1)
+        page_count = max((len(matches) + per_page - 1) // per_page, 1)
+        return 200, {
+            'status': True,
+            'message': 'Transactions retrieved',
+            'data': matches[(page - 1) * per_page:page * per_page],
+            'meta': {
+                'total': len(matches),
+                'perPage': per_page,
+                'page': page,
+                'pageCount': page_count
+            }
+        }, {}
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever,
+                         name="fake-paystack",
+                         daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {'calls': dict(self.calls)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8098)
+    parser.add_argument('--transactions', type=int, default=20000)
+    parser.add_argument('--secret-key', default='sk_bench')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+
+    fake = FakePaystack(port=args.port,
+                        transactions=args.transactions,
+                        secret_key=args.secret_key,
+                        latency=args.latency,
+                        jitter=args.jitter,
+                        rate_429=args.rate_429,
+                        retry_after=args.retry_after).start()
+    print(f"Fake Paystack API listening on {fake.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(json.dumps(fake.stats(), indent=2))
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""Local stand-in for the Telegram Bot API, for benchmarks and load tests.
+
+Usage: python benchmarks/fake_telegram.py [--port 8099] [--latency 0.05]
+                                          [--rate-429 0.01] [--retry-after 1]
+
+Point the app at it with TELEGRAM_API_BASE_URL=http://127.0.0.1:<port>.
+Every method answers after `latency` seconds (plus up to `jitter`). A
+`rate_429` fraction of calls gets a 429 with `retry_after`.
+createChatInviteLink returns a unique link per call. Per-method call
+counts are printed on exit and are available from ``FakeTelegram.stats()``
+when it is embedded.
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeTelegram:
+
+    def __init__(self,
+                 host='127.0.0.1',
+                 port=0,
+                 latency=0.05,
+                 jitter=0.0,
+                 rate_429=0.0,
+                 retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.rate_limited = Counter()
+        self._links = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                try:
+                    payload = json.loads(raw) if raw else {}
+                except ValueError:
+                    payload = {}
+                method = self.path.split('?', 1)[0].rsplit('/', 1)[-1]
+                status, body = fake.respond(method, payload)
+                self._send(status, body)
+
+            do_GET = do_POST
+
+        return Handler
+
+    def respond(self, method, payload):
+        time.sleep(self.latency + random.random() * self.jitter)
+        with self._lock:
+            self.calls[method] += 1
+            limited = self.rate_429 and random.random() < self.rate_429
+            if limited:
+                self.rate_limited[method] += 1
+        if limited:
+            return 429, {
+                'ok': False,
+                'error_code': 429,
+                'description':
+                f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {
+                    'retry_after': self.retry_after
+                }
+            }
+
+        if method == 'createChatInviteLink':
+            result = {
+                'invite_link': f"https://t.me/+fake{next(self._links)}",
+                'creates_join_request': payload.get('creates_join_request',
+                                                    False),
+                'expire_date': payload.get('expire_date'),
+                'is_revoked': False
+            }
+        elif method == 'getUpdates':
+            result = []
+        elif method in ('sendMessage', 'editMessageText'):
+            result = {
+                'message_id': random.randint(1, 2**31),
+                'chat': {
+                    'id': payload.get('chat_id')
+                },
+                'text': payload.get('text')
+            }
+        elif method == 'getWebhookInfo':
+            result = {'url': '', 'pending_update_count': 0}
+        else:
+            result = True
+        return 200, {'ok': True, 'result': result}
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever,
+                         name="fake-telegram",
+                         daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': dict(self.calls),
+                'rate_limited': dict(self.rate_limited)
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+
+    fake = FakeTelegram(port=args.port,
+                        latency=args.latency,
+                        jitter=args.jitter,
+                        rate_429=args.rate_429,
+                        retry_after=args.retry_after).start()
+    print(f"Fake Bot API listening on {fake.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(json.dumps(fake.stats(), indent=2))
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,385 @@
+"""Replay synthetic Telegram updates and signed Paystack webhooks against the app.
+
+Usage: python benchmarks/load_test.py [--duration 10] [--rate 50] [--concurrency 16]
+                                      [--latency 0.05] [--rate-429 0.01]
+                                      [--duplicates 0.1] [--target URL]
+                                      [--save-baseline NAME] [--compare NAME]
+
+By default the app runs in-process on a threaded WSGI server, with a
+throwaway database and an embedded fake Bot API (benchmarks/fake_telegram.py).
+To load an app that is already running, start it with TELEGRAM_API_BASE_URL
+pointing at a standalone fake_telegram.py, then pass --target along with
+--bot-token and --paystack-key matching its environment.
+
+The mix is commands, plain text, media and callback queries to the
+Telegram webhook, plus HMAC-signed charge.success events to
+/payment_webhook. A --duplicates fraction of requests resends an earlier
+body unchanged, the way Telegram and Paystack retry. Requests go out at
+--rate per second. The report shows throughput and p50/p95/p99 per route.
+Any response other than 2xx counts as an error. --save-baseline stores the
+results in benchmarks/baselines.json, and --compare exits non-zero if a
+route is slower than the named baseline by more than --tolerance, has more
+errors, or answers with a status mix the baseline did not have.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegram  # noqa: E402
+
+BASELINES_PATH = os.path.join(ROOT, 'benchmarks', 'baselines.json')
+
+COMMANDS = ('/start', '/help', '/status', '/info')
+MEDIA = ('photo', 'document', 'voice', 'sticker')
+
+# Share of requests per kind of traffic
+MIX = (('command', 40), ('text', 20), ('media', 10), ('callback', 10),
+       ('payment', 20))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class TrafficGenerator:
+    """Builds request bodies; duplicates resend an earlier body verbatim"""
+
+    def __init__(self, bot_token, paystack_key, duplicates, seed=None):
+        self.webhook_path = f"/webhook/{bot_token}"
+        self.paystack_key = paystack_key.encode()
+        self.duplicates = duplicates
+        self.random = random.Random(seed)
+        self.run_id = f"{int(time.time())}{self.random.randrange(1000)}"
+        self.sent = []
+        self._update_id = 0
+        self._kinds = [kind for kind, weight in MIX for _ in range(weight)]
+
+    def _message(self, chat_id, **fields):
+        self._update_id += 1
+        message = {
+            'message_id': self._update_id,
+            'date': int(time.time()),
+            'chat': {
+                'id': chat_id,
+                'type': 'private'
+            },
+            'from': {
+                'id': chat_id,
+                'first_name': f"Load{chat_id}"
+            }
+        }
+        message.update(fields)
+        return {'update_id': self._update_id, 'message': message}
+
+    def _telegram(self, kind, chat_id):
+        if kind == 'command':
+            return self._message(chat_id, text=self.random.choice(COMMANDS))
+        if kind == 'text':
+            return self._message(chat_id, text="hello there")
+        if kind == 'media':
+            return self._message(chat_id,
+                                 **{self.random.choice(MEDIA): {
+                                     'file_id': 'x'
+                                 }})
+        self._update_id += 1
+        return {
+            'update_id': self._update_id,
+            'callback_query': {
+                'id': str(self._update_id),
+                'from': {
+                    'id': chat_id
+                },
+                'message': {
+                    'message_id': 1,
+                    'chat': {
+                        'id': chat_id
+                    }
+                },
+                'data': 'option_a'
+            }
+        }
+
+    def _payment(self, chat_id):
+        self._update_id += 1
+        return {
+            'event': 'charge.success',
+            'data': {
+                'reference': f"LOAD-{self.run_id}-{self._update_id}",
+                'status': 'success',
+                'amount': self.random.choice((5000, 10000, 25000)),
+                'paid_at': datetime.now(timezone.utc).isoformat(),
+                'customer': {
+                    'email': f"load{chat_id}@example.com"
+                },
+                'metadata': {
+                    'custom_fields': [{
+                        'variable_name': 'full_name',
+                        'value': f"Load {chat_id}"
+                    }, {
+                        'variable_name': 'chat_id',
+                        'value': str(chat_id)
+                    }]
+                }
+            }
+        }
+
+    def next_request(self):
+        """Return (route, path, body, headers) for the next request"""
+        if self.sent and self.random.random() < self.duplicates:
+            route, path, body, headers = self.random.choice(self.sent)
+            return f"{route} (dup)", path, body, headers
+
+        kind = self.random.choice(self._kinds)
+        chat_id = self.random.randint(100000, 100999)
+        if kind == 'payment':
+            body = json.dumps(self._payment(chat_id)).encode()
+            signature = hmac.new(self.paystack_key, body,
+                                 hashlib.sha512).hexdigest()
+            request = ('payment_webhook', '/payment_webhook', body, {
+                'Content-Type': 'application/json',
+                'X-Paystack-Signature': signature
+            })
+        else:
+            body = json.dumps(self._telegram(kind, chat_id)).encode()
+            request = ('telegram_webhook', self.webhook_path, body, {
+                'Content-Type': 'application/json'
+            })
+        self.sent.append(request)
+        if len(self.sent) > 1000:
+            self.sent = self.sent[-500:]
+        return request
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def run_load(base_url, generator, rate, duration, concurrency):
+    local = threading.local()
+    results = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    lock = threading.Lock()
+
+    def send(route, path, body, headers):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            status = session.post(base_url + path,
+                                  data=body,
+                                  headers=headers,
+                                  timeout=30).status_code
+        except requests.RequestException:
+            status = 'error'
+        elapsed = time.perf_counter() - start
+        with lock:
+            results[route].append(elapsed)
+            statuses[route][status] += 1
+
+    total = int(rate * duration)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i in range(total):
+            # Open loop: requests go out on schedule even if earlier ones
+            # are still waiting
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, *generator.next_request())
+    elapsed = time.perf_counter() - started
+
+    report = {}
+    for route, latencies in sorted(results.items()):
+        latencies.sort()
+        codes = statuses[route]
+        report[route] = {
+            'requests': len(latencies),
+            'rps': round(len(latencies) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            # Every route answers 200 when the app is healthy, so a 4xx
+            # from a misconfigured run counts as much as a 5xx
+            'errors': sum(n for code, n in codes.items()
+                          if code == 'error' or not 200 <= code < 300),
+            'statuses': {str(code): n for code, n in sorted(codes.items(),
+                                                             key=str)}
+        }
+    return report
+
+
+def print_report(report):
+    print(f"{'route':<26} {'reqs':>6} {'req/s':>8} {'p50 ms':>8} "
+          f"{'p95 ms':>8} {'p99 ms':>8} {'errors':>7}  statuses")
+    for route, r in report.items():
+        print(f"{route:<26} {r['requests']:>6} {r['rps']:>8.1f} "
+              f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+              f"{r['errors']:>7}  {r['statuses']}")
+
+
+def load_baselines():
+    try:
+        with open(BASELINES_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(name, report, params):
+    baselines = load_baselines()
+    baselines[name] = {
+        'recorded': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'params': params,
+        'routes': {
+            route: {k: r[k]
+                    for k in ('rps', 'p50_ms', 'p95_ms', 'p99_ms', 'errors',
+                              'statuses')}
+            for route, r in report.items()
+        }
+    }
+    with open(BASELINES_PATH, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+    print(f"Saved baseline '{name}' to {BASELINES_PATH}")
+
+
+def compare(name, report, tolerance):
+    """Print regressions against a stored baseline; True if there are none"""
+    baseline = load_baselines().get(name)
+    if baseline is None:
+        print(f"No baseline named '{name}' in {BASELINES_PATH}")
+        return False
+
+    ok = True
+    for route, base in baseline['routes'].items():
+        current = report.get(route)
+        if current is None:
+            ok = False
+            print(f"REGRESSION {route}: no requests in this run")
+            continue
+        for key in ('p95_ms', 'p99_ms'):
+            # Ignore sub-millisecond noise on very fast routes
+            limit = max(base[key] * (1 + tolerance), base[key] + 1.0)
+            if current[key] > limit:
+                ok = False
+                print(f"REGRESSION {route} {key}: {current[key]} ms "
+                      f"(baseline {base[key]} ms)")
+        if current['errors'] > base['errors']:
+            ok = False
+            print(f"REGRESSION {route} errors: {current['errors']} "
+                  f"(baseline {base['errors']})")
+        if 'statuses' in base:
+            # Flag any status whose share of the route's responses grew by
+            # more than a point, including codes the baseline never saw
+            base_total = sum(base['statuses'].values()) or 1
+            total = sum(current['statuses'].values()) or 1
+            for code, count in current['statuses'].items():
+                share = count / total
+                base_share = base['statuses'].get(code, 0) / base_total
+                if share > base_share + 0.01:
+                    ok = False
+                    print(f"REGRESSION {route} status {code}: "
+                          f"{share:.1%} of responses "
+                          f"(baseline {base_share:.1%})")
+    if ok:
+        print(f"No regressions against baseline '{name}'")
+    return ok
+
+
+def start_app(fake_url, bot_token, paystack_key):
+    """Import the app against a throwaway database and serve it on a thread"""
+    tmp = tempfile.mkdtemp(prefix="load-test-")
+    for name, value in (("TELEGRAM_GROUP_ID", "-1001"),
+                        ("TELEGRAM_BOT_TOKEN", bot_token),
+                        ("PAYSTACK_SECRET_KEY", paystack_key),
+                        ("TELEGRAM_API_BASE_URL", fake_url),
+                        ("DB_PATH", os.path.join(tmp, "load.db")),
+                        ("METRICS_DIR", os.path.join(tmp, "metrics")),
+                        ("LOG_LEVEL", "WARNING")):
+        os.environ.setdefault(name, value)
+
+    import logging
+    from werkzeug.serving import make_server
+    import app
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    port = free_port()
+    server = make_server('127.0.0.1', port, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--rate', type=float, default=50)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--rate-429', type=float, default=0.01)
+    parser.add_argument('--duplicates', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--target', help="base URL of a running app")
+    parser.add_argument('--bot-token', default="0:loadtest")
+    parser.add_argument('--paystack-key', default="sk_test_loadtest")
+    parser.add_argument('--save-baseline', metavar='NAME')
+    parser.add_argument('--compare', metavar='NAME')
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    args = parser.parse_args()
+
+    fake = None
+    if args.target:
+        base_url = args.target.rstrip('/')
+    else:
+        fake = FakeTelegram(latency=args.latency,
+                            jitter=args.jitter,
+                            rate_429=args.rate_429).start()
+        base_url = start_app(fake.url, args.bot_token, args.paystack_key)
+
+    generator = TrafficGenerator(args.bot_token, args.paystack_key,
+                                 args.duplicates, args.seed)
+    report = run_load(base_url, generator, args.rate, args.duration,
+                      args.concurrency)
+    print_report(report)
+    if fake is not None:
+        # Let queued replies and invite jobs reach the fake API
+        time.sleep(2)
+        print(f"Bot API calls: {fake.stats()}")
+
+    params = {
+        k: getattr(args, k)
+        for k in ('duration', 'rate', 'concurrency', 'latency', 'rate_429',
+                  'duplicates')
+    }
+    if args.save_baseline:
+        save_baseline(args.save_baseline, report, params)
+    if args.compare and not compare(args.compare, report, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
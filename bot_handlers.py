@@ -1,7 +1,13 @@
 import logging
 import json
-import requests
-from config import BOT_TOKEN, COMMANDS, ADMIN_USER_IDS
+import threading
+import broadcast
+import outbound
+import storage
+import telegram_client
+from command_router import CommandRouter, admin_only, rate_limited
+from config import (COMMANDS, ADMIN_USER_IDS, COMMAND_RATE_LIMIT_INTERVAL,
+                    WEBHOOK_REPLY_COMMANDS)
 
 # Set up logger
 logger = logging.getLogger(__name__)
@@ -10,8 +16,6 @@ logger = logging.getLogger(__name__)
 def send_telegram_message(chat_id, text, parse_mode=None, reply_markup=None):
     """Send a message to Telegram chat"""
     try:
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-
         data = {"chat_id": chat_id, "text": text}
 
         if parse_mode:
@@ -20,25 +24,46 @@ def send_telegram_message(chat_id, text, parse_mode=None, reply_markup=None):
         if reply_markup:
             data['reply_markup'] = json.dumps(reply_markup)
 
-        response = requests.post(url, json=data)
-
-        # Print and log the raw Telegram API response
-        logger.debug(f"Telegram API response status: {response.status_code}")
-        logger.debug(f"Telegram API response body: {response.text}")
-        print(f"Telegram API response status: {response.status_code}")
-        print(f"Telegram API response body: {response.text}")
+        response = telegram_client.call("sendMessage", data)
 
-        if response.status_code == 200 and response.json().get('ok'):
-            logger.debug(f"Message sent successfully to chat {chat_id}")
-            return response.json()
-        else:
-            logger.error(
-                f"Failed to send message to chat {chat_id}: {response.text}")
-            return None
+        if response.status_code == 200:
+            result = response.json()
+            if result.get('ok'):
+                logger.debug("Message sent successfully to chat %s", chat_id)
+                return result
+        logger.error("Failed to send message to chat %s: %s", chat_id,
+                     response.text)
+        return None
     except Exception as e:
-        logger.error(f"Exception while sending message to chat {chat_id}: {e}")
-        print(f"Exception while sending message to chat {chat_id}: {e}")
+        logger.error("Exception while sending message to chat %s: %s",
+                     chat_id, e)
+        return None
+
+
+# Set while process_update_for_webhook runs, to capture the first reply
+_webhook_reply = threading.local()
+
+
+def _webhook_reply_body(chat_id, text, parse_mode=None, reply_markup=None):
+    body = {"method": "sendMessage", "chat_id": chat_id, "text": text}
+    if parse_mode:
+        body['parse_mode'] = parse_mode
+    if reply_markup:
+        body['reply_markup'] = reply_markup
+    return json.dumps(body, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def reply_message(chat_id, text, parse_mode=None, reply_markup=None):
+    """Queue a reply for background delivery, sending inline if the queue is full"""
+    if getattr(_webhook_reply, 'active', False) and _webhook_reply.body is None:
+        _webhook_reply.body = _webhook_reply_body(chat_id, text, parse_mode,
+                                                  reply_markup)
+        return None
+    if outbound.enqueue_message(chat_id, text, parse_mode, reply_markup):
         return None
+    logger.warning("Outbound queue full, sending to chat %s inline", chat_id)
+    return send_telegram_message(chat_id, text, parse_mode, reply_markup)
 
 
 def extract_command(text):
@@ -57,6 +82,39 @@ def extract_command(text):
     return command, args
 
 
+def update_chat_id(update):
+    """Chat an update belongs to, or None for update types without one"""
+    if 'message' in update:
+        return update['message'].get('chat', {}).get('id')
+    if 'callback_query' in update:
+        return update['callback_query'].get('message', {}).get('chat',
+                                                              {}).get('id')
+    return None
+
+
+def wants_webhook_reply(text):
+    """True if message `text` is a command answered in the webhook response"""
+    command, _ = extract_command(text)
+    return command in WEBHOOK_REPLY_COMMANDS and not router.is_async(command)
+
+
+def process_update_for_webhook(update):
+    """Process an update in this thread and return its first reply.
+
+    The reply comes back as a pre-serialized ``sendMessage`` call for the
+    webhook response body, or None if nothing was sent. Any later replies
+    go through the outbound queue as usual.
+    """
+    _webhook_reply.active = True
+    _webhook_reply.body = None
+    try:
+        process_update(update)
+        return _webhook_reply.body
+    finally:
+        _webhook_reply.active = False
+        _webhook_reply.body = None
+
+
 def process_update(update):
     """Process incoming update from Telegram"""
     try:
@@ -65,10 +123,10 @@ def process_update(update):
         elif 'callback_query' in update:
             return process_callback_query(update['callback_query'])
         else:
-            logger.info(f"Received unhandled update type: {update}")
+            logger.info("Received unhandled update type: %s", list(update))
             return None
     except Exception as e:
-        logger.error(f"Error processing update: {e}")
+        logger.error("Error processing update: %s", e)
         return None
 
 
@@ -98,46 +156,38 @@ def process_message(message):
 
         return None
     except Exception as e:
-        logger.error(f"Error processing message: {e}")
+        logger.error("Error processing message: %s", e)
         return None
 
 
 def handle_command(command, args, chat_id, user_id, message):
     """Handle commands received from users"""
     try:
+        handler = router.get(command)
+        if handler is not None:
+            logger.info("Received command /%s from user %s", command, user_id)
+            result = handler(chat_id, user_id, message, args)
+            if router.is_async(command):
+                # Called from a worker thread: run the coroutine on the
+                # shared asyncio runtime loop and wait for it
+                import async_runtime
+                return async_runtime.run_coroutine(result)
+            return result
+
         if command in COMMANDS:
-            logger.info(f"Received command /{command} from user {user_id}")
-
-            # Example admin command check (add broadcast to COMMANDS if you want)
-            if command == 'broadcast' and user_id not in ADMIN_USER_IDS:
-                send_telegram_message(
-                    chat_id,
-                    "Sorry, this command is only available to administrators.")
-                return None
-
-            if command == 'start':
-                return cmd_start(chat_id, user_id, message)
-            elif command == 'help':
-                return cmd_help(chat_id, user_id, message)
-            elif command == 'status':
-                return cmd_status(chat_id, user_id, message)
-            elif command == 'info':
-                return cmd_info(chat_id, user_id, message)
-            else:
-                send_telegram_message(
-                    chat_id,
-                    f"The command /{command} is recognized but not yet implemented."
-                )
-                return None
+            reply_message(
+                chat_id,
+                f"The command /{command} is recognized but not yet implemented."
+            )
         else:
-            send_telegram_message(
+            reply_message(
                 chat_id,
                 f"Sorry, I don't recognize the command /{command}. Type /help to see available commands."
             )
-            return None
+        return None
     except Exception as e:
-        logger.error(f"Error handling command {command}: {e}")
-        send_telegram_message(
+        logger.error("Error handling command %s: %s", command, e)
+        reply_message(
             chat_id,
             f"Error processing command /{command}. Please try again later.")
         return None
@@ -145,9 +195,9 @@ def handle_command(command, args, chat_id, user_id, message):
 
 def handle_regular_message(text, chat_id, user_id, message):
     """Handle regular text messages (not commands)"""
-    logger.info(f"Received message from user {user_id}: {text[:20]}...")
+    logger.info("Received message from user %s", user_id)
 
-    send_telegram_message(
+    reply_message(
         chat_id, "I received your message. Use /help to see what I can do.")
     return None
 
@@ -169,9 +219,9 @@ def handle_media_message(message, chat_id, user_id):
     elif 'sticker' in message:
         media_type = "sticker"
 
-    logger.info(f"Received {media_type} from user {user_id}")
+    logger.info("Received %s from user %s", media_type, user_id)
 
-    send_telegram_message(
+    reply_message(
         chat_id,
         f"I received your {media_type}, but I'm not designed to process media files yet."
     )
@@ -189,25 +239,22 @@ def process_callback_query(callback_query):
             logger.error("Missing data or chat_id in callback query")
             return None
 
-        logger.info(
-            f"Received callback query with data: {callback_data} from user {user_id}"
-        )
+        logger.info("Received callback query with data: %s from user %s",
+                    callback_data, user_id)
 
         answer_callback_query(callback_query.get('id'))
 
-        send_telegram_message(chat_id, f"You selected: {callback_data}")
+        reply_message(chat_id, f"You selected: {callback_data}")
 
         return None
     except Exception as e:
-        logger.error(f"Error processing callback query: {e}")
+        logger.error("Error processing callback query: %s", e)
         return None
 
 
 def answer_callback_query(callback_query_id, text=None, show_alert=False):
     """Answer a callback query to remove the loading indicator"""
     try:
-        url = f'https://api.telegram.org/bot{BOT_TOKEN}/answerCallbackQuery'
-
         data = {'callback_query_id': callback_query_id}
 
         if text:
@@ -216,55 +263,119 @@ def answer_callback_query(callback_query_id, text=None, show_alert=False):
         if show_alert:
             data['show_alert'] = True
 
-        response = requests.post(url, json=data)
+        response = telegram_client.call('answerCallbackQuery', data)
 
         if response.status_code != 200 or not response.json().get('ok'):
-            logger.error(f"Failed to answer callback query: {response.text}")
+            logger.error("Failed to answer callback query: %s", response.text)
     except Exception as e:
-        logger.error(f"Error answering callback query: {e}")
+        logger.error("Error answering callback query: %s", e)
 
 
-# Command handlers
-def cmd_start(chat_id, user_id, message):
-    user_name = message.get('from', {}).get('first_name', 'there')
+# Command registry. reply_message is looked up at call time so /test_bot can
+# swap it out while simulating a message.
+def _reply(chat_id, text, parse_mode=None, reply_markup=None):
+    return reply_message(chat_id, text, parse_mode, reply_markup)
 
-    welcome_text = (f"Hello, {user_name}! 👋\n\n"
-                    f"Welcome to the Telegram Bot. I'm here to assist you.\n\n"
-                    f"Use /help to see available commands.")
 
-    reply_markup = {
-        'keyboard': [['/help', '/status'], ['/info']],
-        'resize_keyboard': True
-    }
+def _deny_non_admin(chat_id):
+    reply_message(chat_id,
+                  "Sorry, this command is only available to administrators.")
 
-    send_telegram_message(chat_id, welcome_text, reply_markup=reply_markup)
 
+def _slow_down(chat_id):
+    logger.info("Rate limited command from chat %s", chat_id)
 
-def cmd_help(chat_id, user_id, message):
-    help_text = "Here are the commands you can use:\n\n"
 
-    for cmd, description in COMMANDS.items():
-        help_text += f"/{cmd} - {description}\n"
+router = CommandRouter(
+    _reply,
+    middleware=[rate_limited(COMMAND_RATE_LIMIT_INTERVAL, _slow_down)]
+    if COMMAND_RATE_LIMIT_INTERVAL > 0 else [])
 
-    send_telegram_message(chat_id, help_text)
+# Attach to admin-only commands, e.g. middleware=[require_admin]
+require_admin = admin_only(ADMIN_USER_IDS, _deny_non_admin)
 
 
-def cmd_status(chat_id, user_id, message):
-    status_text = (
-        "✅ Bot Status: Operational\n\n"
-        "The bot is running normally and ready to process your commands.")
+# Command handlers
+@router.command('start', COMMANDS['start'])
+def cmd_start(chat_id, user_id, message, args=''):
+    user_name = message.get('from', {}).get('first_name', 'there')
 
-    send_telegram_message(chat_id, status_text)
+    welcome_text = (f"Hello, {user_name}! 👋\n\n"
+                    f"Welcome to the Telegram Bot. I'm here to assist you.\n\n"
+                    f"Use /help to see available commands.")
 
+    reply_markup = {
+        'keyboard': [['/help', '/status'], ['/info']],
+        'resize_keyboard': True
+    }
 
-def cmd_info(chat_id, user_id, message):
-    info_text = (
-        "📱 *Telegram Webhook Bot*\n\n"
-        "This bot demonstrates how to create a webhook-based Telegram bot using Flask.\n\n"
-        "Features:\n"
-        "• Processes incoming messages\n"
-        "• Handles commands\n"
-        "• Responds to user interactions\n\n"
-        "Use /help to see available commands.")
+    reply_message(chat_id, welcome_text, reply_markup=reply_markup)
+
+
+@router.command('help', COMMANDS['help'])
+def cmd_help(chat_id, user_id, message, args=''):
+    reply_message(chat_id, router.help_text())
+
+
+router.static(
+    'status', "✅ Bot Status: Operational\n\n"
+    "The bot is running normally and ready to process your commands.",
+    COMMANDS['status'])
+
+router.static('info', "📱 *Telegram Webhook Bot*\n\n"
+              "This bot demonstrates how to create a webhook-based Telegram bot using Flask.\n\n"
+              "Features:\n"
+              "• Processes incoming messages\n"
+              "• Handles commands\n"
+              "• Responds to user interactions\n\n"
+              "Use /help to see available commands.",
+              COMMANDS['info'],
+              parse_mode="Markdown")
+
+
+def _broadcast_summary(progress):
+    summary = (f"Broadcast #{progress['id']} {progress['status']}: "
+               f"{progress['handled']}/{progress['total']} chats "
+               f"({progress['sent']} sent, {progress['blocked']} blocked, "
+               f"{progress['failed']} failed)")
+    if progress['messages_per_second']:
+        summary += f", {progress['messages_per_second']} msg/s"
+    if progress['eta_seconds'] is not None:
+        summary += f", about {progress['eta_seconds'] // 60 + 1} min left"
+    return summary
+
+
+# Admin only and left out of /help
+@router.command('broadcast', middleware=[require_admin])
+def cmd_broadcast(chat_id, user_id, message, args=''):
+    """/broadcast [status=.. start=.. end=.. q=.. parse_mode=..] <message>
+
+    Without arguments reports the latest broadcast; "cancel" stops it.
+    """
+    conn = storage.get_connection()
+    if not args.strip():
+        latest = broadcast.get_broadcast(conn)
+        reply_message(
+            chat_id,
+            _broadcast_summary(broadcast.progress(latest)) if latest else
+            "No broadcasts yet. Usage: /broadcast [status=success] "
+            "[start=YYYY-MM-DD] [end=YYYY-MM-DD] <message>")
+        return
+    if args.strip() == 'cancel':
+        cancelled = broadcast.cancel_broadcast(conn)
+        reply_message(
+            chat_id, f"Broadcast #{cancelled} cancelled."
+            if cancelled else "No broadcast is running.")
+        return
 
-    send_telegram_message(chat_id, info_text, parse_mode="Markdown")
+    try:
+        segment, parse_mode, text = broadcast.parse_command(args)
+        broadcast_id, total = broadcast.create_broadcast(
+            conn, text, segment, parse_mode, created_by=user_id)
+    except ValueError as e:
+        reply_message(chat_id, f"Broadcast not started: {e}")
+        return
+    broadcast.wake()
+    reply_message(
+        chat_id, f"📣 Broadcast #{broadcast_id} started for {total} chats. "
+        f"Send /broadcast to check progress or /broadcast cancel to stop it.")
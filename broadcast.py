@@ -0,0 +1,500 @@
+# broadcast.py
+"""Admin broadcasts to every chat in payments, or a filtered segment.
+
+create_broadcast() only stores the message. Each worker process runs a
+BroadcastRunner that reads the broadcasts table until one is running, and
+the runner holding the shared ``broadcast`` lease sends it. Recipients are
+read BROADCAST_BATCH_SIZE at a time in chat_id order, a keyset scan over the
+chat_id index. BROADCAST_WORKERS threads send each batch at up to
+BROADCAST_RATE messages per second. The last chat_id of a finished batch is
+saved with the counters, but only while the runner still holds the lease,
+which a heartbeat renews as the batch sends. A broadcast whose process died
+is picked up from there once its lease expires, so at most one batch is
+sent twice.
+"""
+
+import json
+import logging
+import os
+import random
+import re
+import socket
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import metrics
+import outbound
+import storage
+import telegram_client
+from config import (DB_PATH, OUTBOUND_GLOBAL_RATE, BROADCAST_RATE,
+                    BROADCAST_REPLY_RESERVE, BROADCAST_WORKERS,
+                    BROADCAST_BATCH_SIZE, BROADCAST_POLL_INTERVAL)
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = 'broadcast'
+LEASE_TTL = 60
+MAX_ATTEMPTS = 5
+MAX_RATE_LIMITED = 5
+MAX_BACKOFF = 30.0
+
+SEGMENT_KEYS = ('status', 'start', 'end', 'q')
+PARSE_MODES = ('Markdown', 'MarkdownV2', 'HTML')
+
+COLUMNS = ('id', 'text', 'parse_mode', 'segment', 'status', 'created_by',
+           'total', 'last_chat_id', 'sent', 'blocked', 'failed', 'created_at',
+           'started_at', 'updated_at', 'finished_at')
+
+MESSAGES = metrics.Counter('broadcast_messages_total',
+                           'Broadcast sends by outcome', ('outcome', ))
+
+
+def init_broadcasts(conn):
+    """Create the broadcasts table and the index recipients are read with"""
+    conn.execute(storage.ddl('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id {pk},
+            text TEXT NOT NULL,
+            parse_mode TEXT,
+            segment TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_by {bigint},
+            total INTEGER NOT NULL,
+            last_chat_id TEXT,
+            sent INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at {real} NOT NULL,
+            started_at {real},
+            updated_at {real} NOT NULL,
+            finished_at {real}
+        )
+    '''))
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payments_chat_id
+        ON payments (chat_id)
+    ''')
+
+
+def _recipient_filters(segment):
+    where, params = storage.payment_filters(**segment)
+    where += " AND " if where else "WHERE "
+    return where + "chat_id IS NOT NULL AND chat_id <> ''", params
+
+
+def count_recipients(conn, segment):
+    where, params = _recipient_filters(segment)
+    return conn.execute(
+        f"SELECT COUNT(DISTINCT chat_id) FROM payments {where}",
+        params).fetchone()[0]
+
+
+def next_recipients(conn, segment, after, limit):
+    """Up to `limit` distinct chat_ids of the segment, in order, after `after`"""
+    where, params = _recipient_filters(segment)
+    if after is not None:
+        where += " AND chat_id > ?"
+        params.append(after)
+    rows = conn.execute(
+        f"SELECT DISTINCT chat_id FROM payments {where} "
+        f"ORDER BY chat_id LIMIT ?", params + [limit]).fetchall()
+    return [row[0] for row in rows]
+
+
+def parse_command(args):
+    """Split /broadcast arguments into (segment, parse_mode, text).
+
+    Leading key=value words pick the segment (status, start, end, q) and
+    parse_mode; the rest is the message, kept as written.
+    """
+    segment = {}
+    parse_mode = None
+    text = args.strip()
+    while True:
+        match = re.match(r'(\w+)=(\S+)\s*', text)
+        if not match or match.group(1) not in SEGMENT_KEYS + ('parse_mode', ):
+            break
+        key, value = match.groups()
+        if key == 'parse_mode':
+            if value not in PARSE_MODES:
+                raise ValueError(
+                    f"parse_mode must be one of {', '.join(PARSE_MODES)}")
+            parse_mode = value
+        else:
+            if key in ('start', 'end'):
+                try:
+                    date.fromisoformat(value)
+                except ValueError:
+                    raise ValueError(
+                        f"{key} must be a YYYY-MM-DD date") from None
+            segment[key] = value
+        text = text[match.end():]
+    return segment, parse_mode, text
+
+
+def create_broadcast(conn, text, segment=None, parse_mode=None,
+                     created_by=None):
+    """Store a broadcast for the runners to send. Returns (id, recipients)."""
+    segment = segment or {}
+    unknown = set(segment) - set(SEGMENT_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown segment filters: {', '.join(sorted(unknown))}")
+    if not text or len(text) > outbound.MAX_MESSAGE_LENGTH:
+        raise ValueError(
+            f"Message must be 1 to {outbound.MAX_MESSAGE_LENGTH} characters")
+
+    total = count_recipients(conn, segment)
+    if not total:
+        raise ValueError("No chats match that segment")
+    now = time.time()
+    with conn:
+        broadcast_id = conn.execute(
+            '''
+            INSERT INTO broadcasts (text, parse_mode, segment, status,
+                                    created_by, total, created_at, updated_at)
+            VALUES (?, ?, ?, 'running', ?, ?, ?, ?)
+            RETURNING id
+            ''', (text, parse_mode, json.dumps(segment), created_by, total,
+                  now, now)).fetchone()[0]
+    logger.info("Broadcast %d created for %d chats", broadcast_id, total)
+    return broadcast_id, total
+
+
+def cancel_broadcast(conn, broadcast_id=None):
+    """Cancel a running broadcast, the latest by default. Returns its id or None."""
+    with conn:
+        row = conn.execute(
+            '''
+            UPDATE broadcasts SET status = 'cancelled', finished_at = ?
+            WHERE status = 'running' AND id = COALESCE(?, (
+                SELECT MAX(id) FROM broadcasts WHERE status = 'running'))
+            RETURNING id
+            ''', (time.time(), broadcast_id)).fetchone()
+    return row[0] if row else None
+
+
+def _as_dict(row):
+    return dict(zip(COLUMNS, row)) if row else None
+
+
+def get_broadcast(conn, broadcast_id=None):
+    """A broadcast as a dict, the latest one by default"""
+    columns = ', '.join(COLUMNS)
+    if broadcast_id is None:
+        row = conn.execute(
+            f"SELECT {columns} FROM broadcasts ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+    else:
+        row = conn.execute(f"SELECT {columns} FROM broadcasts WHERE id = ?",
+                           (broadcast_id, )).fetchone()
+    return _as_dict(row)
+
+
+def progress(broadcast):
+    """Counters plus derived progress, throughput and ETA for one broadcast"""
+    handled = broadcast['sent'] + broadcast['blocked'] + broadcast['failed']
+    elapsed = 0.0
+    if broadcast['started_at']:
+        elapsed = ((broadcast['finished_at'] or broadcast['updated_at']) -
+                   broadcast['started_at'])
+    rate = handled / elapsed if elapsed > 0 else 0.0
+    remaining = max(broadcast['total'] - handled, 0)
+    return {
+        'id': broadcast['id'],
+        'status': broadcast['status'],
+        'segment': json.loads(broadcast['segment']),
+        'total': broadcast['total'],
+        'handled': handled,
+        'sent': broadcast['sent'],
+        'blocked': broadcast['blocked'],
+        'failed': broadcast['failed'],
+        'percent': round(handled * 100 / broadcast['total'], 1)
+        if broadcast['total'] else 100.0,
+        'messages_per_second': round(rate, 2),
+        'eta_seconds': round(remaining / rate)
+        if rate and broadcast['status'] == 'running' else None,
+        'created_at': broadcast['created_at'],
+        'finished_at': broadcast['finished_at']
+    }
+
+
+def broadcast_stats(conn, limit=10):
+    columns = ', '.join(COLUMNS)
+    rows = conn.execute(
+        f"SELECT {columns} FROM broadcasts ORDER BY id DESC LIMIT ?",
+        (limit, )).fetchall()
+    runner = _runner if _runner_pid == os.getpid() else None
+    return {
+        'broadcasts': [progress(_as_dict(row)) for row in rows],
+        'sending_here': runner.current if runner else None
+    }
+
+
+def _retry_after(response):
+    try:
+        return float(response.json().get('parameters', {}).get(
+            'retry_after', 1))
+    except ValueError:
+        return 1.0
+
+
+class BroadcastRunner:
+    """Background thread that sends running broadcasts.
+
+    Every worker process runs one, but only the holder of the shared
+    ``broadcast`` lease sends; the others just poll the broadcasts table.
+    Sends are paced by the runner's own bucket: BROADCAST_RATE, but never
+    more than OUTBOUND_GLOBAL_RATE less the BROADCAST_REPLY_RESERVE left for
+    replies to users. A 429 pauses it and this process's dispatcher.
+    """
+
+    def __init__(self,
+                 db_path=DB_PATH,
+                 poll_interval=BROADCAST_POLL_INTERVAL,
+                 rate=BROADCAST_RATE,
+                 workers=BROADCAST_WORKERS,
+                 batch_size=BROADCAST_BATCH_SIZE):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.limiter = outbound.TokenBucket(
+            max(min(rate, OUTBOUND_GLOBAL_RATE - BROADCAST_REPLY_RESERVE), 1))
+        self.workers = workers
+        self.batch_size = batch_size
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.current = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lease_lost = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name="broadcast-runner",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Stop after the batch in flight; a later runner resumes from there"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        conn = storage.get_connection(self.db_path)
+        try:
+            while not self._stop.is_set():
+                try:
+                    self._run_pending(conn)
+                except Exception as e:
+                    logger.error("Error sending broadcast: %s", e)
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+        finally:
+            storage.close_connection(self.db_path)
+
+    def _run_pending(self, conn):
+        columns = ', '.join(COLUMNS)
+        # A plain read while idle; the lease is only taken with work to do
+        row = conn.execute(
+            f"SELECT {columns} FROM broadcasts WHERE status = 'running' "
+            f"ORDER BY id LIMIT 1").fetchone()
+        if row is None or not storage.acquire_lease(conn, LEASE_NAME,
+                                                    self.owner, LEASE_TTL):
+            return
+        self._lease_lost.clear()
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._keep_lease,
+                                     args=(done, ),
+                                     name="broadcast-lease",
+                                     daemon=True)
+        heartbeat.start()
+        try:
+            self._send_broadcast(conn, _as_dict(row))
+        finally:
+            done.set()
+            heartbeat.join()
+            self.current = None
+            storage.release_lease(conn, LEASE_NAME, self.owner)
+
+    def _keep_lease(self, done):
+        """Renew the lease until `done` is set, however long a batch takes"""
+        conn = storage.get_connection(self.db_path)
+        try:
+            while not done.wait(LEASE_TTL / 3):
+                try:
+                    held = storage.acquire_lease(conn, LEASE_NAME, self.owner,
+                                                 LEASE_TTL)
+                except Exception as e:
+                    logger.warning("Error renewing the broadcast lease: %s", e)
+                    continue
+                if not held:
+                    logger.warning("Lost the broadcast lease")
+                    self._lease_lost.set()
+                    return
+        finally:
+            storage.close_connection(self.db_path)
+
+    def _checkpoint(self, conn, sql, params):
+        """Run `sql`, an UPDATE of broadcasts, only while holding the lease.
+
+        Returns the updated row's status, or None if the lease is gone.
+        """
+        with conn:
+            row = conn.execute(
+                sql + '''
+                  AND EXISTS (SELECT 1 FROM worker_leases
+                              WHERE name = ? AND owner = ? AND expires_at > ?)
+                RETURNING status
+                ''', params + (LEASE_NAME, self.owner, time.time())).fetchone()
+        return row[0] if row else None
+
+    def _send_broadcast(self, conn, broadcast):
+        broadcast_id = broadcast['id']
+        segment = json.loads(broadcast['segment'])
+        after = broadcast['last_chat_id']
+        payload = {'text': broadcast['text']}
+        if broadcast['parse_mode']:
+            payload['parse_mode'] = broadcast['parse_mode']
+
+        self.current = broadcast_id
+        with conn:
+            conn.execute(
+                "UPDATE broadcasts SET started_at = COALESCE(started_at, ?) "
+                "WHERE id = ?", (time.time(), broadcast_id))
+        if after:
+            logger.info("Resuming broadcast %d after chat %s", broadcast_id,
+                        after)
+        else:
+            logger.info("Sending broadcast %d", broadcast_id)
+
+        with ThreadPoolExecutor(max_workers=self.workers,
+                                thread_name_prefix="broadcast") as pool:
+            while not self._stop.is_set():
+                chat_ids = next_recipients(conn, segment, after,
+                                           self.batch_size)
+                if not chat_ids:
+                    if self._checkpoint(
+                            conn, "UPDATE broadcasts SET status = 'done', "
+                            "finished_at = ?, updated_at = ? "
+                            "WHERE id = ? AND status = 'running'",
+                        (time.time(), time.time(), broadcast_id)):
+                        logger.info("Broadcast %d finished", broadcast_id)
+                    return
+
+                outcomes = Counter(
+                    pool.map(lambda chat_id: self._send(payload, chat_id),
+                             chat_ids))
+                after = chat_ids[-1]
+                status = self._checkpoint(
+                    conn, '''
+                    UPDATE broadcasts
+                    SET last_chat_id = ?, sent = sent + ?,
+                        blocked = blocked + ?, failed = failed + ?,
+                        updated_at = ?
+                    WHERE id = ?''', (after, outcomes['sent'],
+                                      outcomes['blocked'], outcomes['failed'],
+                                      time.time(), broadcast_id))
+                if status is None:
+                    # Whoever took the lease resumes from the last checkpoint
+                    # and owns the counters from there
+                    logger.warning(
+                        "Stopped broadcast %d: the lease was lost",
+                        broadcast_id)
+                    return
+                if status != 'running':
+                    logger.info("Broadcast %d %s", broadcast_id, status)
+                    return
+
+    def _send(self, payload, chat_id):
+        """Deliver one message. Returns 'sent', 'blocked' or 'failed', or
+        None without sending once the lease is lost.
+        """
+        data = dict(payload, chat_id=chat_id)
+        attempts = 0
+        rate_limited = 0
+        while True:
+            self.limiter.acquire()
+            if self._lease_lost.is_set():
+                return None
+            try:
+                response = telegram_client.call("sendMessage", data)
+            except Exception as e:
+                response = None
+                logger.warning("Error broadcasting to chat %s: %s", chat_id, e)
+
+            if response is not None:
+                if response.status_code == 200:
+                    outcome = 'sent'
+                    break
+                if response.status_code == 429:
+                    retry_after = _retry_after(response)
+                    self.limiter.pause(retry_after)
+                    # The limit is bot-wide, so hold this worker's replies too
+                    outbound.get_dispatcher().limiter.pause(retry_after)
+                    MESSAGES.labels('rate_limited').inc()
+                    rate_limited += 1
+                    if rate_limited < MAX_RATE_LIMITED:
+                        continue
+                    outcome = 'failed'
+                    break
+                if response.status_code == 403:
+                    # Blocked the bot or deactivated; retrying cannot help
+                    outcome = 'blocked'
+                    break
+                if response.status_code < 500:
+                    logger.info("Broadcast to chat %s rejected: %s", chat_id,
+                                response.text)
+                    outcome = 'failed'
+                    break
+
+            attempts += 1
+            if attempts >= MAX_ATTEMPTS:
+                outcome = 'failed'
+                break
+            time.sleep(
+                min(2**attempts, MAX_BACKOFF) * random.uniform(0.5, 1.0))
+        MESSAGES.labels(outcome).inc()
+        return outcome
+
+
+_runner = None
+_runner_pid = None
+_runner_lock = threading.Lock()
+
+
+def start_runner():
+    """Start the broadcast runner for this process if it is not running yet"""
+    global _runner, _runner_pid
+
+    pid = os.getpid()
+    if _runner is None or _runner_pid != pid:
+        with _runner_lock:
+            if _runner is None or _runner_pid != pid:
+                runner = BroadcastRunner()
+                runner.start()
+                _runner = runner
+                _runner_pid = pid
+    return _runner
+
+
+def stop_runner(timeout=5.0):
+    """Stop this process's broadcast runner if it is running"""
+    global _runner
+
+    with _runner_lock:
+        current = _runner if _runner_pid == os.getpid() else None
+        _runner = None
+    if current is not None:
+        current.stop(timeout)
+
+
+def wake():
+    """Nudge this process's runner to pick up a broadcast just created"""
+    start_runner().wake()
@@ -0,0 +1,205 @@
+# command_router.py
+
+import inspect
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class HandlerStats:
+    """Call count, error count and latency for one command handler"""
+
+    __slots__ = ('calls', 'errors', 'total', 'max', '_lock')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed, failed):
+        with self._lock:
+            self.calls += 1
+            self.total += elapsed
+            if elapsed > self.max:
+                self.max = elapsed
+            if failed:
+                self.errors += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'errors': self.errors,
+                'avg_ms': round(self.total / self.calls * 1000, 3)
+                if self.calls else 0.0,
+                'max_ms': round(self.max * 1000, 3),
+                'total_ms': round(self.total * 1000, 3)
+            }
+
+
+def _timed(handler, stats):
+    perf_counter = time.perf_counter
+
+    def timed(chat_id, user_id, message, args):
+        start = perf_counter()
+        failed = True
+        try:
+            result = handler(chat_id, user_id, message, args)
+            failed = False
+            return result
+        finally:
+            stats.record(perf_counter() - start, failed)
+
+    return timed
+
+
+def _timed_async(handler, stats):
+    perf_counter = time.perf_counter
+
+    async def timed(chat_id, user_id, message, args):
+        start = perf_counter()
+        failed = True
+        try:
+            result = handler(chat_id, user_id, message, args)
+            # Middleware that rejects a call returns None instead of the
+            # handler's coroutine
+            if inspect.isawaitable(result):
+                result = await result
+            failed = False
+            return result
+        finally:
+            stats.record(perf_counter() - start, failed)
+
+    return timed
+
+
+def admin_only(admin_ids, on_denied=None):
+    """Middleware: only let users in `admin_ids` through"""
+    allowed = frozenset(admin_ids)
+
+    def middleware(handler):
+
+        def guarded(chat_id, user_id, message, args):
+            if user_id not in allowed:
+                if on_denied is not None:
+                    on_denied(chat_id)
+                return None
+            return handler(chat_id, user_id, message, args)
+
+        return guarded
+
+    return middleware
+
+
+def rate_limited(interval, on_limited=None, max_tracked=10000):
+    """Middleware: allow each user one call per `interval` seconds"""
+    last_call = {}
+    lock = threading.Lock()
+    monotonic = time.monotonic
+
+    def middleware(handler):
+
+        def limited(chat_id, user_id, message, args):
+            now = monotonic()
+            with lock:
+                if now - last_call.get(user_id, -interval) < interval:
+                    allowed = False
+                else:
+                    allowed = True
+                    last_call[user_id] = now
+                    if len(last_call) > max_tracked:
+                        last_call.clear()
+            if not allowed:
+                if on_limited is not None:
+                    on_limited(chat_id)
+                return None
+            return handler(chat_id, user_id, message, args)
+
+        return limited
+
+    return middleware
+
+
+class CommandRouter:
+    """Registry of bot commands with O(1) dispatch.
+
+    Handlers take ``(chat_id, user_id, message, args)`` and may be plain
+    functions or ``async def`` coroutines; ``is_async()`` tells callers which
+    kind they are about to run. Middleware are
+    factories ``middleware(handler) -> handler``; the chain for each command
+    is composed once at registration, so dispatch is a dict lookup plus the
+    calls themselves. Every handler is wrapped in a timer feeding
+    ``stats()``.
+    """
+
+    def __init__(self, reply, middleware=()):
+        self.reply = reply
+        self.middleware = tuple(middleware)
+        self._handlers = {}
+        self._async = set()
+        self._descriptions = {}
+        self._stats = {}
+        self._help_text = None
+
+    def command(self, name, description=None, middleware=()):
+        """Decorator registering `func` as the handler for /name"""
+
+        def decorator(func):
+            self.add(name, func, description, middleware)
+            return func
+
+        return decorator
+
+    def add(self, name, func, description=None, middleware=()):
+        handler = func
+        # Per-command middleware runs inside the router-wide chain
+        for wrap in reversed(self.middleware + tuple(middleware)):
+            handler = wrap(handler)
+        stats = self._stats.setdefault(name, HandlerStats())
+        if inspect.iscoroutinefunction(func):
+            self._handlers[name] = _timed_async(handler, stats)
+            self._async.add(name)
+        else:
+            self._handlers[name] = _timed(handler, stats)
+            self._async.discard(name)
+        if description:
+            self._descriptions[name] = description
+        self._help_text = None
+
+    def static(self, name, text, description=None, parse_mode=None,
+               reply_markup=None, middleware=()):
+        """Register a command that always sends the same pre-rendered reply"""
+        reply = self.reply
+
+        def static_reply(chat_id, user_id, message, args):
+            reply(chat_id, text, parse_mode=parse_mode,
+                  reply_markup=reply_markup)
+
+        self.add(name, static_reply, description, middleware)
+
+    def get(self, name):
+        """Return the compiled handler for a command, or None"""
+        return self._handlers.get(name)
+
+    def is_async(self, name):
+        """True if the command's handler is a coroutine function"""
+        return name in self._async
+
+    def __contains__(self, name):
+        return name in self._handlers
+
+    def help_text(self):
+        """Help listing, rendered once and reused until commands change"""
+        if self._help_text is None:
+            lines = ["Here are the commands you can use:\n"]
+            for name, description in self._descriptions.items():
+                lines.append(f"/{name} - {description}")
+            self._help_text = "\n".join(lines) + "\n"
+        return self._help_text
+
+    def stats(self):
+        return {name: stats.as_dict() for name, stats in self._stats.items()}
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 TELEGRAM_GROUP_ID = os.environ.get("TELEGRAM_GROUP_ID")
 if not TELEGRAM_GROUP_ID:
@@ -12,6 +13,80 @@ if not BOT_TOKEN:
 # Webhook URL path (should be difficult to guess)
 WEBHOOK_URL_PATH = f"/webhook/{BOT_TOKEN}"
 
+# How updates arrive: "webhook" (Telegram POSTs to WEBHOOK_URL_PATH) or
+# "polling" (a background getUpdates loop, no public URL needed)
+UPDATE_MODE = os.environ.get("UPDATE_MODE", "webhook").lower()
+POLLING_TIMEOUT = int(os.environ.get("POLLING_TIMEOUT", "30"))
+POLLING_LIMIT = min(int(os.environ.get("POLLING_LIMIT", "100")), 100)
+POLLING_WORKERS = int(os.environ.get("POLLING_WORKERS", "8"))
+
+# Commands answered in the webhook HTTP response itself instead of with a
+# separate sendMessage call (webhook mode only)
+WEBHOOK_REPLY = os.environ.get("WEBHOOK_REPLY", "true").lower() == "true"
+WEBHOOK_REPLY_COMMANDS = frozenset(
+    name.strip().lower() for name in os.environ.get(
+        "WEBHOOK_REPLY_COMMANDS", "start,help,status,info").split(",")
+    if name.strip())
+
+# Largest webhook body accepted (bytes); Telegram updates and Paystack events
+# are a few KB
+WEBHOOK_MAX_BODY = int(os.environ.get("WEBHOOK_MAX_BODY", str(256 * 1024)))
+
+# Webhook update execution - UPDATE_WORKERS threads, each owning a shard of
+# chats; 0 processes updates inline in the request as before
+UPDATE_WORKERS = int(os.environ.get("UPDATE_WORKERS", "8"))
+UPDATE_QUEUE_SIZE = int(os.environ.get("UPDATE_QUEUE_SIZE", "200"))
+UPDATE_DRAIN_TIMEOUT = float(os.environ.get("UPDATE_DRAIN_TIMEOUT", "10"))
+
+# Telegram update_id deduplication - ids remembered per worker (count and
+# seconds), optionally shared across workers through the database
+UPDATE_DEDUPE_SIZE = int(os.environ.get("UPDATE_DEDUPE_SIZE", "10000"))
+UPDATE_DEDUPE_TTL = float(os.environ.get("UPDATE_DEDUPE_TTL", "3600"))
+UPDATE_DEDUPE_SHARED = os.environ.get("UPDATE_DEDUPE_SHARED",
+                                      "true").lower() == "true"
+
+# Asyncio runtime (python async_runtime.py) - aiohttp connection pool size,
+# threads for sync handlers and the port its webhook server listens on
+ASYNC_POOL_SIZE = int(os.environ.get("ASYNC_POOL_SIZE", "100"))
+ASYNC_SYNC_WORKERS = int(os.environ.get("ASYNC_SYNC_WORKERS", "16"))
+ASYNC_PORT = int(os.environ.get("ASYNC_PORT", "8080"))
+
+# Telegram Bot API client - base URL, connection pool size and timeouts (seconds)
+TELEGRAM_API_BASE_URL = os.environ.get("TELEGRAM_API_BASE_URL",
+                                       "https://api.telegram.org").rstrip("/")
+TELEGRAM_POOL_SIZE = int(os.environ.get("TELEGRAM_POOL_SIZE", "10"))
+TELEGRAM_CONNECT_TIMEOUT = float(
+    os.environ.get("TELEGRAM_CONNECT_TIMEOUT", "3.05"))
+TELEGRAM_READ_TIMEOUT = float(os.environ.get("TELEGRAM_READ_TIMEOUT", "10"))
+
+# Outbound message dispatcher - Telegram allows ~30 msg/s overall, ~1 msg/s
+# per chat. OUTBOUND_GLOBAL_RATE is bot-wide: each of the OUTBOUND_PROCESSES
+# worker processes (gunicorn's WEB_CONCURRENCY by default) replies at its
+# share of it
+OUTBOUND_GLOBAL_RATE = float(os.environ.get("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_PROCESSES = int(
+    os.environ.get("OUTBOUND_PROCESSES",
+                   os.environ.get("WEB_CONCURRENCY", "1")))
+OUTBOUND_PER_CHAT_INTERVAL = float(
+    os.environ.get("OUTBOUND_PER_CHAT_INTERVAL", "1.0"))
+OUTBOUND_WORKERS = int(os.environ.get("OUTBOUND_WORKERS", "4"))
+OUTBOUND_QUEUE_MAX = int(os.environ.get("OUTBOUND_QUEUE_MAX", "10000"))
+OUTBOUND_MAX_RETRIES = int(os.environ.get("OUTBOUND_MAX_RETRIES", "5"))
+OUTBOUND_COALESCE = os.environ.get("OUTBOUND_COALESCE",
+                                   "true").lower() == "true"
+
+# Admin /broadcast - messages per second, capped at OUTBOUND_GLOBAL_RATE less
+# the BROADCAST_REPLY_RESERVE kept for replies, sender threads, recipients
+# per checkpoint and how often idle workers look for a broadcast to send or
+# resume (seconds)
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", "25"))
+BROADCAST_REPLY_RESERVE = float(
+    os.environ.get("BROADCAST_REPLY_RESERVE", "5"))
+BROADCAST_WORKERS = int(os.environ.get("BROADCAST_WORKERS", "8"))
+BROADCAST_BATCH_SIZE = int(os.environ.get("BROADCAST_BATCH_SIZE", "50"))
+BROADCAST_POLL_INTERVAL = float(
+    os.environ.get("BROADCAST_POLL_INTERVAL", "5"))
+
 # Configure allowed commands
 COMMANDS = {
     'start': 'Start the bot',
@@ -20,14 +95,86 @@ COMMANDS = {
     'info': 'Get information about the bot'
 }
 
+# Minimum seconds between commands from one user (0 disables the limit)
+COMMAND_RATE_LIMIT_INTERVAL = float(
+    os.environ.get("COMMAND_RATE_LIMIT_INTERVAL", "0"))
+
 # Paystack secret key - MUST now be set in Replit as 'PAYSTACK_SECRET_KEY'
 PAYSTACK_SECRET_KEY = os.environ.get("PAYSTACK_SECRET_KEY")
 if not PAYSTACK_SECRET_KEY:
     raise ValueError("No PAYSTACK_SECRET_KEY found in environment variables")
 
-# Optional: print preview for debugging (don't do this in production!)
-print(f"PAYSTACK_SECRET_KEY length: {len(PAYSTACK_SECRET_KEY)}")
-print(f"PAYSTACK_SECRET_KEY preview: {PAYSTACK_SECRET_KEY[:10]}...")
+# Paystack transactions API, used to reconcile payments whose webhook was
+# lost - pages fetched in parallel, page size, how far back the first run
+# looks (days) and how far each later run reaches behind its checkpoint
+# (seconds), for transactions that succeeded well after they were created
+PAYSTACK_API_BASE_URL = os.environ.get("PAYSTACK_API_BASE_URL",
+                                       "https://api.paystack.co").rstrip("/")
+RECONCILE_CONCURRENCY = int(os.environ.get("RECONCILE_CONCURRENCY", "8"))
+RECONCILE_PAGE_SIZE = int(os.environ.get("RECONCILE_PAGE_SIZE", "100"))
+RECONCILE_INITIAL_DAYS = int(os.environ.get("RECONCILE_INITIAL_DAYS", "7"))
+RECONCILE_LOOKBACK = int(os.environ.get("RECONCILE_LOOKBACK", "86400"))
+
+# Database holding payments and background job state - "sqlite" keeps it in
+# the DB_PATH file of each instance, "postgres" in the DATABASE_URL server
+# shared by every instance of an autoscale deployment
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sqlite").lower()
+DB_PATH = os.environ.get("DB_PATH", "payments.db")
+DATABASE_URL = os.environ.get("DATABASE_URL", "")
+if STORAGE_BACKEND == "postgres" and not DATABASE_URL:
+    raise ValueError("STORAGE_BACKEND=postgres needs DATABASE_URL")
+
+# PostgreSQL connections per worker process, opened as threads first use the
+# database and kept by each thread
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", "32"))
+
+# Startup - importing the app never starts threads; each worker starts them
+# after it forks (see gunicorn.conf.py) or on its first request. Without
+# LAZY_INIT the import migrates the database; with it (gunicorn.conf.py turns
+# it on for --preload) the import touches no database either
+LAZY_INIT = os.environ.get("LAZY_INIT", "false").lower() == "true"
+
+# SQLite tuning - connections are kept open per worker thread
+SQLITE_BUSY_TIMEOUT = float(os.environ.get("SQLITE_BUSY_TIMEOUT", "5.0"))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", "20000"))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHED_STATEMENTS = int(
+    os.environ.get("SQLITE_CACHED_STATEMENTS", "256"))
+
+# /all_payments page size when no limit is given, and the largest allowed
+ALL_PAYMENTS_DEFAULT_LIMIT = int(os.environ.get("ALL_PAYMENTS_DEFAULT_LIMIT",
+                                                "100"))
+ALL_PAYMENTS_MAX_LIMIT = int(os.environ.get("ALL_PAYMENTS_MAX_LIMIT", "1000"))
+
+# Rows fetched per query when streaming /payments/export
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", "1000"))
+
+# Paystack references remembered per worker to short-circuit webhook retries
+SEEN_REFERENCES_MAX = int(os.environ.get("SEEN_REFERENCES_MAX", "10000"))
+
+# Outbox worker - polling interval, job lease and retry budget
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", "1.0"))
+OUTBOX_LEASE_SECONDS = float(os.environ.get("OUTBOX_LEASE_SECONDS", "60"))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "8"))
+
+# Invite link pool - links are minted ahead of time and claimed per payment
+INVITE_POOL_ENABLED = os.environ.get("INVITE_POOL_ENABLED",
+                                     "true").lower() == "true"
+INVITE_POOL_MIN = int(os.environ.get("INVITE_POOL_MIN", "5"))
+INVITE_POOL_MAX = int(os.environ.get("INVITE_POOL_MAX", "200"))
+# Keep enough links for this many minutes of payments at the recent rate
+INVITE_POOL_LEAD_MINUTES = float(
+    os.environ.get("INVITE_POOL_LEAD_MINUTES", "30"))
+INVITE_POOL_REFILL_INTERVAL = float(
+    os.environ.get("INVITE_POOL_REFILL_INTERVAL", "30"))
+INVITE_POOL_REVOKE_BATCH = int(os.environ.get("INVITE_POOL_REVOKE_BATCH",
+                                              "20"))
+# Pooled links expire after INVITE_LINK_TTL seconds and are not handed out
+# with less than INVITE_POOL_MIN_REMAINING seconds left
+INVITE_LINK_TTL = int(os.environ.get("INVITE_LINK_TTL", "86400"))
+INVITE_POOL_MIN_REMAINING = int(
+    os.environ.get("INVITE_POOL_MIN_REMAINING", "3600"))
 
 # Telegram invite link - use env or default
 TELEGRAM_INVITE_LINK = os.environ.get("TELEGRAM_INVITE_LINK",
@@ -39,8 +186,24 @@ ADMIN_USER_IDS = [
     if id.strip().isdigit()
 ]
 
-# Optional: print debug info
-print("Loaded config:")
-print(f"- BOT_TOKEN: {'*' * len(BOT_TOKEN)} (hidden)")
-print(f"- TELEGRAM_INVITE_LINK: {TELEGRAM_INVITE_LINK}")
-print(f"- ADMIN_USER_IDS: {ADMIN_USER_IDS}")
+# Logging - level name, "json" or "text" output, and the fraction of
+# webhook payloads logged at DEBUG (secrets and personal fields are masked)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+LOG_PAYLOAD_SAMPLE_RATE = float(
+    os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+
+# Metrics - each worker writes a snapshot to METRICS_DIR every
+# METRICS_FLUSH_INTERVAL seconds and /metrics merges them
+METRICS_DIR = os.environ.get(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), "telegram-bot-metrics"))
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))
+
+# Profiling (off by default) - fraction of requests run under cProfile, and
+# requests slower than SLOW_REQUEST_MS are captured to PROFILE_DIR, keeping
+# the newest PROFILE_KEEP
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "0"))
+PROFILE_DIR = os.environ.get(
+    "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "telegram-bot-profiles"))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "50"))
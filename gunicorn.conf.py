@@ -0,0 +1,38 @@
+# gunicorn.conf.py
+"""Gunicorn settings, read automatically from the working directory.
+
+The app is preloaded: the master imports it once, applies schema migrations
+and loads templates and the HTTP stack, then forks workers that are ready to
+serve. Each worker starts its own background threads after the fork, since
+threads do not survive it.
+"""
+
+import os
+import sys
+
+# Importing the app in the master must not start threads or hold a database
+# connection that every worker would inherit
+os.environ.setdefault("LAZY_INIT", "true")
+
+# --reload needs every worker to import the code itself
+preload_app = "--reload" not in sys.argv
+
+
+def when_ready(server):
+    # Runs in the master once, before the first worker is forked
+    if not server.cfg.preload_app:
+        return
+    import app
+    app.init_db()
+    app.warm_up()
+    app.storage.close_connection()
+
+
+def post_worker_init(worker):
+    import app
+    if worker.cfg.workers != app.outbound.OUTBOUND_PROCESSES:
+        worker.log.warning(
+            "OUTBOUND_PROCESSES is %s but gunicorn runs %s workers; set "
+            "WEB_CONCURRENCY instead of -w so the send rate is split evenly",
+            app.outbound.OUTBOUND_PROCESSES, worker.cfg.workers)
+    app.start_background()
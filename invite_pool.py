@@ -0,0 +1,241 @@
+# invite_pool.py
+
+import logging
+import math
+import os
+import socket
+import threading
+import time
+
+import storage
+from config import (DB_PATH, INVITE_POOL_MIN, INVITE_POOL_MAX,
+                    INVITE_POOL_LEAD_MINUTES, INVITE_POOL_REFILL_INTERVAL,
+                    INVITE_POOL_REVOKE_BATCH, INVITE_LINK_TTL,
+                    INVITE_POOL_MIN_REMAINING)
+from telegram_invite import generate_invite_link, revoke_invite_link
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on links minted per refill cycle, so a cold pool does not
+# burst createChatInviteLink calls into Telegram's rate limit
+MAX_MINT_PER_CYCLE = 20
+RATE_WINDOW_SECONDS = 3600
+
+
+def init_pool(conn):
+    """Create the invite link pool tables on an open connection"""
+    c = conn.cursor()
+    c.execute(storage.ddl('''
+        CREATE TABLE IF NOT EXISTS invite_links (
+            id {pk},
+            invite_link TEXT UNIQUE NOT NULL,
+            created_at {real} NOT NULL,
+            expire_date {bigint},
+            claimed_at {real},
+            claimed_by TEXT,
+            revoked_at {real}
+        )
+    '''))
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_invite_links_available
+        ON invite_links (expire_date)
+        WHERE claimed_at IS NULL AND revoked_at IS NULL
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_invite_links_claimed
+        ON invite_links (claimed_by)
+    ''')
+
+
+def claim_invite_link(conn, reference):
+    """Atomically hand out an unused pooled link for a payment reference"""
+    with conn:
+        row = conn.execute(
+            "SELECT invite_link FROM invite_links WHERE claimed_by = ?",
+            (reference, )).fetchone()
+        if row:
+            return row[0]
+
+        row = conn.execute(
+            f'''
+            UPDATE invite_links
+            SET claimed_at = ?, claimed_by = ?
+            WHERE id = (
+                SELECT id FROM invite_links
+                WHERE claimed_at IS NULL AND revoked_at IS NULL
+                  AND (expire_date IS NULL OR expire_date > ?)
+                ORDER BY expire_date, id
+                LIMIT 1{storage.SKIP_LOCKED}
+            )
+            RETURNING invite_link
+            ''', (time.time(), reference,
+                  int(time.time()) + INVITE_POOL_MIN_REMAINING)).fetchone()
+    return row[0] if row else None
+
+
+def available_count(conn):
+    return conn.execute(
+        '''
+        SELECT COUNT(*) FROM invite_links
+        WHERE claimed_at IS NULL AND revoked_at IS NULL
+          AND (expire_date IS NULL OR expire_date > ?)
+        ''', (int(time.time()) + INVITE_POOL_MIN_REMAINING, )).fetchone()[0]
+
+
+def target_size(conn):
+    """Pool size needed to cover INVITE_POOL_LEAD_MINUTES at the recent claim rate"""
+    claimed = conn.execute(
+        "SELECT COUNT(*) FROM invite_links WHERE claimed_at > ?",
+        (time.time() - RATE_WINDOW_SECONDS, )).fetchone()[0]
+    per_minute = claimed / (RATE_WINDOW_SECONDS / 60)
+    wanted = math.ceil(per_minute * INVITE_POOL_LEAD_MINUTES)
+    return max(INVITE_POOL_MIN, min(INVITE_POOL_MAX, wanted))
+
+
+def refill(conn):
+    """Mint links until the pool reaches its target size. Returns links added."""
+    missing = min(target_size(conn) - available_count(conn),
+                  MAX_MINT_PER_CYCLE)
+    added = 0
+    for _ in range(max(missing, 0)):
+        expire_date = int(time.time()) + INVITE_LINK_TTL if INVITE_LINK_TTL else None
+        try:
+            invite_link = generate_invite_link(expire_date=expire_date)
+        except Exception as e:
+            logger.warning("Invite pool refill stopped: %s", e)
+            break
+        with conn:
+            conn.execute(
+                '''
+                INSERT INTO invite_links (invite_link, created_at, expire_date)
+                VALUES (?, ?, ?)
+                ON CONFLICT (invite_link) DO NOTHING
+                ''', (invite_link, time.time(), expire_date))
+        added += 1
+    if added:
+        logger.info("Invite pool refilled with %s links", added)
+    return added
+
+
+def revoke_stale(conn, batch_size=INVITE_POOL_REVOKE_BATCH):
+    """Revoke unclaimed links that are too close to expiry to hand out"""
+    now = int(time.time())
+    rows = conn.execute(
+        '''
+        SELECT id, invite_link, expire_date FROM invite_links
+        WHERE claimed_at IS NULL AND revoked_at IS NULL
+          AND expire_date IS NOT NULL AND expire_date <= ?
+        ORDER BY expire_date
+        LIMIT ?
+        ''', (now + INVITE_POOL_MIN_REMAINING, batch_size)).fetchall()
+
+    revoked = []
+    for link_id, invite_link, expire_date in rows:
+        # Links past their expiry are already dead on Telegram's side
+        if expire_date > now:
+            try:
+                revoke_invite_link(invite_link)
+            except Exception as e:
+                logger.warning("Failed to revoke stale invite link: %s", e)
+                continue
+        revoked.append((time.time(), link_id))
+
+    if revoked:
+        with conn:
+            conn.executemany(
+                "UPDATE invite_links SET revoked_at = ? WHERE id = ?",
+                revoked)
+        logger.info("Revoked %s stale invite links", len(revoked))
+    return len(revoked)
+
+
+def pool_stats(conn):
+    return {
+        'available': available_count(conn),
+        'target': target_size(conn),
+        'claimed_last_hour': conn.execute(
+            "SELECT COUNT(*) FROM invite_links WHERE claimed_at > ?",
+            (time.time() - RATE_WINDOW_SECONDS, )).fetchone()[0]
+    }
+
+
+class InvitePoolRefiller:
+    """Background thread keeping the pool topped up.
+
+    Every worker process runs one, but only the holder of the shared
+    ``invite_pool`` lease mints or revokes links.
+    """
+
+    def __init__(self, db_path=DB_PATH, interval=INVITE_POOL_REFILL_INTERVAL):
+        self.db_path = db_path
+        self.interval = interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name="invite-pool",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        conn = storage.get_connection(self.db_path)
+        try:
+            while not self._stop.is_set():
+                try:
+                    if storage.acquire_lease(conn, 'invite_pool',
+                                             self.owner, self.interval * 3):
+                        revoke_stale(conn)
+                        refill(conn)
+                except Exception as e:
+                    logger.error("Error maintaining invite pool: %s", e)
+                self._wake.wait(self.interval)
+                self._wake.clear()
+        finally:
+            storage.close_connection(self.db_path)
+
+
+_refiller = None
+_refiller_pid = None
+_refiller_lock = threading.Lock()
+
+
+def start_refiller():
+    """Start the pool refiller for this process if it is not running yet"""
+    global _refiller, _refiller_pid
+
+    pid = os.getpid()
+    if _refiller is None or _refiller_pid != pid:
+        with _refiller_lock:
+            if _refiller is None or _refiller_pid != pid:
+                refiller = InvitePoolRefiller()
+                refiller.start()
+                _refiller = refiller
+                _refiller_pid = pid
+    return _refiller
+
+
+def stop_refiller(timeout=5.0):
+    """Stop this process's pool refiller if it is running"""
+    global _refiller
+
+    with _refiller_lock:
+        current = _refiller if _refiller_pid == os.getpid() else None
+        _refiller = None
+    if current is not None:
+        current.stop(timeout)
+
+
+def wake():
+    start_refiller().wake()
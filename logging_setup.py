@@ -0,0 +1,164 @@
+# logging_setup.py
+"""Non-blocking logging: records go through a queue to a listener thread.
+
+Request threads only put the record on a queue. Formatting (JSON or text),
+redaction and the write to stderr all happen on the listener thread, and
+only for records that pass the level check. Call configure_logging() once
+at startup.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+from datetime import datetime, timezone
+
+from config import (BOT_TOKEN, PAYSTACK_SECRET_KEY, LOG_LEVEL, LOG_FORMAT,
+                    LOG_PAYLOAD_SAMPLE_RATE)
+
+REDACTED = "[REDACTED]"
+
+# Keys whose values never reach the logs when a payload is sampled
+SENSITIVE_KEYS = frozenset(('authorization', 'email', 'phone', 'signature',
+                            'token', 'secret', 'password', 'invite_link'))
+
+_SECRET_PATTERNS = [
+    re.compile(r"\bsk_(?:live|test)_[A-Za-z0-9]+"),
+    re.compile(r"\bbot\d+:[A-Za-z0-9_-]+"),
+]
+_SECRETS = [s for s in (BOT_TOKEN, PAYSTACK_SECRET_KEY) if s]
+
+# Attributes every LogRecord has; anything else came from `extra=`
+_RECORD_ATTRS = frozenset(
+    logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {
+        'message', 'asctime', 'taskName'}
+
+
+def redact(text):
+    """Mask the bot token, the Paystack key and anything shaped like them"""
+    for secret in _SECRETS:
+        text = text.replace(secret, REDACTED)
+    for pattern in _SECRET_PATTERNS:
+        text = pattern.sub(REDACTED, text)
+    return text
+
+
+def _mask(value):
+    if isinstance(value, dict):
+        return {
+            k: REDACTED if k.lower() in SENSITIVE_KEYS else _mask(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, list):
+        return [_mask(v) for v in value]
+    return value
+
+
+class _Payload:
+    """Defers masking and serialization until a record is formatted"""
+
+    __slots__ = ('value', )
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return json.dumps(_mask(self.value), default=str)
+
+
+def log_payload(logger, label, payload, rate=None):
+    """Log a sampled, masked copy of `payload` at DEBUG"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if random.random() >= (LOG_PAYLOAD_SAMPLE_RATE if rate is None else rate):
+        return
+    logger.debug("%s: %s", label, _Payload(payload))
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with `extra=` fields as top-level keys"""
+
+    def format(self, record):
+        created = datetime.fromtimestamp(record.created, timezone.utc)
+        entry = {
+            'time': created.isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return redact(json.dumps(entry, default=str, ensure_ascii=False))
+
+
+class RedactingFormatter(logging.Formatter):
+
+    def format(self, record):
+        return redact(super().format(record))
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    # The stock prepare() formats the message in the calling thread; leave
+    # that to the listener instead
+    def prepare(self, record):
+        return record
+
+
+_listener = None
+_queue_handler = None
+
+
+def _start_listener(handler):
+    global _listener
+    log_queue = queue.SimpleQueue()
+    _queue_handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue,
+                                               handler,
+                                               respect_handler_level=True)
+    _listener.start()
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    """Route the root logger through a queue to a stderr listener thread"""
+    global _queue_handler
+
+    if _queue_handler is not None:
+        return
+
+    handler = logging.StreamHandler(sys.stderr)
+    if fmt == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(
+            RedactingFormatter(
+                '%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    _queue_handler = _DeferredQueueHandler(queue.SimpleQueue())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+    # urllib3 logs every pooled connection at DEBUG
+    logging.getLogger('urllib3').setLevel(max(root.level, logging.INFO))
+
+    _start_listener(handler)
+    # The listener thread does not survive fork, so each gunicorn worker
+    # starts its own on a fresh queue
+    os.register_at_fork(after_in_child=lambda: _start_listener(handler))
+    atexit.register(_stop_listener)
@@ -1,4 +1,6 @@
+import app as app_module
 from app import app  # noqa: F401
 
 if __name__ == "__main__":
+    app_module.start_background()
     app.run(host="0.0.0.0", port=5000, debug=True)
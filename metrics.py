@@ -0,0 +1,417 @@
+# metrics.py
+"""In-process counters, histograms and gauges with Prometheus text output.
+
+Every metric child holds preallocated bucket counts behind its own lock, so
+recording a value is a bisect and a few integer adds. Each worker process
+writes a JSON snapshot of its metrics to METRICS_DIR every
+METRICS_FLUSH_INTERVAL seconds. render() merges the snapshots of all live
+workers, so /metrics shows the whole gunicorn server no matter which
+worker answers the scrape. A dead worker's counters and histograms are
+folded into a shared accumulator file before its snapshot is removed, so
+merged totals never go down when gunicorn recycles a worker; its gauges are
+dropped.
+"""
+
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from config import METRICS_DIR, METRICS_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers a cached SQLite read up to a slow Bot API call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = {}
+_gauges = {}
+_registry_lock = threading.Lock()
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One slot per bound plus +Inf; cumulated only when rendering
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            return [list(self.counts), self.sum]
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry[name] = self
+
+    def labels(self, *values):
+        """Return the child for these label values, creating it once"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def _reset(self):
+        self._children = {}
+
+    def snapshot(self):
+        return {
+            'kind': self.kind,
+            'help': self.help,
+            'labelnames': list(self.labelnames),
+            'values': [[list(labels), child.snapshot()]
+                       for labels, child in list(self._children.items())]
+        }
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot['buckets'] = list(self.bounds)
+        return snapshot
+
+
+def gauge(name, help, func, merge='sum'):
+    """Register a gauge whose value is read from `func()` at snapshot time.
+
+    Per-process values (queue depths) are summed across workers; use
+    ``merge='max'`` for values every worker reads from shared state.
+    """
+    with _registry_lock:
+        _gauges[name] = (help, func, merge)
+
+
+def snapshot():
+    """This process's metrics as a JSON-serializable dict"""
+    metrics = {name: metric.snapshot() for name, metric in
+               list(_registry.items())}
+    for name, (help, func, merge) in list(_gauges.items()):
+        try:
+            value = float(func())
+        except Exception as e:
+            logger.debug("Gauge %s failed: %s", name, e)
+            continue
+        metrics[name] = {
+            'kind': 'gauge',
+            'help': help,
+            'merge': merge,
+            'labelnames': [],
+            'values': [[[], value]]
+        }
+    return {'pid': os.getpid(), 'time': time.time(), 'metrics': metrics}
+
+
+def _snapshot_path(pid):
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+
+def _dead_path():
+    # Counter and histogram totals of every worker that has exited
+    return os.path.join(METRICS_DIR, "dead.json")
+
+
+@contextmanager
+def _dir_lock(mode):
+    """flock on METRICS_DIR: shared to read snapshots, exclusive to fold"""
+    with open(os.path.join(METRICS_DIR, ".lock"), 'a') as lock:
+        fcntl.flock(lock, mode)
+        yield
+
+
+def flush():
+    """Write this process's snapshot for the other workers to read"""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write_snapshot(_snapshot_path(os.getpid()), snapshot())
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_snapshot(path, snap):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(snap, f)
+    os.replace(tmp, path)
+
+
+def _worker_snapshots():
+    """(pid, path) of every worker snapshot in METRICS_DIR"""
+    try:
+        names = os.listdir(METRICS_DIR)
+    except FileNotFoundError:
+        return []
+    return [(int(name[:-5]), os.path.join(METRICS_DIR, name))
+            for name in names
+            if name.endswith('.json') and name[:-5].isdigit()]
+
+
+def _fold_dead(path):
+    """Add a dead worker's counters and histograms to dead.json, then
+    remove its snapshot. Gauges end with the worker.
+    """
+    with _dir_lock(fcntl.LOCK_EX):
+        # Another worker's scrape may have folded it already
+        if not os.path.exists(path):
+            return
+        snap = _read_snapshot(path)
+        if snap is not None:
+            snapshots = [{
+                'metrics': {
+                    name: metric
+                    for name, metric in snap['metrics'].items()
+                    if metric['kind'] != 'gauge'
+                }
+            }]
+            dead = _read_snapshot(_dead_path())
+            if dead is not None:
+                snapshots.append(dead)
+            _write_snapshot(_dead_path(), {
+                'pid': None,
+                'time': time.time(),
+                'metrics': _as_snapshot(_merge(snapshots))
+            })
+        os.remove(path)
+
+
+def _load_snapshots():
+    own = snapshot()
+    for pid, path in _worker_snapshots():
+        if pid != own['pid'] and not _pid_alive(pid):
+            try:
+                _fold_dead(path)
+            except OSError as e:
+                logger.warning("Failed to fold metrics of worker %s: %s", pid,
+                               e)
+
+    snapshots = [own]
+    if not os.path.isdir(METRICS_DIR):
+        return snapshots
+    # Folding moves a worker's totals from its file to dead.json; reading
+    # both under the shared lock counts them exactly once
+    with _dir_lock(fcntl.LOCK_SH):
+        for pid, path in _worker_snapshots():
+            if pid != own['pid']:
+                snap = _read_snapshot(path)
+                if snap is not None:
+                    snapshots.append(snap)
+        dead = _read_snapshot(_dead_path())
+        if dead is not None:
+            snapshots.append(dead)
+    return snapshots
+
+
+def _merge(snapshots):
+    merged = {}
+    for snap in snapshots:
+        for name, metric in snap['metrics'].items():
+            target = merged.setdefault(name, {
+                'kind': metric['kind'],
+                'help': metric['help'],
+                'labelnames': metric['labelnames'],
+                'buckets': metric.get('buckets'),
+                'values': {}
+            })
+            values = target['values']
+            for labels, value in metric['values']:
+                key = tuple(labels)
+                if metric['kind'] == 'histogram':
+                    counts, total = value
+                    current = values.get(key)
+                    if current is None:
+                        values[key] = [list(counts), total]
+                    else:
+                        current[0] = [a + b for a, b in zip(current[0], counts)]
+                        current[1] += total
+                elif metric.get('merge') == 'max':
+                    values[key] = max(values.get(key, value), value)
+                else:
+                    values[key] = values.get(key, 0.0) + value
+    return merged
+
+
+def _as_snapshot(merged):
+    """The snapshot 'metrics' dict for the output of _merge()"""
+    metrics = {}
+    for name, metric in merged.items():
+        metrics[name] = {
+            'kind': metric['kind'],
+            'help': metric['help'],
+            'labelnames': metric['labelnames'],
+            'values': [[list(labels), value]
+                       for labels, value in metric['values'].items()]
+        }
+        if metric['buckets'] is not None:
+            metrics[name]['buckets'] = metric['buckets']
+    return metrics
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n')
+
+
+def _label_str(labelnames, labels, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def render():
+    """Prometheus text exposition for all live workers"""
+    lines = []
+    for name, metric in sorted(_merge(_load_snapshots()).items()):
+        kind = metric['kind']
+        names = metric['labelnames']
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(metric['values'].items()):
+            if kind != 'histogram':
+                lines.append(
+                    f"{name}{_label_str(names, labels)} {_format_value(value)}")
+                continue
+            counts, total = value
+            cumulative = 0
+            for bound, count in zip(metric['buckets'] + ['+Inf'], counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == '+Inf' else f'le="{bound}"'
+                lines.append(f"{name}_bucket{_label_str(names, labels, le)} "
+                             f"{cumulative}")
+            lines.append(f"{name}_sum{_label_str(names, labels)} {total!r}")
+            lines.append(
+                f"{name}_count{_label_str(names, labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+def _reset_after_fork():
+    # A forked worker starts from zero instead of repeating the parent's
+    # counts under its own pid
+    global _flusher_pid
+    for metric in list(_registry.values()):
+        metric._reset()
+    _flusher_pid = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _flush_forever():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            logger.warning("Failed to write metrics snapshot: %s", e)
+
+
+def start_flusher():
+    """Start this process's snapshot writer if it is not running yet"""
+    global _flusher_pid
+
+    pid = os.getpid()
+    if _flusher_pid != pid:
+        with _flusher_lock:
+            if _flusher_pid != pid:
+                threading.Thread(target=_flush_forever,
+                                 name="metrics-flusher",
+                                 daemon=True).start()
+                _flusher_pid = pid
+
+
+@atexit.register
+def _final_flush():
+    # Counts since the last periodic flush would otherwise be lost when the
+    # worker exits and its snapshot is folded into dead.json
+    if _flusher_pid == os.getpid():
+        try:
+            flush()
+        except Exception as e:
+            logger.warning("Failed to write metrics snapshot: %s", e)
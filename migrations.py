@@ -0,0 +1,96 @@
+# migrations.py
+"""Versioned schema changes, applied once per database.
+
+schema_version records every applied step. migrate() takes a database-wide
+lock first, so when several workers or instances start at once one of them
+applies the pending steps and the others find nothing left to do. Once the
+database is current, migrate() is a single read. Append new
+steps to MIGRATIONS; never edit or renumber one that has shipped.
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+
+import broadcast
+import invite_pool
+import outbox
+import storage
+
+logger = logging.getLogger(__name__)
+
+# pg_advisory_xact_lock key serializing migrations across instances
+LOCK_ID = 0x7061797374616b
+
+
+def _base_schema(conn):
+    storage.init_schema(conn)
+    outbox.init_outbox(conn)
+    invite_pool.init_pool(conn)
+    storage.init_indexes(conn)
+
+
+# (version, description, step); steps run inside the migration transaction
+# and must not commit it themselves
+MIGRATIONS = (
+    (1, "payments, rollups, outbox and invite pool tables", _base_schema),
+    (2, "backfill revenue rollups", storage.backfill_rollups),
+    (3, "broadcasts table and payments chat_id index",
+     broadcast.init_broadcasts),
+)
+
+
+@contextmanager
+def _schema_lock(conn):
+    if storage.DIALECT == 'postgres':
+        with conn:
+            conn.execute("SELECT pg_advisory_xact_lock(?)", (LOCK_ID, ))
+            yield
+        return
+
+    # BEGIN IMMEDIATE takes SQLite's write lock before reading the version
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def current_version(conn):
+    return conn.execute(
+        "SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Apply pending migrations. Returns the versions applied by this call."""
+    # Up-to-date databases are the common case: one read, no lock
+    try:
+        if current_version(conn) >= MIGRATIONS[-1][0]:
+            return []
+    except Exception:
+        pass  # schema_version does not exist yet
+
+    applied = []
+    with _schema_lock(conn):
+        conn.execute(
+            storage.ddl('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at {real} NOT NULL
+            )
+        '''))
+        current = current_version(conn)
+        for version, description, step in MIGRATIONS:
+            if version <= current:
+                continue
+            logger.info("Applying schema migration %d: %s", version,
+                        description)
+            step(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) "
+                "VALUES (?, ?, ?)", (version, description, time.time()))
+            applied.append(version)
+    return applied
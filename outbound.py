@@ -0,0 +1,377 @@
+# outbound.py
+
+import atexit
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import telegram_client
+from config import (OUTBOUND_GLOBAL_RATE, OUTBOUND_PROCESSES,
+                    OUTBOUND_PER_CHAT_INTERVAL, OUTBOUND_WORKERS, OUTBOUND_QUEUE_MAX, OUTBOUND_MAX_RETRIES,
+                    OUTBOUND_COALESCE)
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+MAX_BACKOFF = 60.0
+
+# Returned by _deliver for a message that will not be retried
+_DROPPED = object()
+
+
+class TokenBucket:
+    """Thread-safe token bucket used for the bot-wide send rate"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token without blocking: 0 on success, else seconds to wait"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._tokens = min(self.capacity, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Block until a token is available"""
+        while True:
+            delay = self.reserve()
+            if not delay:
+                return
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for the given number of seconds"""
+        with self._lock:
+            self._paused_until = max(self._paused_until,
+                                     time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+class _Message:
+    __slots__ = ('chat_id', 'text', 'parse_mode', 'reply_markup', 'attempts')
+
+    def __init__(self, chat_id, text, parse_mode=None, reply_markup=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.parse_mode = parse_mode
+        self.reply_markup = reply_markup
+        self.attempts = 0
+
+
+class _ChatState:
+    __slots__ = ('messages', 'next_allowed', 'scheduled', 'busy')
+
+    def __init__(self):
+        self.messages = deque()
+        self.next_allowed = 0.0
+        self.scheduled = False
+        self.busy = False
+
+
+class OutboundDispatcher:
+    """Background sender that paces messages to Telegram's rate limits.
+
+    Messages are queued per chat. Worker threads pick the chat that is due
+    soonest, so one chat never gets more than one message per
+    ``per_chat_interval`` while this process stays under ``global_rate``,
+    its share of the bot-wide OUTBOUND_GLOBAL_RATE. Messages for a single
+    chat are always delivered in order.
+    """
+
+    def __init__(self,
+                 global_rate=OUTBOUND_GLOBAL_RATE / max(OUTBOUND_PROCESSES, 1),
+                 per_chat_interval=OUTBOUND_PER_CHAT_INTERVAL,
+                 workers=OUTBOUND_WORKERS,
+                 max_queue=OUTBOUND_QUEUE_MAX,
+                 max_retries=OUTBOUND_MAX_RETRIES,
+                 coalesce=OUTBOUND_COALESCE):
+        self.limiter = TokenBucket(global_rate)
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.coalesce = coalesce
+
+        self._cond = threading.Condition()
+        self._chats = {}
+        self._ready = []
+        self._seq = itertools.count()
+        self._depth = 0
+        self._threads = []
+        self._stopping = False
+        self._last_prune = time.monotonic()
+        self._counters = {
+            'enqueued': 0,
+            'sent': 0,
+            'coalesced': 0,
+            'retried': 0,
+            'rate_limited': 0,
+            'dropped': 0,
+            'rejected': 0
+        }
+
+    def start(self):
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run,
+                                          name=f"outbound-{i}",
+                                          daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        logger.info("Outbound dispatcher started with %s workers",
+                    self.workers)
+
+    def stop(self, timeout=5.0):
+        """Stop the workers, giving queued messages up to `timeout` to drain"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        if self._depth:
+            logger.warning(
+                "Outbound dispatcher stopped with %s undelivered messages",
+                self._depth)
+
+    def enqueue(self, chat_id, text, parse_mode=None, reply_markup=None):
+        """Queue a message for delivery. Returns False if the queue is full."""
+        with self._cond:
+            if self._depth >= self.max_queue or self._stopping:
+                self._counters['rejected'] += 1
+                return False
+
+            state = self._chats.get(chat_id)
+            if state is None:
+                state = self._chats[chat_id] = _ChatState()
+            state.messages.append(
+                _Message(chat_id, text, parse_mode, reply_markup))
+            self._depth += 1
+            self._counters['enqueued'] += 1
+            self._schedule(chat_id, state)
+        return True
+
+    def has_pending(self, chat_id):
+        """True if a message for the chat is queued or being sent"""
+        with self._cond:
+            state = self._chats.get(chat_id)
+            return state is not None and (bool(state.messages) or state.busy)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats['queue_depth'] = self._depth
+            stats['active_chats'] = len(self._chats)
+        return stats
+
+    # Internal helpers below are called with self._cond held
+
+    def _schedule(self, chat_id, state):
+        if state.scheduled or state.busy or not state.messages:
+            return
+        state.scheduled = True
+        heapq.heappush(self._ready,
+                       (state.next_allowed, next(self._seq), chat_id))
+        self._cond.notify()
+
+    def _take_batch(self, state):
+        first = state.messages.popleft()
+        if not self.coalesce or first.reply_markup:
+            return first
+
+        # Merge a burst of plain replies to the same chat into one message
+        parts = [first.text]
+        length = len(first.text)
+        while state.messages:
+            nxt = state.messages[0]
+            if (nxt.reply_markup or nxt.parse_mode != first.parse_mode
+                    or length + 2 + len(nxt.text) > MAX_MESSAGE_LENGTH):
+                break
+            state.messages.popleft()
+            parts.append(nxt.text)
+            length += 2 + len(nxt.text)
+            self._depth -= 1
+            self._counters['coalesced'] += 1
+
+        if len(parts) > 1:
+            first.text = "\n\n".join(parts)
+        return first
+
+    def _prune(self, now):
+        if now - self._last_prune < 30:
+            return
+        self._last_prune = now
+        for chat_id in [
+                c for c, s in self._chats.items() if not s.messages
+                and not s.busy and s.next_allowed < now
+        ]:
+            del self._chats[chat_id]
+
+    def _next_message(self):
+        with self._cond:
+            while True:
+                if self._stopping and not self._depth:
+                    return None
+                if not self._ready:
+                    self._cond.wait(1.0)
+                    continue
+                ready_at, _, chat_id = self._ready[0]
+                now = time.monotonic()
+                if ready_at > now:
+                    self._cond.wait(ready_at - now)
+                    continue
+                heapq.heappop(self._ready)
+                state = self._chats[chat_id]
+                state.scheduled = False
+                state.busy = True
+                self._prune(now)
+                return self._take_batch(state)
+
+    def _run(self):
+        while True:
+            message = self._next_message()
+            if message is None:
+                return
+            self.limiter.acquire()
+            retry_after = self._deliver(message)
+            self._finish(message, retry_after)
+
+    def _deliver(self, message):
+        """Send one message. Returns None on success, _DROPPED or a retry delay."""
+        data = {"chat_id": message.chat_id, "text": message.text}
+        if message.parse_mode:
+            data['parse_mode'] = message.parse_mode
+        if message.reply_markup:
+            data['reply_markup'] = json.dumps(message.reply_markup)
+
+        try:
+            response = telegram_client.call("sendMessage", data)
+        except Exception as e:
+            logger.warning("Error sending queued message to chat %s: %s",
+                           message.chat_id, e)
+            return self._backoff(message)
+
+        if response.status_code == 200:
+            return None
+
+        if response.status_code == 429:
+            try:
+                retry_after = float(response.json().get('parameters', {}).get(
+                    'retry_after', 1))
+            except ValueError:
+                retry_after = 1.0
+            logger.warning("Rate limited by Telegram, retrying chat %s in %ss",
+                           message.chat_id, retry_after)
+            with self._cond:
+                self._counters['rate_limited'] += 1
+            self.limiter.pause(retry_after)
+            return retry_after
+
+        if response.status_code >= 500:
+            return self._backoff(message)
+
+        # 400/403 etc. will not succeed on retry (blocked bot, bad chat id)
+        logger.error("Dropping message to chat %s: %s", message.chat_id,
+                     response.text)
+        with self._cond:
+            self._counters['dropped'] += 1
+        return _DROPPED
+
+    def _backoff(self, message):
+        message.attempts += 1
+        if message.attempts > self.max_retries:
+            logger.error("Giving up on message to chat %s after %s attempts",
+                         message.chat_id, message.attempts)
+            with self._cond:
+                self._counters['dropped'] += 1
+            return _DROPPED
+        with self._cond:
+            self._counters['retried'] += 1
+        delay = min(2**message.attempts, MAX_BACKOFF)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _finish(self, message, retry_after):
+        with self._cond:
+            state = self._chats[message.chat_id]
+            now = time.monotonic()
+            if retry_after is not None and retry_after is not _DROPPED:
+                # Retry, even after 0 seconds. Put the message back at the
+                # head so chat order is preserved
+                state.messages.appendleft(message)
+                state.next_allowed = now + retry_after
+            else:
+                self._depth -= 1
+                if retry_after is None:
+                    self._counters['sent'] += 1
+                state.next_allowed = now + self.per_chat_interval
+            state.busy = False
+            self._schedule(message.chat_id, state)
+            if self._stopping and not self._depth:
+                self._cond.notify_all()
+
+
+_dispatcher = None
+_dispatcher_pid = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Return this worker's dispatcher, starting it on first use"""
+    global _dispatcher, _dispatcher_pid
+
+    pid = os.getpid()
+    if _dispatcher is None or _dispatcher_pid != pid:
+        with _dispatcher_lock:
+            if _dispatcher is None or _dispatcher_pid != pid:
+                dispatcher = OutboundDispatcher()
+                dispatcher.start()
+                _dispatcher = dispatcher
+                _dispatcher_pid = pid
+    return _dispatcher
+
+
+def enqueue_message(chat_id, text, parse_mode=None, reply_markup=None):
+    """Queue a Telegram message for background delivery"""
+    return get_dispatcher().enqueue(chat_id, text, parse_mode, reply_markup)
+
+
+def has_pending(chat_id):
+    """True if this worker still has a message to deliver to the chat"""
+    if _dispatcher is None or _dispatcher_pid != os.getpid():
+        return False
+    return _dispatcher.has_pending(chat_id)
+
+
+def dispatcher_stats():
+    if _dispatcher is None or _dispatcher_pid != os.getpid():
+        return {'queue_depth': 0, 'running': False}
+    stats = _dispatcher.stats()
+    stats['running'] = True
+    return stats
+
+
+@atexit.register
+def _shutdown():
+    if _dispatcher is not None and _dispatcher_pid == os.getpid():
+        _dispatcher.stop()
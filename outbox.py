@@ -0,0 +1,223 @@
+# outbox.py
+
+import json
+import logging
+import os
+import threading
+import time
+
+import storage
+from config import (DB_PATH, OUTBOX_POLL_INTERVAL, OUTBOX_LEASE_SECONDS,
+                    OUTBOX_MAX_ATTEMPTS)
+
+logger = logging.getLogger(__name__)
+
+MAX_BACKOFF = 300
+
+_handlers = {}
+
+
+def init_outbox(conn):
+    """Create the outbox table on an open connection"""
+    c = conn.cursor()
+    c.execute(storage.ddl('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id {pk},
+            kind TEXT NOT NULL,
+            dedupe_key TEXT UNIQUE,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at {real} NOT NULL,
+            locked_until {real},
+            last_error TEXT,
+            created_at {real} NOT NULL,
+            completed_at {real}
+        )
+    '''))
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_outbox_pending
+        ON outbox (status, next_attempt_at)
+    ''')
+
+
+def add_job(conn, kind, payload, dedupe_key=None):
+    """Add a job inside the caller's transaction (committed with it)"""
+    now = time.time()
+    conn.execute(
+        '''
+        INSERT INTO outbox (kind, dedupe_key, payload, next_attempt_at, created_at)
+        VALUES (?, ?, ?, ?, ?)
+        ''', (kind, dedupe_key, json.dumps(payload), now, now))
+
+
+def add_invite_job(conn, reference, chat_id, amount):
+    """Queue delivery of a payment's invite link (app.deliver_invite runs it)"""
+    add_job(conn,
+            'deliver_invite', {
+                'reference': reference,
+                'chat_id': chat_id,
+                'amount': amount
+            },
+            dedupe_key=f"invite:{reference}")
+
+
+def register_handler(kind, func):
+    """Register `func(payload, attempts)` to run jobs of the given kind"""
+    _handlers[kind] = func
+
+
+def claim_job(conn):
+    """Lease the oldest due job, or return None if there is nothing to do"""
+    now = time.time()
+    with conn:
+        row = conn.execute(
+            f'''
+            UPDATE outbox
+            SET locked_until = ?, attempts = attempts + 1
+            WHERE id = (
+                SELECT id FROM outbox
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                  AND (locked_until IS NULL OR locked_until < ?)
+                ORDER BY next_attempt_at, id
+                LIMIT 1{storage.SKIP_LOCKED}
+            )
+            RETURNING id, kind, payload, attempts
+            ''', (now + OUTBOX_LEASE_SECONDS, now, now)).fetchone()
+    return row
+
+
+def complete_job(conn, job_id):
+    with conn:
+        conn.execute(
+            "UPDATE outbox SET status = 'done', completed_at = ?, "
+            "locked_until = NULL WHERE id = ?", (time.time(), job_id))
+
+
+def fail_job(conn, job_id, attempts, error):
+    """Schedule a retry with exponential backoff, or mark the job failed"""
+    if attempts >= OUTBOX_MAX_ATTEMPTS:
+        status, next_attempt = 'failed', time.time()
+        logger.error("Outbox job %s failed permanently: %s", job_id, error)
+    else:
+        status = 'pending'
+        next_attempt = time.time() + min(2**attempts, MAX_BACKOFF)
+        logger.warning("Outbox job %s failed (attempt %s), retrying: %s",
+                       job_id, attempts, error)
+    with conn:
+        conn.execute(
+            '''
+            UPDATE outbox
+            SET status = ?, next_attempt_at = ?, locked_until = NULL, last_error = ?
+            WHERE id = ?
+            ''', (status, next_attempt, str(error)[:500], job_id))
+
+
+def run_job(conn, job):
+    job_id, kind, payload, attempts = job
+    handler = _handlers.get(kind)
+    if handler is None:
+        fail_job(conn, job_id, OUTBOX_MAX_ATTEMPTS,
+                 f"No handler for job kind {kind}")
+        return
+    try:
+        handler(json.loads(payload), attempts)
+    except Exception as e:
+        fail_job(conn, job_id, attempts, e)
+    else:
+        complete_job(conn, job_id)
+
+
+def drain(conn, max_jobs=None):
+    """Run due jobs until none are left. Returns the number processed."""
+    processed = 0
+    while max_jobs is None or processed < max_jobs:
+        job = claim_job(conn)
+        if job is None:
+            break
+        run_job(conn, job)
+        processed += 1
+    return processed
+
+
+def outbox_stats(conn):
+    rows = conn.execute(
+        "SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+    stats = {'pending': 0, 'done': 0, 'failed': 0}
+    stats.update(dict(rows))
+    return stats
+
+
+class OutboxWorker:
+    """Background thread that drains the outbox for this worker process"""
+
+    def __init__(self, db_path=DB_PATH, poll_interval=OUTBOX_POLL_INTERVAL):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name="outbox-worker",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        conn = storage.get_connection(self.db_path)
+        try:
+            while not self._stop.is_set():
+                try:
+                    drain(conn)
+                except Exception as e:
+                    logger.error("Error draining outbox: %s", e)
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+        finally:
+            storage.close_connection(self.db_path)
+
+
+_worker = None
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+
+def start_worker():
+    """Start the outbox worker for this process if it is not running yet"""
+    global _worker, _worker_pid
+
+    pid = os.getpid()
+    if _worker is None or _worker_pid != pid:
+        with _worker_lock:
+            if _worker is None or _worker_pid != pid:
+                worker = OutboxWorker()
+                worker.start()
+                _worker = worker
+                _worker_pid = pid
+    return _worker
+
+
+def stop_worker(timeout=5.0):
+    """Stop this process's outbox worker if it is running"""
+    global _worker
+
+    with _worker_lock:
+        current = _worker if _worker_pid == os.getpid() else None
+        _worker = None
+    if current is not None:
+        current.stop(timeout)
+
+
+def wake():
+    """Nudge the worker to pick up a job that was just committed"""
+    start_worker().wake()
@@ -0,0 +1,186 @@
+# polling.py
+"""getUpdates long-polling runner, an alternative to the Flask webhook.
+
+Enable it with UPDATE_MODE=polling (the app starts it in the background), or
+run ``python polling.py`` to poll in the foreground.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+import telegram_client
+import update_dedupe
+from bot_handlers import process_update, update_chat_id
+from config import (POLLING_TIMEOUT, POLLING_LIMIT, POLLING_WORKERS,
+                    TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_READ_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+OFFSET_KEY = 'polling_offset'
+MAX_BACKOFF = 30
+
+
+class UpdatePoller:
+    """Fetch updates in batches and process each batch concurrently.
+
+    Updates for different chats run in parallel; updates for the same chat
+    run in order. The offset is saved only after a batch has been handled,
+    and the next getUpdates call confirms it to Telegram, so a restart
+    neither skips nor repeats a finished batch. Only the holder of the shared
+    ``polling`` lease polls, because Telegram rejects concurrent getUpdates.
+    """
+
+    def __init__(self,
+                 process=process_update,
+                 workers=POLLING_WORKERS,
+                 timeout=POLLING_TIMEOUT,
+                 limit=POLLING_LIMIT):
+        self.process = process
+        self.timeout = timeout
+        self.limit = limit
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix="poll-worker")
+        self._stop = threading.Event()
+        self._thread = None
+
+    def fetch(self, offset):
+        payload = {
+            'timeout': self.timeout,
+            'limit': self.limit,
+            'allowed_updates': ['message', 'callback_query']
+        }
+        if offset is not None:
+            payload['offset'] = offset
+
+        response = telegram_client.call(
+            'getUpdates',
+            payload,
+            timeout=(TELEGRAM_CONNECT_TIMEOUT,
+                     self.timeout + TELEGRAM_READ_TIMEOUT))
+        result = response.json()
+        if not result.get('ok'):
+            raise RuntimeError(f"getUpdates failed: {result}")
+        return result['result']
+
+    def _process_chain(self, updates):
+        for update in updates:
+            # Claimed only right before it runs: a crash mid-batch leaves the
+            # rest unclaimed, so the redelivered batch still processes them
+            if update_dedupe.is_duplicate(update):
+                continue
+            self.process(update)
+
+    def process_batch(self, updates):
+        """Run a batch, keeping per-chat order, and wait for it to finish"""
+        chains = {}
+        for update in updates:
+            chains.setdefault(update_chat_id(update), []).append(update)
+
+        futures = [
+            self._executor.submit(self._process_chain, chain)
+            for chain in chains.values()
+        ]
+        for future in futures:
+            future.result()
+
+    def run_once(self, conn):
+        """Poll once and process what arrives. Returns the number of updates."""
+        offset = storage.get_state(conn, OFFSET_KEY)
+        updates = self.fetch(int(offset) if offset is not None else None)
+        if not updates:
+            return 0
+
+        self.process_batch(updates)
+        storage.set_state(conn, OFFSET_KEY,
+                          max(u['update_id'] for u in updates) + 1)
+        return len(updates)
+
+    def run_forever(self):
+        conn = storage.get_connection()
+        failures = 0
+        webhook_cleared = False
+        lease_ttl = self.timeout + TELEGRAM_READ_TIMEOUT + 30
+
+        while not self._stop.is_set():
+            try:
+                if not storage.acquire_lease(conn, 'polling', self.owner,
+                                             lease_ttl):
+                    self._stop.wait(self.timeout)
+                    continue
+                if not webhook_cleared:
+                    # getUpdates returns 409 while a webhook is registered
+                    telegram_client.call('deleteWebhook')
+                    webhook_cleared = True
+                self.run_once(conn)
+                failures = 0
+            except Exception as e:
+                failures += 1
+                delay = min(2**failures, MAX_BACKOFF)
+                logger.error("Polling failed, retrying in %ss: %s", delay, e)
+                self._stop.wait(delay)
+
+        storage.close_connection()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run_forever,
+                                        name="update-poller",
+                                        daemon=True)
+        self._thread.start()
+        logger.info("Started getUpdates long polling")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
+
+
+_poller = None
+_poller_pid = None
+_poller_lock = threading.Lock()
+
+
+def start_poller():
+    """Start polling in the background for this process if not running yet"""
+    global _poller, _poller_pid
+
+    pid = os.getpid()
+    if _poller is None or _poller_pid != pid:
+        with _poller_lock:
+            if _poller is None or _poller_pid != pid:
+                poller = UpdatePoller()
+                poller.start()
+                _poller = poller
+                _poller_pid = pid
+    return _poller
+
+
+def stop_poller(timeout=5.0):
+    """Stop this process's poller if it is running"""
+    global _poller
+
+    with _poller_lock:
+        current = _poller if _poller_pid == os.getpid() else None
+        _poller = None
+    if current is not None:
+        current.stop(timeout)
+
+
+if __name__ == '__main__':
+    import app  # noqa: F401  (configures logging and initializes the database)
+    import polling
+
+    # Go through the imported module rather than __main__ so this shares the
+    # poller the app starts when UPDATE_MODE=polling
+    poller = polling.start_poller()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        poller.stop(timeout=5)
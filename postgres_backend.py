@@ -0,0 +1,199 @@
+# postgres_backend.py
+"""PostgreSQL connections that behave like the sqlite3 ones storage uses.
+
+Statements keep sqlite3's ``?`` placeholders and are translated once per
+distinct text. Connections run in autocommit mode, so a plain read never
+leaves a transaction open; ``with conn:`` opens one and commits or rolls it
+back when the outermost block exits. Each worker process has its own
+ThreadedConnectionPool, and a thread keeps the connection it checked out
+until it closes it or exits.
+"""
+
+import logging
+import os
+import threading
+import time
+import weakref
+
+try:
+    import psycopg2
+    import psycopg2.pool
+except ImportError:
+    psycopg2 = None
+
+from config import DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+# Pools inherited from a parent process across fork; closing their
+# connections in the child would end the parent's sessions
+_inherited = []
+
+# sqlite3 statement text -> psycopg2 statement text
+_statements = {}
+
+
+def _translate(sql):
+    statement = _statements.get(sql)
+    if statement is None:
+        statement = sql.replace('%', '%%').replace('?', '%s')
+        if len(_statements) < 1000:
+            _statements[sql] = statement
+    return statement
+
+
+class _Cursor:
+
+    def __init__(self, cursor, record_query):
+        self._cursor = cursor
+        self._record_query = record_query
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            # An empty tuple still makes psycopg2 unescape %%
+            self._cursor.execute(_translate(sql), tuple(parameters))
+        finally:
+            self._record_query(sql, time.perf_counter() - start)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            self._cursor.executemany(_translate(sql), seq_of_parameters)
+        finally:
+            self._record_query(sql, time.perf_counter() - start)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone() if self._cursor.description else None
+
+    def fetchall(self):
+        return self._cursor.fetchall() if self._cursor.description else []
+
+    def fetchmany(self, size=1):
+        return self._cursor.fetchmany(size) if self._cursor.description else []
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class PgConnection:
+    """The subset of sqlite3.Connection that storage and its callers use"""
+
+    def __init__(self, raw, record_query):
+        self.raw = raw
+        self.raw.autocommit = True
+        self._record_query = record_query
+        self._depth = 0
+
+    def cursor(self):
+        return _Cursor(self.raw.cursor(), self._record_query)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    @property
+    def in_transaction(self):
+        return self._depth > 0
+
+    @property
+    def closed(self):
+        return bool(self.raw.closed)
+
+    def __enter__(self):
+        if self._depth == 0:
+            # psycopg2 issues BEGIN before the next statement
+            self.raw.autocommit = False
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if self._depth == 0 and not self.raw.closed:
+            try:
+                if exc_type is None:
+                    self.raw.commit()
+                else:
+                    self.raw.rollback()
+            finally:
+                self.raw.autocommit = True
+        return False
+
+    def commit(self):
+        if not self.raw.autocommit:
+            self.raw.commit()
+
+    def rollback(self):
+        if not self.raw.autocommit:
+            self.raw.rollback()
+
+    def close(self):
+        """Hand the connection back to the pool"""
+        self._finalizer()
+
+
+def _get_pool():
+    global _pool, _pool_pid
+
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                if psycopg2 is None:
+                    raise RuntimeError(
+                        "STORAGE_BACKEND=postgres needs psycopg2 "
+                        "(pip install psycopg2-binary)")
+                if _pool is not None:
+                    _inherited.append(_pool)
+                _pool = psycopg2.pool.ThreadedConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX, DATABASE_URL)
+                _pool_pid = pid
+    return _pool
+
+
+def _release(pool, raw, pid):
+    if os.getpid() != pid:
+        return
+    try:
+        # Rolls back anything left open and drops broken connections
+        pool.putconn(raw, close=bool(raw.closed))
+    except Exception as e:
+        logger.debug("Could not return connection to the pool: %s", e)
+
+
+def connect(record_query):
+    """Check a connection out of this process's pool for the calling thread.
+
+    `record_query(sql, elapsed)` is called after every statement. The
+    connection goes back to the pool on close() or when it is garbage
+    collected with its thread.
+    """
+    pool = _get_pool()
+    try:
+        raw = pool.getconn()
+    except psycopg2.pool.PoolError:
+        raise RuntimeError(
+            f"All {DB_POOL_MAX} PostgreSQL connections of this worker are in "
+            "use; raise DB_POOL_MAX") from None
+    conn = PgConnection(raw, record_query)
+    conn._finalizer = weakref.finalize(conn, _release, pool, raw, os.getpid())
+    return conn
@@ -0,0 +1,170 @@
+# profiling.py
+"""Opt-in request profiling and slow-request capture.
+
+While a request is traced, span() and add_span() add up time per named
+call site (SQLite, Bot API calls, signature checks) for the current
+thread. PROFILE_SAMPLE_RATE of requests also run under cProfile. A request
+slower than SLOW_REQUEST_MS is written to PROFILE_DIR as a JSON summary,
+holding its spans and, when it was profiled, the frames with the most self
+time plus a .prof file for pstats/snakeviz. Only the newest PROFILE_KEEP
+captures are kept.
+
+With both settings at 0 nothing is hooked into Flask, and span() and
+add_span() return after one global check.
+"""
+
+import cProfile
+import glob
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from config import (PROFILE_SAMPLE_RATE, SLOW_REQUEST_MS, PROFILE_DIR,
+                    PROFILE_KEEP)
+
+logger = logging.getLogger(__name__)
+
+TOP_FRAMES = 15
+
+ENABLED = PROFILE_SAMPLE_RATE > 0 or SLOW_REQUEST_MS > 0
+
+_local = threading.local()
+_dump_lock = threading.Lock()
+
+
+def add_span(name, elapsed):
+    """Add `elapsed` seconds to span `name` of the request being traced"""
+    if not ENABLED:
+        return
+    spans = getattr(_local, 'spans', None)
+    if spans is not None:
+        total = spans.get(name)
+        spans[name] = (elapsed, 1) if total is None else (total[0] + elapsed,
+                                                         total[1] + 1)
+
+
+@contextmanager
+def span(name):
+    if not ENABLED or getattr(_local, 'spans', None) is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(name, time.perf_counter() - start)
+
+
+def start_request():
+    """Begin tracing the current request; profile it if it is sampled"""
+    _local.spans = {}
+    _local.profiler = None
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active on this thread
+            return
+        _local.profiler = profiler
+
+
+def finish_request(route, method, status, elapsed):
+    """Stop tracing and capture the request if it was slow"""
+    spans = getattr(_local, 'spans', None)
+    profiler = getattr(_local, 'profiler', None)
+    _local.spans = None
+    _local.profiler = None
+    if profiler is not None:
+        profiler.disable()
+    if spans is None:
+        return None
+
+    elapsed_ms = elapsed * 1000
+    if SLOW_REQUEST_MS <= 0 or elapsed_ms < SLOW_REQUEST_MS:
+        return None
+
+    try:
+        return _capture(route, method, status, elapsed_ms, spans, profiler)
+    except Exception as e:
+        logger.warning("Failed to capture slow request: %s", e)
+        return None
+
+
+def _top_frames(profiler):
+    stats = pstats.Stats(profiler)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2],
+                  reverse=True)[:TOP_FRAMES]
+    frames = []
+    for (filename, line, function), (_, calls, self_time, cumulative,
+                                     _) in rows:
+        frames.append({
+            'function': f"{function} ({os.path.basename(filename)}:{line})",
+            'calls': calls,
+            'self_ms': round(self_time * 1000, 3),
+            'cumulative_ms': round(cumulative * 1000, 3)
+        })
+    return frames
+
+
+def _capture(route, method, status, elapsed_ms, spans, profiler):
+    now = time.time()
+    name = f"{int(now * 1000)}-{os.getpid()}-{route}"
+    summary = {
+        'time': now,
+        'route': route,
+        'method': method,
+        'status': status,
+        'elapsed_ms': round(elapsed_ms, 3),
+        'pid': os.getpid(),
+        'spans': {
+            span_name: {
+                'ms': round(total * 1000, 3),
+                'count': count
+            }
+            for span_name, (total, count) in sorted(
+                spans.items(), key=lambda item: item[1][0], reverse=True)
+        },
+        'top_frames': _top_frames(profiler) if profiler else None,
+        'profile': f"{name}.prof" if profiler else None
+    }
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    if profiler is not None:
+        profiler.dump_stats(os.path.join(PROFILE_DIR, f"{name}.prof"))
+    with open(os.path.join(PROFILE_DIR, f"{name}.json"), 'w') as f:
+        json.dump(summary, f)
+    logger.warning("Slow request %s %s took %.1f ms", method, route,
+                   elapsed_ms)
+    _rotate()
+    return summary
+
+
+def _rotate():
+    with _dump_lock:
+        summaries = sorted(glob.glob(os.path.join(PROFILE_DIR, '*.json')))
+        for path in summaries[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else []:
+            for stale in (path, path[:-len('.json')] + '.prof'):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+
+
+def slow_requests(limit=50):
+    """Most recent captured slow requests from every worker, newest first"""
+    paths = sorted(glob.glob(os.path.join(PROFILE_DIR, '*.json')),
+                   reverse=True)[:limit]
+    captures = []
+    for path in paths:
+        try:
+            with open(path) as f:
+                captures.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return captures
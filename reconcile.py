@@ -0,0 +1,244 @@
+# reconcile.py
+"""Recover payments whose webhook never arrived.
+
+reconcile() lists successful transactions from Paystack's API for the
+window since the last checkpoint. Pages are fetched RECONCILE_CONCURRENCY at
+a time while this thread diffs each page that arrives against payments with
+one indexed lookup. Missing payments are inserted with insert_payments,
+together with their invite jobs, in one transaction per page. The window end
+is checkpointed in bot_state only once every page was processed, so a failed
+run is simply repeated by the next one.
+"""
+
+import json
+import logging
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import outbox
+import storage
+import webhook_ingest
+from config import (PAYSTACK_API_BASE_URL, PAYSTACK_SECRET_KEY,
+                    RECONCILE_CONCURRENCY, RECONCILE_PAGE_SIZE,
+                    RECONCILE_INITIAL_DAYS, RECONCILE_LOOKBACK)
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_KEY = 'reconcile_checkpoint'
+LAST_RUN_KEY = 'reconcile_last_run'
+LEASE_NAME = 'reconcile'
+LEASE_TTL = 600
+
+MAX_ATTEMPTS = 4
+TIMEOUT = (3.05, 30)
+
+
+def to_iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime(
+        '%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def from_iso(value):
+    """Epoch seconds for an ISO date or datetime; naive values are UTC"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class PaystackClient:
+    """GET /transaction over a pooled session, safe to share between threads"""
+
+    def __init__(self,
+                 base_url=PAYSTACK_API_BASE_URL,
+                 secret_key=PAYSTACK_SECRET_KEY,
+                 pool_size=RECONCILE_CONCURRENCY):
+        self.url = f"{base_url}/transaction"
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f"Bearer {secret_key}"
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=pool_size,
+                              max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def list_transactions(self, page, since, until,
+                          per_page=RECONCILE_PAGE_SIZE):
+        """One page of successful transactions. Returns (transactions, page_count)."""
+        params = {
+            'status': 'success',
+            'perPage': per_page,
+            'page': page,
+            'from': to_iso(since),
+            'to': to_iso(until)
+        }
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            delay = 2**(attempt - 1)
+            try:
+                response = self.session.get(self.url,
+                                            params=params,
+                                            timeout=TIMEOUT)
+            except requests.RequestException as e:
+                error = e
+            else:
+                if response.status_code == 200:
+                    body = response.json()
+                    meta = body.get('meta') or {}
+                    return body.get('data') or [], int(
+                        meta.get('pageCount') or 1)
+                error = RuntimeError(
+                    f"Paystack returned HTTP {response.status_code} for page {page}")
+                if response.status_code != 429 and response.status_code < 500:
+                    raise error
+                retry_after = response.headers.get('Retry-After')
+                if retry_after and retry_after.isdigit():
+                    delay = int(retry_after)
+            if attempt == MAX_ATTEMPTS:
+                raise error
+            logger.warning("Retrying Paystack page %d in %ss: %s", page,
+                           delay, error)
+            time.sleep(delay)
+
+    def close(self):
+        self.session.close()
+
+
+def payment_data(transaction):
+    """A listed transaction in the shape of a charge.success webhook's data"""
+    metadata = transaction.get('metadata')
+    if isinstance(metadata, str):
+        # The API returns metadata as the JSON string it was created with
+        try:
+            metadata = json.loads(metadata)
+        except ValueError:
+            metadata = None
+    if not isinstance(metadata, dict):
+        metadata = {}
+    return {
+        'reference': transaction['reference'],
+        'status': transaction.get('status'),
+        'amount': transaction.get('amount'),
+        'paid_at': transaction.get('paid_at') or transaction.get('paidAt'),
+        'customer': {
+            'email': (transaction.get('customer') or {}).get('email')
+        },
+        'metadata': {
+            'custom_fields': metadata.get('custom_fields') or []
+        }
+    }
+
+
+def record_missing(conn, transactions):
+    """Insert the transactions not in payments and queue their invites.
+
+    Returns (payments inserted, invites queued).
+    """
+    payments = {}
+    for transaction in transactions:
+        if transaction.get('status') == 'success' and transaction.get(
+                'reference'):
+            payments[transaction['reference']] = payment_data(transaction)
+    known = storage.existing_references(conn, list(payments))
+    missing = [data for reference, data in payments.items()
+               if reference not in known]
+    if not missing:
+        return 0, 0
+
+    queued = 0
+    with conn:
+        inserted = set(storage.insert_payments(conn, missing))
+        for data in missing:
+            chat_id = webhook_ingest.custom_field(data, 'chat_id')
+            if data['reference'] in inserted and chat_id:
+                outbox.add_invite_job(conn, data['reference'], chat_id,
+                                      data['amount'])
+                queued += 1
+    for reference in inserted:
+        logger.info("Recovered payment %s from the Paystack API", reference)
+    return len(inserted), queued
+
+
+def reconcile(conn=None, since=None, until=None, client=None):
+    """Record successful transactions in [since, until] that payments lacks.
+
+    `since` defaults to RECONCILE_LOOKBACK before the checkpoint, or
+    RECONCILE_INITIAL_DAYS ago on the first run, and `until` to now (epoch
+    seconds). Returns the run's stats, or None while another worker holds
+    the reconcile lease.
+    """
+    conn = conn or storage.get_connection()
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    if not storage.acquire_lease(conn, LEASE_NAME, owner, LEASE_TTL):
+        logger.info("Reconciliation already running elsewhere")
+        return None
+
+    started = time.monotonic()
+    until = time.time() if until is None else until
+    if since is None:
+        checkpoint = storage.get_state(conn, CHECKPOINT_KEY)
+        since = (from_iso(checkpoint) - RECONCILE_LOOKBACK if checkpoint else
+                 until - RECONCILE_INITIAL_DAYS * 86400)
+    stats = {
+        'from': to_iso(since),
+        'to': to_iso(until),
+        'pages': 0,
+        'transactions': 0,
+        'inserted': 0,
+        'invites_queued': 0
+    }
+
+    def process(transactions):
+        inserted, queued = record_missing(conn, transactions)
+        stats['pages'] += 1
+        stats['transactions'] += len(transactions)
+        stats['inserted'] += inserted
+        stats['invites_queued'] += queued
+
+    own_client = client is None
+    client = client or PaystackClient()
+    try:
+        transactions, page_count = client.list_transactions(1, since, until)
+        process(transactions)
+        with ThreadPoolExecutor(max_workers=RECONCILE_CONCURRENCY,
+                                thread_name_prefix="reconcile") as pool:
+            futures = [
+                pool.submit(client.list_transactions, page, since, until)
+                for page in range(2, page_count + 1)
+            ]
+            try:
+                for future in as_completed(futures):
+                    process(future.result()[0])
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        stats['seconds'] = round(time.monotonic() - started, 3)
+        # Checkpoint before the lease is released, so the next runner starts
+        # after this window rather than scanning it again
+        storage.set_state(conn, CHECKPOINT_KEY, to_iso(until))
+        storage.set_state(conn, LAST_RUN_KEY, json.dumps(stats))
+    finally:
+        if own_client:
+            client.close()
+        storage.release_lease(conn, LEASE_NAME, owner)
+
+    logger.info(
+        "Reconciled %d transactions in %d pages: %d payments recovered",
+        stats['transactions'], stats['pages'], stats['inserted'])
+    return stats
+
+
+def reconcile_stats(conn=None):
+    conn = conn or storage.get_connection()
+    last_run = storage.get_state(conn, LAST_RUN_KEY)
+    return {
+        'checkpoint': storage.get_state(conn, CHECKPOINT_KEY),
+        'last_run': json.loads(last_run) if last_run else None
+    }
@@ -0,0 +1,79 @@
+# seen_cache.py
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class SeenCache:
+    """Bounded LRU of recently seen keys, optionally expiring after `ttl` seconds.
+
+    Used to reject obvious duplicates (webhook retries) before they reach the
+    database. It is per-process and best-effort: a miss here is always
+    settled by the database's own uniqueness check.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expired(self, seen_at, now):
+        return self.ttl is not None and now - seen_at > self.ttl
+
+    def contains(self, key):
+        """Return True if `key` was seen recently (counts as a hit or miss)"""
+        now = time.monotonic()
+        with self._lock:
+            seen_at = self._entries.get(key)
+            if seen_at is None or self._expired(seen_at, now):
+                self.misses += 1
+                return False
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True
+
+    def add(self, key):
+        with self._lock:
+            self._add(key, time.monotonic())
+
+    def _add(self, key, now):
+        self._entries[key] = now
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        # Entries are in insertion/refresh order, so expired ones are
+        # always at the front
+        if self.ttl is not None:
+            while self._entries:
+                oldest_key, seen_at = next(iter(self._entries.items()))
+                if not self._expired(seen_at, now):
+                    break
+                del self._entries[oldest_key]
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def check_and_add(self, key):
+        """Record `key` and return True if it had already been seen"""
+        now = time.monotonic()
+        with self._lock:
+            seen_at = self._entries.get(key)
+            if seen_at is not None and not self._expired(seen_at, now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True
+            self.misses += 1
+            self._add(key, now)
+        return False
+
+    def stats(self):
+        return {'size': len(self._entries), 'hits': self.hits,
+                'misses': self.misses}
@@ -0,0 +1,721 @@
+# storage.py
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+import metrics
+import profiling
+from config import (STORAGE_BACKEND, DB_PATH, SQLITE_BUSY_TIMEOUT,
+                    SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE,
+                    SQLITE_CACHED_STATEMENTS)
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# Connections inherited from a parent process across fork. They must not be
+# closed (or garbage collected) in the child, so references are parked here.
+_inherited = []
+
+# Set by detect_features once the FTS5 search index is known to exist
+_fts_enabled = False
+
+DIALECT = 'postgres' if STORAGE_BACKEND == 'postgres' else 'sqlite'
+
+# Column types and clauses that differ between the backends, filled into
+# CREATE statements by ddl()
+_DDL = {
+    'sqlite': {
+        'pk': 'INTEGER PRIMARY KEY AUTOINCREMENT',
+        'bigint': 'INTEGER',
+        'real': 'REAL',
+        'without_rowid': 'WITHOUT ROWID'
+    },
+    'postgres': {
+        'pk': 'BIGSERIAL PRIMARY KEY',
+        'bigint': 'BIGINT',
+        'real': 'DOUBLE PRECISION',
+        'without_rowid': ''
+    }
+}
+
+# Appended to the subquery picking a row to claim, so concurrent claimers on
+# PostgreSQL skip each other's rows (SQLite serializes writers anyway)
+SKIP_LOCKED = ' FOR UPDATE SKIP LOCKED' if DIALECT == 'postgres' else ''
+
+# Case-insensitive substring search when there is no FTS index
+_LIKE = 'ILIKE' if DIALECT == 'postgres' else 'LIKE'
+
+# Payments per multi-row INSERT in insert_payments, well under SQLite's
+# bound parameter limit
+BULK_INSERT_ROWS = 500
+
+
+def ddl(sql, **names):
+    """Fill the {pk}, {bigint}, {real} and {without_rowid} slots of a CREATE statement"""
+    return sql.format(**_DDL[DIALECT], **names)
+
+
+QUERY_SECONDS = metrics.Histogram(f'{DIALECT}_query_seconds',
+                                  'Database statement execution time',
+                                  ('operation', ))
+
+# Statement text -> first keyword, so timing does not re-parse hot queries
+_operations = {}
+
+
+def _operation(sql):
+    op = _operations.get(sql)
+    if op is None:
+        words = sql.split(None, 1)
+        op = words[0].lower() if words else 'unknown'
+        if len(_operations) < 1000:
+            _operations[sql] = op
+    return op
+
+
+def _record_query(sql, elapsed):
+    op = _operation(sql)
+    QUERY_SECONDS.labels(op).observe(elapsed)
+    if profiling.ENABLED:
+        profiling.add_span(f"{DIALECT}.{op}", elapsed)
+
+
+class _TimedCursor(sqlite3.Cursor):
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - start)
+
+
+class _TimedConnection(sqlite3.Connection):
+
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path,
+                           timeout=SQLITE_BUSY_TIMEOUT,
+                           cached_statements=SQLITE_CACHED_STATEMENTS,
+                           factory=_TimedConnection)
+    # WAL lets the dashboard read while webhooks write; NORMAL is durable
+    # across application crashes and only risks the last commit on power loss
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def get_connection(db_path=DB_PATH):
+    """Return this thread's open database connection, creating it on first use.
+
+    With the PostgreSQL backend `db_path` is ignored and the connection is
+    checked out of the worker's pool.
+    """
+    pid = os.getpid()
+    if getattr(_local, 'pid', None) != pid:
+        if getattr(_local, 'connections', None):
+            _inherited.extend(_local.connections.values())
+        _local.connections = {}
+        _local.pid = pid
+
+    conn = _local.connections.get(db_path)
+    if conn is None or (DIALECT == 'postgres' and conn.closed):
+        if DIALECT == 'postgres':
+            import postgres_backend
+            conn = postgres_backend.connect(_record_query)
+        else:
+            conn = _connect(db_path)
+        _local.connections[db_path] = conn
+    return conn
+
+
+def close_connection(db_path=DB_PATH):
+    """Close this thread's connection, e.g. when a background thread exits"""
+    connections = getattr(_local, 'connections', None)
+    if connections and getattr(_local, 'pid', None) == os.getpid():
+        conn = connections.pop(db_path, None)
+        if conn is not None:
+            conn.close()
+
+
+def init_schema(conn):
+    """Create the payments, bot state and shared lease tables on an open connection"""
+    c = conn.cursor()
+    c.execute(ddl('''
+        CREATE TABLE IF NOT EXISTS payments (
+            id {pk},
+            reference TEXT UNIQUE,
+            status TEXT,
+            amount INTEGER,
+            email TEXT,
+            full_name TEXT,
+            paid_at TEXT,
+            chat_id TEXT,
+            invite_link TEXT
+        )
+    '''))
+    # Revenue rollups, maintained by insert_payment in the same transaction
+    for table, key in (('payment_rollups_daily', 'day'),
+                       ('payment_rollups_monthly', 'month')):
+        c.execute(ddl('''
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key} TEXT NOT NULL,
+                status TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                amount {bigint} NOT NULL,
+                PRIMARY KEY ({key}, status)
+            ) {without_rowid}
+        ''', table=table, key=key))
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+    # Telegram update_ids already accepted by some worker (update_dedupe)
+    c.execute(ddl('''
+        CREATE TABLE IF NOT EXISTS seen_updates (
+            update_id {bigint} PRIMARY KEY,
+            seen_at {real} NOT NULL
+        )
+    '''))
+    c.execute(ddl('''
+        CREATE TABLE IF NOT EXISTS worker_leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at {real} NOT NULL
+        )
+    '''))
+
+
+def acquire_lease(conn, name, owner, ttl):
+    """Take or renew a named lease shared by all workers. Returns True if held."""
+    now = time.time()
+    with conn:
+        cursor = conn.execute(
+            '''
+            INSERT INTO worker_leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE
+            SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE worker_leases.expires_at < ? OR worker_leases.owner = excluded.owner
+            ''', (name, owner, now + ttl, now))
+    return cursor.rowcount == 1
+
+
+def release_lease(conn, name, owner):
+    """Give up a lease early, if `owner` still holds it"""
+    with conn:
+        conn.execute("DELETE FROM worker_leases WHERE name = ? AND owner = ?",
+                     (name, owner))
+
+
+def claim_update(conn, update_id):
+    """Record a Telegram update_id. Returns False if it was already recorded."""
+    with conn:
+        cursor = conn.execute(
+            "INSERT INTO seen_updates (update_id, seen_at) VALUES (?, ?) "
+            "ON CONFLICT (update_id) DO NOTHING", (update_id, time.time()))
+    return cursor.rowcount == 1
+
+
+def release_update(conn, update_id):
+    """Forget a claimed update_id so a redelivery is processed"""
+    with conn:
+        conn.execute("DELETE FROM seen_updates WHERE update_id = ?",
+                     (update_id, ))
+
+
+def prune_seen_updates(conn, max_age):
+    """Delete update_ids recorded more than `max_age` seconds ago"""
+    with conn:
+        cursor = conn.execute("DELETE FROM seen_updates WHERE seen_at < ?",
+                              (time.time() - max_age, ))
+    return cursor.rowcount
+
+
+def get_state(conn, key, default=None):
+    """Read a value from the bot_state key/value table"""
+    row = conn.execute("SELECT value FROM bot_state WHERE key = ?",
+                       (key, )).fetchone()
+    return row[0] if row else default
+
+
+def set_state(conn, key, value):
+    with conn:
+        conn.execute(
+            "INSERT INTO bot_state (key, value) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, str(value)))
+
+
+def dict_factory(cursor, row):
+    return {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
+
+
+_PAYMENT_COLUMNS = ('reference, status, amount, email, full_name, paid_at, '
+                    'chat_id, invite_link')
+
+
+def payment_row(data, invite_link=None):
+    # Extract full_name and chat_id from metadata.custom_fields
+    full_name = None
+    chat_id = None
+    for field in data.get('metadata', {}).get('custom_fields', []):
+        if field.get('variable_name') == 'full_name':
+            full_name = field.get('value')
+        elif field.get('variable_name') == 'chat_id':
+            chat_id = field.get('value')
+
+    return (data['reference'], data['status'], data['amount'],
+            data['customer']['email'], full_name, data['paid_at'], chat_id,
+            invite_link)
+
+
+def insert_payment(conn, data, invite_link=None):
+    """Insert a payment in the caller's transaction.
+
+    Returns the new row id, or None if the reference is already recorded.
+    The duplicate check and the insert are one statement, so concurrent
+    retries of the same webhook cannot both get through.
+    """
+    row = payment_row(data, invite_link)
+    inserted = conn.execute(
+        f'''
+        INSERT INTO payments ({_PAYMENT_COLUMNS})
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (reference) DO NOTHING
+        RETURNING id
+        ''', row).fetchone()
+    if inserted is None:
+        return None
+
+    payment_id = inserted[0]
+    if _fts_enabled:
+        conn.execute(
+            "INSERT INTO payments_fts (rowid, email, full_name, reference) "
+            "VALUES (?, ?, ?, ?)", (payment_id, row[3], row[4], row[0]))
+    _add_to_rollups(conn, [_rollup_keys(row[5], row[1]) + (1, row[2] or 0)])
+    return payment_id
+
+
+def insert_payments(conn, payments, chunk_size=BULK_INSERT_ROWS):
+    """Insert many payments in the caller's transaction.
+
+    Each chunk is one multi-row INSERT, and the rollups get one upsert per
+    bucket. Returns the references that were not recorded before.
+    """
+    rows = [payment_row(data) for data in payments]
+    inserted = []
+    for i in range(0, len(rows), chunk_size):
+        chunk = rows[i:i + chunk_size]
+        values = ', '.join(['(?, ?, ?, ?, ?, ?, ?, ?)'] * len(chunk))
+        new = conn.execute(
+            f'''
+            INSERT INTO payments ({_PAYMENT_COLUMNS})
+            VALUES {values}
+            ON CONFLICT (reference) DO NOTHING
+            RETURNING id, reference, status, amount, email, full_name, paid_at
+            ''', [value for row in chunk for value in row]).fetchall()
+        if not new:
+            continue
+        if _fts_enabled:
+            conn.executemany(
+                "INSERT INTO payments_fts (rowid, email, full_name, reference) "
+                "VALUES (?, ?, ?, ?)",
+                [(r[0], r[4], r[5], r[1]) for r in new])
+        counts, amounts = Counter(), Counter()
+        for _, _, status, amount, _, _, paid_at in new:
+            key = _rollup_keys(paid_at, status)
+            counts[key] += 1
+            amounts[key] += amount or 0
+        _add_to_rollups(conn, [key + (counts[key], amounts[key])
+                               for key in counts])
+        inserted.extend(r[1] for r in new)
+    return inserted
+
+
+def existing_references(conn, references, chunk_size=BULK_INSERT_ROWS):
+    """The subset of `references` already in payments, one lookup per chunk"""
+    found = set()
+    for i in range(0, len(references), chunk_size):
+        chunk = references[i:i + chunk_size]
+        placeholders = ', '.join(['?'] * len(chunk))
+        found.update(row[0] for row in conn.execute(
+            f"SELECT reference FROM payments WHERE reference IN ({placeholders})",
+            chunk).fetchall())
+    return found
+
+
+def save_payment(data, invite_link=None):
+    conn = get_connection()
+    with conn:
+        payment_id = insert_payment(conn, data, invite_link)
+    if payment_id is None:
+        logger.warning("Payment with reference %s already saved",
+                       data['reference'])
+    return payment_id
+
+
+def _rollup_keys(paid_at, status):
+    day = paid_at[:10] if paid_at else 'unknown'
+    return day, day[:7], status or 'unknown'
+
+
+def _add_to_rollups(conn, buckets):
+    """Add (day, month, status, count, amount) tuples to the rollups"""
+    conn.executemany(
+        '''
+        INSERT INTO payment_rollups_daily AS r (day, status, count, amount) VALUES (?, ?, ?, ?)
+        ON CONFLICT (day, status) DO UPDATE
+        SET count = r.count + excluded.count, amount = r.amount + excluded.amount
+        ''', [(day, status, count, amount)
+              for day, _, status, count, amount in buckets])
+    conn.executemany(
+        '''
+        INSERT INTO payment_rollups_monthly AS r (month, status, count, amount) VALUES (?, ?, ?, ?)
+        ON CONFLICT (month, status) DO UPDATE
+        SET count = r.count + excluded.count, amount = r.amount + excluded.amount
+        ''', [(month, status, count, amount)
+              for _, month, status, count, amount in buckets])
+
+
+def set_invite_link(conn, reference, invite_link):
+    """Store a payment's invite link unless one is already set; return the stored link"""
+    with conn:
+        conn.execute(
+            "UPDATE payments SET invite_link = ? "
+            "WHERE reference = ? AND invite_link IS NULL",
+            (invite_link, reference))
+    return get_invite_link(conn, reference)
+
+
+def get_invite_link(conn, reference):
+    row = conn.execute("SELECT invite_link FROM payments WHERE reference = ?",
+                       (reference, )).fetchone()
+    return row[0] if row else None
+
+
+def init_indexes(conn):
+    """Create the indexes used by the dashboard queries"""
+    # Covers the stats scan: range on paid_at, grouping on status, sum of amount
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payments_paid_at_status
+        ON payments (paid_at, status, amount)
+    ''')
+    # Status filter with keyset pagination on id
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payments_status_id
+        ON payments (status, id)
+    ''')
+
+    if DIALECT != 'sqlite':
+        # Search falls back to ILIKE
+        return
+
+    # Full-text index over the searchable columns. It is an external-content
+    # table, so only the index is stored; insert_payment keeps it in sync.
+    try:
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS payments_fts USING fts5(
+                email, full_name, reference,
+                content='payments', content_rowid='id', prefix='2 3'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        logger.warning("FTS5 unavailable, falling back to LIKE search: %s", e)
+        return
+
+    indexed = conn.execute(
+        "SELECT COUNT(*) FROM payments_fts_docsize").fetchone()[0]
+    total = conn.execute("SELECT COUNT(*) FROM payments").fetchone()[0]
+    if indexed != total:
+        logger.info("Rebuilding payments search index (%s rows)", total)
+        conn.execute("INSERT INTO payments_fts (payments_fts) VALUES ('rebuild')")
+
+
+def detect_features(conn):
+    """Note which optional indexes this database has, once per process"""
+    global _fts_enabled
+
+    _fts_enabled = DIALECT == 'sqlite' and conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'payments_fts'").fetchone(
+        ) is not None
+
+
+def backfill_rollups(conn):
+    """Build the rollups for a database that predates them"""
+    has_rollups = conn.execute(
+        "SELECT 1 FROM payment_rollups_daily LIMIT 1").fetchone()
+    has_payments = conn.execute("SELECT 1 FROM payments LIMIT 1").fetchone()
+    if has_payments and not has_rollups:
+        logger.info("Backfilling payment rollups")
+        _rebuild_rollups(conn)
+
+
+# Bucket expressions matching _rollup_keys, used to rebuild and verify rollups
+_DAY_SQL = "COALESCE(substr(paid_at, 1, 10), 'unknown')"
+_STATUS_SQL = "COALESCE(status, 'unknown')"
+
+
+def rebuild_rollups(conn):
+    """Recompute the rollup tables from the payments table"""
+    with conn:
+        _rebuild_rollups(conn)
+
+
+def _rebuild_rollups(conn):
+    conn.execute("DELETE FROM payment_rollups_daily")
+    conn.execute("DELETE FROM payment_rollups_monthly")
+    conn.execute(f'''
+        INSERT INTO payment_rollups_daily (day, status, count, amount)
+        SELECT {_DAY_SQL}, {_STATUS_SQL}, COUNT(*), COALESCE(SUM(amount), 0)
+        FROM payments GROUP BY 1, 2
+    ''')
+    conn.execute('''
+        INSERT INTO payment_rollups_monthly (month, status, count, amount)
+        SELECT substr(day, 1, 7), status, SUM(count), SUM(amount)
+        FROM payment_rollups_daily GROUP BY 1, 2
+    ''')
+
+
+def check_rollups(conn):
+    """Compare the rollups with the payments table. Returns a list of mismatches."""
+    mismatches = []
+    checks = (
+        ('daily', f'''
+            SELECT {_DAY_SQL} AS bucket, {_STATUS_SQL} AS st,
+                   COUNT(*) AS count, COALESCE(SUM(amount), 0) AS amount
+            FROM payments GROUP BY 1, 2
+        ''', "SELECT day, status, count, amount FROM payment_rollups_daily"),
+        ('monthly', f'''
+            SELECT substr({_DAY_SQL}, 1, 7) AS bucket, {_STATUS_SQL} AS st,
+                   COUNT(*) AS count, COALESCE(SUM(amount), 0) AS amount
+            FROM payments GROUP BY 1, 2
+        ''', "SELECT month, status, count, amount FROM payment_rollups_monthly"),
+    )
+    for name, expected_sql, actual_sql in checks:
+        expected = {(r[0], r[1]): (r[2], r[3])
+                    for r in conn.execute(expected_sql)}
+        actual = {(r[0], r[1]): (r[2], r[3]) for r in conn.execute(actual_sql)}
+        for key in expected.keys() | actual.keys():
+            if expected.get(key) != actual.get(key):
+                mismatches.append({
+                    'rollup': name,
+                    'bucket': key[0],
+                    'status': key[1],
+                    'expected': expected.get(key),
+                    'actual': actual.get(key)
+                })
+    return mismatches
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query matching every word as a prefix"""
+    terms = re.findall(r"\w+", text)
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def payment_filters(start=None, end=None, status=None, q=None, after_id=None):
+    """Build a WHERE clause for the dashboard filters.
+
+    `start` and `end` are inclusive YYYY-MM-DD dates. paid_at is stored as an
+    ISO-8601 string, so plain string comparison keeps the index usable.
+    `after_id` continues a newest-first listing after the given row id.
+    """
+    clauses = []
+    params = []
+    if start:
+        clauses.append("paid_at >= ?")
+        params.append(start)
+    if end:
+        try:
+            day_after = (date.fromisoformat(end) + timedelta(days=1)).isoformat()
+        except ValueError:
+            day_after = None  # compares as NULL, so nothing matches
+        clauses.append("paid_at < ?")
+        params.append(day_after)
+    if status:
+        clauses.append("status = ?")
+        params.append(status)
+    if q:
+        match = fts_query(q) if _fts_enabled else None
+        if match:
+            clauses.append(
+                "id IN (SELECT rowid FROM payments_fts WHERE payments_fts MATCH ?)"
+            )
+            params.append(match)
+        else:
+            # Without FTS, or for a query with no words in it (punctuation
+            # only), which would otherwise match every payment
+            clauses.append(f"(email {_LIKE} ? OR full_name {_LIKE} ? "
+                           f"OR reference {_LIKE} ?)")
+            params.extend([f"%{q}%"] * 3)
+    if after_id:
+        # Keyset pagination: rows are listed newest first
+        clauses.append("id < ?")
+        params.append(after_id)
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return where, params
+
+
+def _add_to_bucket(bucket, count, amount, success):
+    bucket['count'] += count
+    bucket['amount'] += amount
+    if success:
+        bucket['success_count'] += count
+        bucket['success_amount'] += amount
+
+
+def _add_to_series(series, key, count, amount, success):
+    bucket = series.get(key)
+    if bucket is None:
+        bucket = series[key] = {
+            'period': key,
+            'count': 0,
+            'amount': 0,
+            'success_count': 0,
+            'success_amount': 0
+        }
+    _add_to_bucket(bucket, count, amount, success)
+
+
+def payment_stats(conn, start=None, end=None, status=None, q=None):
+    """Revenue, status counts and daily/monthly/yearly series for the dashboard.
+
+    Without search text the answer comes from the rollup tables, so the cost
+    depends on the number of buckets rather than the number of payments.
+    """
+    monthly_rows = None
+    if q:
+        where, params = payment_filters(start, end, status, q)
+        rows = conn.execute(
+            f'''
+            SELECT substr(paid_at, 1, 10) AS day, status, COUNT(*), COALESCE(SUM(amount), 0)
+            FROM payments
+            {where}
+            GROUP BY day, status
+            ''', params).fetchall()
+    else:
+        clauses, params = [], []
+        if start:
+            clauses.append("day >= ?")
+            params.append(start)
+        if end:
+            clauses.append("day <= ?")
+            params.append(end)
+        if status:
+            clauses.append("status = ?")
+            params.append(status)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = conn.execute(
+            f"SELECT day, status, count, amount FROM payment_rollups_daily {where}",
+            params).fetchall()
+        if not start and not end:
+            monthly_rows = conn.execute(
+                "SELECT month, status, count, amount FROM payment_rollups_monthly "
+                + ("WHERE status = ?" if status else ""),
+                (status, ) if status else ()).fetchall()
+
+    totals = {'count': 0, 'amount': 0, 'success_count': 0, 'success_amount': 0}
+    status_counts = {}
+    series = {'daily': {}, 'monthly': {}, 'yearly': {}}
+
+    # Daily rows feed the totals and every series unless the monthly rollup
+    # can supply the coarser buckets directly
+    coarse = ('monthly', 'yearly') if monthly_rows is None else ()
+    for day, row_status, count, amount in rows:
+        day = day or 'unknown'
+        success = row_status == 'success'
+        status_counts[row_status] = status_counts.get(row_status, 0) + count
+        _add_to_bucket(totals, count, amount, success)
+        _add_to_series(series['daily'], day, count, amount, success)
+        if coarse:
+            _add_to_series(series['monthly'], day[:7], count, amount, success)
+            _add_to_series(series['yearly'], day[:4], count, amount, success)
+
+    for month, row_status, count, amount in monthly_rows or ():
+        success = row_status == 'success'
+        _add_to_series(series['monthly'], month, count, amount, success)
+        _add_to_series(series['yearly'], month[:4], count, amount, success)
+
+    return {
+        'totals': totals,
+        'status_counts': status_counts,
+        'daily': sorted(series['daily'].values(), key=lambda b: b['period']),
+        'monthly': sorted(series['monthly'].values(),
+                          key=lambda b: b['period']),
+        'yearly': sorted(series['yearly'].values(), key=lambda b: b['period'])
+    }
+
+
+EXPORT_COLUMNS = ('id', 'reference', 'status', 'amount', 'email', 'full_name',
+                  'paid_at', 'chat_id', 'invite_link')
+
+
+def list_payments(conn, limit, offset=0, after_id=None, start=None, end=None,
+                  status=None, q=None):
+    """One page of payments as dicts, newest first"""
+    where, params = payment_filters(start, end, status, q, after_id)
+    rows = conn.execute(
+        f'''
+        SELECT {', '.join(EXPORT_COLUMNS)}
+        FROM payments
+        {where}
+        ORDER BY id DESC
+        LIMIT ? OFFSET ?
+        ''', (*params, limit, offset)).fetchall()
+    return [dict(zip(EXPORT_COLUMNS, row)) for row in rows]
+
+
+def iter_payment_chunks(conn, chunk_size, start=None, end=None, status=None,
+                        q=None):
+    """Yield lists of payment rows, oldest first, `chunk_size` rows at a time.
+
+    Each chunk is a separate keyset query on id, so no read snapshot is held
+    open while the caller is busy writing the previous chunk to a slow client.
+    """
+    where, params = payment_filters(start, end, status, q)
+    where = f"{where} AND id > ?" if where else "WHERE id > ?"
+    query = f"""
+        SELECT {', '.join(EXPORT_COLUMNS)}
+        FROM payments
+        {where}
+        ORDER BY id
+        LIMIT ?
+    """
+    last_id = 0
+    while True:
+        rows = conn.execute(query, (*params, last_id, chunk_size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
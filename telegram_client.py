@@ -0,0 +1,130 @@
+# telegram_client.py
+
+import logging
+import os
+import threading
+import time
+
+import metrics
+import profiling
+
+from config import (BOT_TOKEN, TELEGRAM_API_BASE_URL, TELEGRAM_POOL_SIZE,
+                    TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_READ_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+API_URL = f"{TELEGRAM_API_BASE_URL}/bot{BOT_TOKEN}"
+DEFAULT_TIMEOUT = (TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_READ_TIMEOUT)
+
+API_SECONDS = metrics.Histogram('telegram_api_request_seconds',
+                                'Bot API call latency', ('method', ))
+API_REQUESTS = metrics.Counter('telegram_api_requests_total',
+                               'Bot API calls by outcome',
+                               ('method', 'outcome'))
+
+
+def record_call(method, status, elapsed):
+    """Count one Bot API call; status is the HTTP status or None on error"""
+    if status == 429:
+        outcome = 'rate_limited'
+    elif status is not None and status < 400:
+        outcome = 'ok'
+    else:
+        outcome = 'error'
+    API_SECONDS.labels(method).observe(elapsed)
+    API_REQUESTS.labels(method, outcome).inc()
+    if profiling.ENABLED:
+        profiling.add_span(f"telegram.{method}", elapsed)
+
+# One session per worker process. Gunicorn forks workers after import, so the
+# owning pid is tracked and a fresh pool is built in the child instead of
+# sharing sockets inherited from the parent.
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def _build_session():
+    # requests is the slowest import on the cold start path, so it is loaded
+    # by the first call rather than by importing this module
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2,
+                          pool_maxsize=TELEGRAM_POOL_SIZE,
+                          max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def warm_up():
+    """Load the HTTP stack without opening connections, e.g. before a fork"""
+    import requests.adapters  # noqa: F401
+
+
+def get_session():
+    """Return the keep-alive session for this worker, creating it on first use"""
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+                logger.debug(
+                    "Created Telegram API session for worker %s (pool size %s)",
+                    pid, TELEGRAM_POOL_SIZE)
+    return _session
+
+
+def call(method, payload=None, http_method="POST", timeout=None):
+    """Call a Bot API method over the pooled session and return the response"""
+    url = f"{API_URL}/{method}"
+    session = get_session()
+
+    start = time.perf_counter()
+    status = None
+    try:
+        if http_method == "GET":
+            response = session.get(url,
+                                   params=payload,
+                                   timeout=timeout or DEFAULT_TIMEOUT)
+        else:
+            response = session.post(url,
+                                    json=payload,
+                                    timeout=timeout or DEFAULT_TIMEOUT)
+        status = response.status_code
+        return response
+    finally:
+        record_call(method, status, time.perf_counter() - start)
+
+
+def connection_stats():
+    """Return request and connection counts for this worker's pools"""
+    total_requests = 0
+    total_connections = 0
+
+    if _session is not None and _session_pid == os.getpid():
+        adapters = {id(a): a for a in _session.adapters.values()}
+        for adapter in adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                total_requests += pool.num_requests
+                total_connections += pool.num_connections
+
+    reused = max(total_requests - total_connections, 0)
+    return {
+        'pid': os.getpid(),
+        'pool_size': TELEGRAM_POOL_SIZE,
+        'requests': total_requests,
+        'connections_opened': total_connections,
+        'connections_reused': reused,
+        'reuse_ratio':
+        round(reused / total_requests, 4) if total_requests else 0.0
+    }
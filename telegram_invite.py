@@ -1,27 +1,45 @@
 # telegram_invite.py
 
-import requests
+import logging
 import time
-from config import BOT_TOKEN, TELEGRAM_GROUP_ID
+import telegram_client
+from config import TELEGRAM_GROUP_ID
 
-TELEGRAM_API_URL = f"https://api.telegram.org/bot{BOT_TOKEN}"
+logger = logging.getLogger(__name__)
 
 
-def generate_invite_link():
+def generate_invite_link(expire_date=None, member_limit=None):
     #expire_date = int(time.time()) + 5 * 60  # 5 minutes from now
     """Generate a new invite link for the Telegram group/channel with expiry and member limit"""
-    url = f"{TELEGRAM_API_URL}/createChatInviteLink"
     payload = {
         "chat_id": TELEGRAM_GROUP_ID,
-        # "expire_date": expire_date,
-        # "member_limit": 30,  # Only 30 user can join using this link
         "creates_join_request": True  # This enables admin approval
     }
-    response = requests.post(url, json=payload)
+    if expire_date:
+        payload["expire_date"] = int(expire_date)
+    if member_limit:
+        # Telegram rejects member_limit on join-request links
+        payload["member_limit"] = member_limit
+        del payload["creates_join_request"]
+
+    response = telegram_client.call("createChatInviteLink", payload)
     result = response.json()
 
     if result.get("ok"):
         return result["result"]["invite_link"]
     else:
-        print("Error while generating invite link:", result)  # For debugging
+        logger.error("Error while generating invite link: %s", result)
         raise Exception(f"Failed to generate invite link: {result}")
+
+
+def revoke_invite_link(invite_link):
+    """Revoke an invite link so it can no longer be used to join"""
+    response = telegram_client.call("revokeChatInviteLink", {
+        "chat_id": TELEGRAM_GROUP_ID,
+        "invite_link": invite_link
+    })
+    result = response.json()
+
+    if not result.get("ok"):
+        raise Exception(f"Failed to revoke invite link: {result}")
+    return True
@@ -0,0 +1,110 @@
+# tests/conftest.py
+"""Test settings, applied before the app's modules read config.
+
+Tests run against a throwaway SQLite file. Set TEST_DATABASE_URL to a
+PostgreSQL database to run them there instead; they create and drop their
+own schema in it.
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                 "benchmarks"))
+
+TMP = tempfile.mkdtemp(prefix="telegram-bot-tests-")
+TEST_SCHEMA = f"test_{os.getpid()}"
+
+os.environ.update({
+    "TELEGRAM_GROUP_ID": "-1000000000000",
+    "TELEGRAM_BOT_TOKEN": "0:test",
+    "PAYSTACK_SECRET_KEY": "sk_test",
+    # Nothing listens there; tests that talk to Telegram start a fake
+    "TELEGRAM_API_BASE_URL": "http://127.0.0.1:9",
+    "INVITE_POOL_ENABLED": "false",
+    # Fixtures migrate the schema; importing app should not
+    "LAZY_INIT": "true",
+    "DB_PATH": os.path.join(TMP, "payments.db"),
+    "METRICS_DIR": os.path.join(TMP, "metrics"),
+    "LOG_LEVEL": "WARNING",
+})
+if os.environ.get("TEST_DATABASE_URL"):
+    url = os.environ["TEST_DATABASE_URL"]
+    os.environ["STORAGE_BACKEND"] = "postgres"
+    os.environ["DATABASE_URL"] = (
+        f"{url}{'&' if '?' in url else '?'}"
+        f"options=-csearch_path%3D{TEST_SCHEMA}")
+
+import pytest  # noqa: E402
+
+import migrations  # noqa: E402
+import storage  # noqa: E402
+
+
+def _drop_everything(conn):
+    if storage.DIALECT == 'postgres':
+        conn.execute(f"DROP SCHEMA IF EXISTS {TEST_SCHEMA} CASCADE")
+        conn.execute(f"CREATE SCHEMA {TEST_SCHEMA}")
+        return
+    tables = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'table' "
+        "AND name NOT LIKE 'sqlite_%'").fetchall()
+    # Dropping the FTS table drops its shadow tables with it
+    for name, sql in sorted(tables,
+                            key=lambda t: not t[1].startswith('CREATE VIRTUAL')):
+        conn.execute(f"DROP TABLE IF EXISTS {name}")
+    conn.commit()
+
+
+@pytest.fixture
+def empty_conn():
+    """This thread's connection to a test database with no tables"""
+    conn = storage.get_connection()
+    _drop_everything(conn)
+    return conn
+
+
+@pytest.fixture
+def conn(empty_conn):
+    """This thread's connection to an empty, fully migrated test database"""
+    migrations.migrate(empty_conn)
+    storage.detect_features(empty_conn)
+    return empty_conn
+
+
+@pytest.fixture
+def make_payment():
+    """Build charge.success data like the Paystack webhook's"""
+
+    def make(i,
+             status='success',
+             amount=5000,
+             paid_at='2024-03-05T10:00:00.000Z',
+             chat_id=None,
+             email=None,
+             full_name=None,
+             reference=None):
+        return {
+            'reference': reference or f"REF{i:06d}",
+            'status': status,
+            'amount': amount,
+            'paid_at': paid_at,
+            'customer': {
+                'email': email or f"customer{i}@example.com"
+            },
+            'metadata': {
+                'custom_fields': [{
+                    'variable_name': 'full_name',
+                    'value': full_name or f"Customer {i}"
+                }, {
+                    'variable_name': 'chat_id',
+                    'value': str(chat_id if chat_id is not None else 1000 + i)
+                }]
+            }
+        }
+
+    return make
@@ -0,0 +1,80 @@
+# tests/test_metrics.py
+
+import json
+import os
+
+import pytest
+
+import metrics
+
+DEAD_PIDS = (999991, 999992)
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path))
+    monkeypatch.setattr(metrics, '_pid_alive',
+                        lambda pid: pid not in DEAD_PIDS)
+    return tmp_path
+
+
+def _samples(name):
+    return [line for line in metrics.render().splitlines()
+            if line.startswith(name)]
+
+
+def _write_worker(metrics_dir, pid, counter_value, gauge_value):
+    snap = {
+        'pid': pid,
+        'time': 0,
+        'metrics': {
+            'test_events_total': {
+                'kind': 'counter',
+                'help': 'Test events',
+                'labelnames': [],
+                'values': [[[], counter_value]]
+            },
+            'test_queue_depth': {
+                'kind': 'gauge',
+                'help': 'Test depth',
+                'merge': 'sum',
+                'labelnames': [],
+                'values': [[[], gauge_value]]
+            }
+        }
+    }
+    (metrics_dir / f"{pid}.json").write_text(json.dumps(snap))
+
+
+def test_dead_worker_counters_are_kept(metrics_dir):
+    _write_worker(metrics_dir, 999991, 5, 7)
+    _write_worker(metrics_dir, os.getppid(), 3, 2)
+    assert _samples('test_events_total') == ['test_events_total 8']
+    assert _samples('test_queue_depth') == ['test_queue_depth 2']
+    assert not (metrics_dir / "999991.json").exists()
+
+    # Folded once: later scrapes and more dead workers only add
+    assert _samples('test_events_total') == ['test_events_total 8']
+    _write_worker(metrics_dir, 999992, 4, 1)
+    assert _samples('test_events_total') == ['test_events_total 12']
+    assert _samples('test_queue_depth') == ['test_queue_depth 2']
+
+
+def test_dead_worker_histograms_are_kept(metrics_dir):
+    histogram = metrics.Histogram('test_fold_seconds', 'Test latency',
+                                  buckets=(0.1, 1.0))
+    dead = {'test_fold_seconds': dict(histogram.snapshot(),
+                                      values=[[[], [[1, 0, 0], 0.05]]])}
+    (metrics_dir / f"{DEAD_PIDS[0]}.json").write_text(
+        json.dumps({'pid': DEAD_PIDS[0], 'time': 0, 'metrics': dead}))
+    histogram.observe(0.5)
+
+    for _ in range(2):
+        assert _samples('test_fold_seconds_bucket') == [
+            'test_fold_seconds_bucket{le="0.1"} 1',
+            'test_fold_seconds_bucket{le="1.0"} 2',
+            'test_fold_seconds_bucket{le="+Inf"} 2'
+        ]
+        assert _samples('test_fold_seconds_sum') == [
+            'test_fold_seconds_sum 0.55'
+        ]
@@ -0,0 +1,62 @@
+# tests/test_migrations.py
+
+import threading
+
+import migrations
+import storage
+
+VERSIONS = [version for version, _, _ in migrations.MIGRATIONS]
+
+
+def test_migrate_fresh_database(empty_conn):
+    assert migrations.migrate(empty_conn) == VERSIONS
+    assert migrations.current_version(empty_conn) == VERSIONS[-1]
+    for table in ('payments', 'outbox', 'invite_links', 'broadcasts',
+                  'payment_rollups_daily', 'worker_leases', 'seen_updates'):
+        assert empty_conn.execute(
+            f"SELECT COUNT(*) FROM {table}").fetchone()[0] == 0
+
+    assert migrations.migrate(empty_conn) == []
+    assert migrations.current_version(empty_conn) == VERSIONS[-1]
+
+
+def test_migrate_backfills_rollups_of_an_old_database(empty_conn,
+                                                      monkeypatch,
+                                                      make_payment):
+    monkeypatch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS[:1])
+    assert migrations.migrate(empty_conn) == [1]
+    # Rows written by a version that kept no rollups
+    with empty_conn:
+        for i in range(3):
+            empty_conn.execute(
+                f"INSERT INTO payments ({storage._PAYMENT_COLUMNS}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                storage.payment_row(make_payment(i, amount=100 * (i + 1))))
+    monkeypatch.undo()
+
+    assert migrations.migrate(empty_conn) == VERSIONS[1:]
+    assert storage.check_rollups(empty_conn) == []
+    assert empty_conn.execute(
+        "SELECT SUM(count), SUM(amount) FROM payment_rollups_daily").fetchone(
+        ) == (3, 600)
+
+
+def test_concurrent_migrate_applies_each_step_once(empty_conn):
+    results = []
+
+    def run():
+        try:
+            results.append(migrations.migrate(storage.get_connection()))
+        finally:
+            storage.close_connection()
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 4
+    assert sorted(v for result in results for v in result) == VERSIONS
+    assert empty_conn.execute(
+        "SELECT COUNT(*) FROM schema_version").fetchone()[0] == len(VERSIONS)
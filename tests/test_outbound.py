@@ -0,0 +1,26 @@
+# tests/test_outbound.py
+
+import outbound
+
+
+def test_has_pending_tracks_queued_and_in_flight_messages():
+    # Not started, so queued messages stay queued
+    dispatcher = outbound.OutboundDispatcher(workers=0)
+    assert not dispatcher.has_pending(7)
+
+    dispatcher.enqueue(7, "first")
+    assert dispatcher.has_pending(7)
+    assert not dispatcher.has_pending(8)
+
+    # Picked up by a worker: no longer queued, but not delivered yet
+    message = dispatcher._next_message()
+    assert dispatcher.has_pending(7)
+
+    dispatcher._finish(message, None)
+    assert not dispatcher.has_pending(7)
+
+
+def test_has_pending_does_not_start_a_dispatcher(monkeypatch):
+    monkeypatch.setattr(outbound, '_dispatcher', None)
+    assert not outbound.has_pending(7)
+    assert outbound._dispatcher is None
@@ -0,0 +1,117 @@
+# tests/test_outbox.py
+
+import json
+import time
+
+import pytest
+
+import outbox
+from config import OUTBOX_LEASE_SECONDS, OUTBOX_MAX_ATTEMPTS
+
+
+def _job(conn, job_id):
+    return conn.execute(
+        "SELECT status, attempts, next_attempt_at, locked_until, last_error "
+        "FROM outbox WHERE id = ?", (job_id, )).fetchone()
+
+
+@pytest.fixture
+def handled(monkeypatch):
+    """Register a 'test' handler that fails once per queued error"""
+
+    class Handler:
+
+        def __init__(self):
+            self.calls = []
+            self.failures = []
+
+        def __call__(self, payload, attempts):
+            self.calls.append((payload, attempts))
+            if self.failures:
+                raise RuntimeError(self.failures.pop())
+
+    handler = Handler()
+    monkeypatch.setitem(outbox._handlers, 'test', handler)
+    return handler
+
+
+def test_claim_leases_the_oldest_due_job(conn):
+    with conn:
+        outbox.add_job(conn, 'test', {'n': 1})
+        outbox.add_job(conn, 'test', {'n': 2})
+
+    job_id, kind, payload, attempts = outbox.claim_job(conn)
+    assert (kind, json.loads(payload), attempts) == ('test', {'n': 1}, 1)
+    locked_until = _job(conn, job_id)[3]
+    assert locked_until == pytest.approx(time.time() + OUTBOX_LEASE_SECONDS,
+                                         abs=5)
+
+    # The leased job is skipped until its lease runs out
+    assert json.loads(outbox.claim_job(conn)[2]) == {'n': 2}
+    assert outbox.claim_job(conn) is None
+
+
+def test_expired_lease_is_claimed_again(conn):
+    with conn:
+        outbox.add_job(conn, 'test', {})
+    job_id = outbox.claim_job(conn)[0]
+    with conn:
+        conn.execute("UPDATE outbox SET locked_until = ? WHERE id = ?",
+                     (time.time() - 1, job_id))
+
+    assert outbox.claim_job(conn)[::3] == (job_id, 2)
+
+
+def test_failed_job_backs_off(conn, handled):
+    handled.failures.append("Telegram is down")
+    with conn:
+        outbox.add_job(conn, 'test', {'n': 1})
+
+    assert outbox.drain(conn) == 1
+    job_id = conn.execute("SELECT id FROM outbox").fetchone()[0]
+    status, attempts, next_attempt_at, locked_until, error = _job(conn, job_id)
+    assert (status, attempts, locked_until) == ('pending', 1, None)
+    assert error == "Telegram is down"
+    assert next_attempt_at == pytest.approx(time.time() + 2, abs=1)
+    # Not due yet
+    assert outbox.claim_job(conn) is None
+
+    with conn:
+        conn.execute("UPDATE outbox SET next_attempt_at = 0")
+    assert outbox.drain(conn) == 1
+    assert _job(conn, job_id)[:2] == ('done', 2)
+    assert handled.calls == [({'n': 1}, 1), ({'n': 1}, 2)]
+
+
+def test_job_fails_for_good_after_max_attempts(conn, handled):
+    handled.failures.extend(["boom"] * OUTBOX_MAX_ATTEMPTS)
+    with conn:
+        outbox.add_job(conn, 'test', {})
+
+    for _ in range(OUTBOX_MAX_ATTEMPTS):
+        with conn:
+            conn.execute("UPDATE outbox SET next_attempt_at = 0")
+        outbox.drain(conn)
+
+    assert outbox.outbox_stats(conn) == {'pending': 0, 'done': 0, 'failed': 1}
+    assert len(handled.calls) == OUTBOX_MAX_ATTEMPTS
+
+
+def test_unknown_kind_fails_without_retry(conn):
+    with conn:
+        outbox.add_job(conn, 'no-such-kind', {})
+    outbox.drain(conn)
+    status, _, _, _, error = conn.execute(
+        "SELECT status, attempts, next_attempt_at, locked_until, last_error "
+        "FROM outbox").fetchone()
+    assert status == 'failed'
+    assert 'no-such-kind' in error
+
+
+def test_invite_job_is_queued_once_per_reference(conn):
+    with conn:
+        outbox.add_invite_job(conn, 'REF1', '42', 5000)
+    with pytest.raises(Exception):
+        with conn:
+            outbox.add_invite_job(conn, 'REF1', '42', 5000)
+    assert outbox.outbox_stats(conn)['pending'] == 1
@@ -0,0 +1,162 @@
+# tests/test_polling.py
+
+import random
+import threading
+import time
+
+import pytest
+
+import polling
+import storage
+import telegram_client
+import update_dedupe
+from fake_telegram import FakeTelegram
+
+
+class ScriptedTelegram(FakeTelegram):
+    """Fake Bot API whose getUpdates hands out the given batches in turn"""
+
+    def __init__(self, batches):
+        super().__init__(latency=0)
+        self.batches = list(batches)
+        self.offsets = []
+
+    def respond(self, method, payload):
+        if method != 'getUpdates':
+            return super().respond(method, payload)
+        with self._lock:
+            self.calls[method] += 1
+            self.offsets.append(payload.get('offset'))
+            batch = self.batches.pop(0) if self.batches else []
+        return 200, {'ok': True, 'result': batch}
+
+
+def _update(update_id, chat_id, text="hello"):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'chat': {
+                'id': chat_id
+            },
+            'from': {
+                'id': chat_id
+            },
+            'text': text
+        }
+    }
+
+
+@pytest.fixture
+def telegram(conn, monkeypatch):
+    """Start a scripted fake Bot API: ``telegram(batches)``"""
+    started = []
+    # A fresh dedupe cache, so ids from other tests are not remembered
+    monkeypatch.setattr(update_dedupe, '_deduplicator',
+                        update_dedupe.UpdateDeduplicator())
+
+    def start(batches):
+        fake = ScriptedTelegram(batches).start()
+        started.append(fake)
+        monkeypatch.setattr(telegram_client, 'API_URL', f"{fake.url}/bot0:test")
+        return fake
+
+    yield start
+    for fake in started:
+        fake.stop()
+
+
+@pytest.fixture
+def make_poller():
+    pollers = []
+
+    def make(process, workers=4):
+        poller = polling.UpdatePoller(process=process, workers=workers,
+                                      timeout=0)
+        pollers.append(poller)
+        return poller
+
+    yield make
+    for poller in pollers:
+        poller.stop()
+
+
+def _offset():
+    conn = storage.get_connection()
+    offset = storage.get_state(conn, polling.OFFSET_KEY)
+    # Don't leave a read transaction open on the worker's connection
+    conn.commit()
+    return offset
+
+
+def test_offset_is_saved_after_the_batch(conn, telegram, make_poller):
+    fake = telegram([[_update(1, 10), _update(2, 20), _update(3, 10)]])
+    offsets_seen = []
+    poller = make_poller(lambda update: offsets_seen.append(_offset()))
+
+    assert poller.run_once(conn) == 3
+    # While the batch ran, the offset still pointed at its start
+    assert offsets_seen == [None, None, None]
+    assert storage.get_state(conn, polling.OFFSET_KEY) == '4'
+
+    # The next poll confirms the batch to Telegram
+    assert poller.run_once(conn) == 0
+    assert fake.offsets == [None, 4]
+
+
+def test_failed_batch_keeps_the_offset(conn, telegram, make_poller):
+    telegram([[_update(1, 10), _update(2, 10)]])
+
+    def process(update):
+        if update['update_id'] == 2:
+            raise RuntimeError("handler crashed")
+
+    poller = make_poller(process)
+    with pytest.raises(RuntimeError):
+        poller.run_once(conn)
+    assert storage.get_state(conn, polling.OFFSET_KEY) is None
+
+
+def test_replayed_updates_are_dropped(conn, telegram, make_poller):
+    # Telegram hands out part of the first batch again, as after a restart
+    # that never confirmed it
+    fake = telegram([
+        [_update(1, 10), _update(2, 20), _update(3, 10)],
+        [_update(2, 20), _update(3, 10), _update(4, 20)],
+    ])
+    processed = []
+    lock = threading.Lock()
+
+    def process(update):
+        with lock:
+            processed.append(update['update_id'])
+
+    poller = make_poller(process)
+    poller.run_once(conn)
+    poller.run_once(conn)
+
+    assert sorted(processed) == [1, 2, 3, 4]
+    assert storage.get_state(conn, polling.OFFSET_KEY) == '5'
+    assert fake.offsets == [None, 4]
+
+
+def test_updates_for_one_chat_run_in_order(conn, telegram, make_poller):
+    updates = [_update(i, 10 + i % 3) for i in range(1, 31)]
+    telegram([updates])
+    by_chat = {}
+    lock = threading.Lock()
+
+    def process(update):
+        # Uneven handler times would reorder anything not kept in a chain
+        time.sleep(random.random() * 0.005)
+        chat_id = update['message']['chat']['id']
+        with lock:
+            by_chat.setdefault(chat_id, []).append(update['update_id'])
+
+    make_poller(process, workers=3).run_once(conn)
+
+    assert by_chat == {
+        chat_id: [u['update_id'] for u in updates
+                  if u['message']['chat']['id'] == chat_id]
+        for chat_id in (10, 11, 12)
+    }
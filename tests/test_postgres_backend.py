@@ -0,0 +1,27 @@
+# tests/test_postgres_backend.py
+
+import postgres_backend
+from postgres_backend import _translate
+
+
+def test_translate_placeholders():
+    assert (_translate("SELECT * FROM payments WHERE reference = ? AND amount > ?")
+            == "SELECT * FROM payments WHERE reference = %s AND amount > %s")
+
+
+def test_translate_escapes_percent():
+    # psycopg2 unescapes %% because _Cursor always passes a parameter tuple
+    assert (_translate("SELECT * FROM payments WHERE email LIKE '%' || ?")
+            == "SELECT * FROM payments WHERE email LIKE '%%' || %s")
+
+
+def test_translate_without_placeholders():
+    assert _translate("SELECT COUNT(*) FROM payments") == \
+        "SELECT COUNT(*) FROM payments"
+
+
+def test_translate_caches_statements():
+    sql = "SELECT invite_link FROM payments WHERE reference = ?"
+    assert _translate(sql) is _translate(sql)
+    assert postgres_backend._statements[sql] == \
+        "SELECT invite_link FROM payments WHERE reference = %s"
@@ -0,0 +1,143 @@
+# tests/test_reconcile.py
+
+import json
+import time
+
+import pytest
+
+import reconcile
+import storage
+from config import RECONCILE_LOOKBACK
+from fake_paystack import FakePaystack, transaction
+
+
+class SmallPages(reconcile.PaystackClient):
+    """Client for the fake that asks for a few transactions per page"""
+
+    per_page = 7
+
+    def list_transactions(self, page, since, until, per_page=None):
+        return super().list_transactions(page, since, until, self.per_page)
+
+
+@pytest.fixture
+def paystack():
+    """Start a fake Paystack API: ``paystack(transactions)``"""
+    started = []
+
+    def start(transactions, span=3600):
+        fake = FakePaystack(transactions=transactions, span=span,
+                            latency=0).start()
+        started.append(fake)
+        return fake, SmallPages(base_url=fake.url, secret_key='sk_bench')
+
+    yield start
+    for fake in started:
+        fake.stop()
+
+
+def _count(conn, table):
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_reconcile_fetches_every_page(conn, paystack):
+    fake, client = paystack(50)
+    stats = reconcile.reconcile(conn, since=time.time() - 7200, client=client)
+
+    # Every tenth fake transaction failed; the other 45 are listed 7 a page
+    assert fake.stats()['calls'] == {'/transaction': 7}
+    assert stats['pages'] == 7
+    assert stats['transactions'] == 45
+    assert stats['inserted'] == stats['invites_queued'] == 45
+    assert _count(conn, 'payments') == 45
+    assert _count(conn, 'outbox') == 45
+    assert storage.check_rollups(conn) == []
+
+
+def test_record_missing_inserts_only_unknown_references(conn, make_payment):
+    now = time.time()
+    transactions = [transaction(i, now) for i in range(10)]
+    # Known from their webhooks
+    with conn:
+        for i in (0, 2):
+            storage.insert_payment(
+                conn, make_payment(i, reference=f"FAKE{i:08d}"))
+    # No chat to invite
+    transactions[4]['metadata'] = {}
+
+    inserted, queued = reconcile.record_missing(conn, transactions)
+
+    # 9 failed; 0 and 2 known; 4 has no chat_id
+    assert (inserted, queued) == (7, 6)
+    references = {row[0] for row in conn.execute(
+        "SELECT reference FROM payments").fetchall()}
+    assert references == {f"FAKE{i:08d}" for i in range(9)}
+    invited = sorted(
+        json.loads(row[0])['reference']
+        for row in conn.execute("SELECT payload FROM outbox").fetchall())
+    assert invited == [f"FAKE{i:08d}" for i in (1, 3, 5, 6, 7, 8)]
+    recovered = conn.execute(
+        "SELECT chat_id, full_name FROM payments WHERE reference = ?",
+        ('FAKE00000001', )).fetchone()
+    assert tuple(recovered) == ('100001', 'Customer 1')
+
+    # A second pass finds nothing new
+    assert reconcile.record_missing(conn, transactions) == (0, 0)
+
+
+def test_reconcile_resumes_from_the_checkpoint(conn, paystack):
+    fake, client = paystack(20)
+    until = time.time()
+    reconcile.reconcile(conn, since=until - 7200, until=until, client=client)
+    checkpoint = storage.get_state(conn, reconcile.CHECKPOINT_KEY)
+    assert checkpoint == reconcile.to_iso(until)
+
+    stats = reconcile.reconcile(conn, client=client)
+    assert stats['from'] == reconcile.to_iso(
+        reconcile.from_iso(checkpoint) - RECONCILE_LOOKBACK)
+    assert stats['inserted'] == 0
+    assert storage.get_state(conn, reconcile.CHECKPOINT_KEY) == stats['to']
+    assert reconcile.reconcile_stats(conn)['last_run'] == stats
+
+
+def test_failed_run_keeps_the_checkpoint(conn, paystack):
+    fake, client = paystack(20)
+    storage.set_state(conn, reconcile.CHECKPOINT_KEY, '2024-03-05T00:00:00.000Z')
+
+    def list_transactions(page, since, until):
+        if page == 2:
+            raise RuntimeError("Paystack returned HTTP 400 for page 2")
+        return SmallPages.list_transactions(client, page, since, until)
+
+    client.list_transactions = list_transactions
+    with pytest.raises(RuntimeError):
+        reconcile.reconcile(conn, client=client)
+
+    assert storage.get_state(
+        conn, reconcile.CHECKPOINT_KEY) == '2024-03-05T00:00:00.000Z'
+    # The lease was given up, so the next run can retry straight away
+    assert storage.acquire_lease(conn, reconcile.LEASE_NAME, 'someone-else',
+                                 60)
+
+
+def test_lease_is_released_after_the_checkpoint(conn, paystack, monkeypatch):
+    fake, client = paystack(5)
+    release_lease = storage.release_lease
+    at_release = []
+
+    def record_release(conn, name, owner):
+        at_release.append(storage.get_state(conn, reconcile.CHECKPOINT_KEY))
+        release_lease(conn, name, owner)
+
+    monkeypatch.setattr(storage, 'release_lease', record_release)
+    stats = reconcile.reconcile(conn, since=time.time() - 7200, client=client)
+
+    assert at_release == [stats['to']]
+
+
+def test_reconcile_skips_while_another_worker_holds_the_lease(conn, paystack):
+    fake, client = paystack(5)
+    storage.acquire_lease(conn, reconcile.LEASE_NAME, 'someone-else', 60)
+
+    assert reconcile.reconcile(conn, client=client) is None
+    assert fake.stats()['calls'] == {}
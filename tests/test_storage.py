@@ -0,0 +1,187 @@
+# tests/test_storage.py
+
+import pytest
+
+import storage
+
+
+def _rollups(conn):
+    return {(day, status): (count, amount) for day, status, count, amount in
+            conn.execute("SELECT day, status, count, amount "
+                         "FROM payment_rollups_daily").fetchall()}
+
+
+def test_insert_payment_is_idempotent(conn, make_payment):
+    data = make_payment(1, amount=2500)
+    with conn:
+        payment_id = storage.insert_payment(conn, data)
+    with conn:
+        assert storage.insert_payment(conn, data) is None
+
+    assert payment_id is not None
+    assert conn.execute("SELECT COUNT(*) FROM payments").fetchone()[0] == 1
+    assert _rollups(conn) == {('2024-03-05', 'success'): (1, 2500)}
+    assert storage.check_rollups(conn) == []
+
+
+def test_insert_payment_reads_custom_fields(conn, make_payment):
+    with conn:
+        storage.insert_payment(
+            conn, make_payment(1, chat_id=42, full_name="Ama Mensah"))
+    row = conn.execute(
+        "SELECT reference, email, full_name, chat_id FROM payments").fetchone()
+    assert tuple(row) == ('REF000001', 'customer1@example.com', 'Ama Mensah',
+                          '42')
+
+
+def test_insert_payments_skips_known_references(conn, make_payment):
+    with conn:
+        storage.insert_payments(conn, [make_payment(i) for i in range(5)])
+    batch = [make_payment(i) for i in range(3, 12)]
+    # The same reference twice in one batch is inserted once
+    batch.append(make_payment(11))
+    with conn:
+        inserted = storage.insert_payments(conn, batch, chunk_size=4)
+
+    assert sorted(inserted) == [f"REF{i:06d}" for i in range(5, 12)]
+    assert conn.execute("SELECT COUNT(*) FROM payments").fetchone()[0] == 12
+    assert _rollups(conn) == {('2024-03-05', 'success'): (12, 12 * 5000)}
+
+
+def test_rollups_follow_day_and_status(conn, make_payment):
+    payments = [
+        make_payment(1, paid_at='2024-03-05T09:00:00Z', amount=100),
+        make_payment(2, paid_at='2024-03-05T23:59:59Z', amount=200),
+        make_payment(3, paid_at='2024-04-01T00:00:00Z', amount=300),
+        make_payment(4, status='failed', amount=400),
+        make_payment(5, paid_at=None, status='abandoned', amount=500),
+    ]
+    with conn:
+        storage.insert_payment(conn, payments[0])
+        storage.insert_payments(conn, payments[1:])
+
+    assert _rollups(conn) == {
+        ('2024-03-05', 'success'): (2, 300),
+        ('2024-04-01', 'success'): (1, 300),
+        ('2024-03-05', 'failed'): (1, 400),
+        ('unknown', 'abandoned'): (1, 500),
+    }
+    assert storage.check_rollups(conn) == []
+
+    stats = storage.payment_stats(conn)
+    assert stats['totals'] == {
+        'count': 5,
+        'amount': 1500,
+        'success_count': 3,
+        'success_amount': 600
+    }
+    assert [m['period'] for m in stats['monthly']] == [
+        '2024-03', '2024-04', 'unknown'
+    ]
+
+
+def test_check_and_rebuild_rollups(conn, make_payment):
+    with conn:
+        storage.insert_payments(conn, [make_payment(i) for i in range(3)])
+    with conn:
+        conn.execute("UPDATE payment_rollups_daily SET count = count + 1")
+    assert [m['rollup'] for m in storage.check_rollups(conn)] == ['daily']
+
+    storage.rebuild_rollups(conn)
+    assert storage.check_rollups(conn) == []
+
+
+def test_existing_references(conn, make_payment):
+    with conn:
+        storage.insert_payments(conn, [make_payment(i) for i in range(5)])
+    wanted = [f"REF{i:06d}" for i in range(3, 8)]
+    assert storage.existing_references(conn, wanted, chunk_size=2) == {
+        'REF000003', 'REF000004'
+    }
+
+
+@pytest.fixture
+def payments(conn, make_payment):
+    with conn:
+        storage.insert_payments(conn, [
+            make_payment(1, paid_at='2024-03-01T08:00:00Z',
+                         email='ama@example.com', full_name='Ama Mensah'),
+            make_payment(2, paid_at='2024-03-02T23:30:00Z',
+                         email='kofi@example.com', full_name='Kofi Boateng'),
+            make_payment(3, paid_at='2024-03-03T00:00:00Z', status='failed',
+                         email='efua@example.com', full_name='Efua Mensah'),
+            make_payment(4, paid_at='2024-03-04T12:00:00Z',
+                         email='yaw@example.com', full_name='Yaw Asante'),
+        ])
+    return conn
+
+
+def _references(conn, **filters):
+    where, params = storage.payment_filters(**filters)
+    return sorted(row[0] for row in conn.execute(
+        f"SELECT reference FROM payments {where}", params).fetchall())
+
+
+def test_payment_filters_dates_are_inclusive(payments):
+    assert _references(payments, start='2024-03-02', end='2024-03-03') == [
+        'REF000002', 'REF000003'
+    ]
+    assert _references(payments, end='2024-03-01') == ['REF000001']
+    assert _references(payments, end='not-a-date') == []
+
+
+def test_payment_filters_status_and_search(payments):
+    assert _references(payments, status='failed') == ['REF000003']
+    assert _references(payments, q='mensah') == ['REF000001', 'REF000003']
+    assert _references(payments, q='Mens', status='success') == ['REF000001']
+    assert _references(payments, q='kofi@example') == ['REF000002']
+    assert _references(payments, q='REF000004') == ['REF000004']
+    assert _references(payments, q='nobody') == []
+
+
+def test_payment_filters_search_without_words(payments):
+    # No word for full-text search to match, so it is a substring search
+    assert _references(payments, q='!!!') == []
+    assert _references(payments, q='@') == [
+        'REF000001', 'REF000002', 'REF000003', 'REF000004'
+    ]
+    assert _references(payments, q='@', status='failed') == ['REF000003']
+
+
+def test_list_payments_keyset_pages(conn, make_payment):
+    with conn:
+        storage.insert_payments(conn, [make_payment(i) for i in range(23)])
+
+    seen = []
+    after_id = None
+    while True:
+        page = storage.list_payments(conn, 5, after_id=after_id)
+        if not page:
+            break
+        seen.extend(row['reference'] for row in page)
+        after_id = page[-1]['id']
+
+    assert seen == [f"REF{i:06d}" for i in reversed(range(23))]
+
+
+def test_list_payments_keyset_with_filters(conn, make_payment):
+    with conn:
+        storage.insert_payments(conn, [
+            make_payment(i, status='failed' if i % 3 else 'success')
+            for i in range(20)
+        ])
+    first = storage.list_payments(conn, 3, status='success')
+    second = storage.list_payments(conn, 3, status='success',
+                                   after_id=first[-1]['id'])
+    references = [row['reference'] for row in first + second]
+    assert references == [f"REF{i:06d}" for i in (18, 15, 12, 9, 6, 3)]
+
+
+def test_iter_payment_chunks(conn, make_payment):
+    with conn:
+        storage.insert_payments(conn, [make_payment(i) for i in range(10)])
+    chunks = list(storage.iter_payment_chunks(conn, 4))
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    assert [row[1] for chunk in chunks for row in chunk] == [
+        f"REF{i:06d}" for i in range(10)
+    ]
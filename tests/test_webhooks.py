@@ -0,0 +1,171 @@
+# tests/test_webhooks.py
+
+import hashlib
+import hmac
+import io
+import json
+
+import pytest
+
+import app as app_module
+import metrics
+import outbound
+import outbox
+import update_dedupe
+import update_executor
+from config import PAYSTACK_SECRET_KEY, WEBHOOK_MAX_BODY, WEBHOOK_URL_PATH
+from seen_cache import SeenCache
+
+
+@pytest.fixture
+def client(conn, monkeypatch):
+    """Flask test client with no background threads and no Telegram calls"""
+    replies = []
+    monkeypatch.setattr(app_module, 'start_background', lambda: None)
+    monkeypatch.setattr(metrics, 'start_flusher', lambda: None)
+    monkeypatch.setattr(outbox, 'wake', lambda: None)
+    monkeypatch.setattr(app_module, 'reply_message',
+                        lambda chat_id, text, *args, **kwargs: replies.append(
+                            (chat_id, text)))
+    monkeypatch.setattr(app_module, 'seen_references', SeenCache(100))
+    client = app_module.app.test_client()
+    client.replies = replies
+    return client
+
+
+def _post_payment(client, payload, signature=None):
+    body = json.dumps(payload).encode()
+    if signature is None:
+        signature = hmac.new(PAYSTACK_SECRET_KEY.encode(), body,
+                             hashlib.sha512).hexdigest()
+    headers = {'Content-Type': 'application/json'}
+    if signature:
+        headers['X-Paystack-Signature'] = signature
+    return client.post('/payment_webhook', data=body, headers=headers)
+
+
+def _count(conn, table):
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_signed_charge_is_stored_with_its_invite_job(client, conn,
+                                                     make_payment):
+    payload = {'event': 'charge.success', 'data': make_payment(1, chat_id=42)}
+    response = _post_payment(client, payload)
+
+    assert response.status_code == 200
+    assert response.get_json() == {'status': 'success'}
+    assert conn.execute("SELECT reference, chat_id FROM payments").fetchall(
+    ) == [('REF000001', '42')]
+    kind, payload = conn.execute("SELECT kind, payload FROM outbox").fetchone()
+    assert kind == 'deliver_invite'
+    assert json.loads(payload) == {
+        'reference': 'REF000001',
+        'chat_id': '42',
+        'amount': 5000
+    }
+
+
+def test_duplicate_charge_is_ignored(client, conn, make_payment):
+    payload = {'event': 'charge.success', 'data': make_payment(1, chat_id=42)}
+    _post_payment(client, payload)
+    response = _post_payment(client, payload)
+
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'ignored'
+    assert _count(conn, 'payments') == 1
+    assert _count(conn, 'outbox') == 1
+    assert [chat_id for chat_id, _ in client.replies] == ['42']
+
+
+@pytest.mark.parametrize('signature, message', [
+    ('', 'Missing signature'),
+    ('0' * 128, 'Invalid signature'),
+    ('not ascii ✓', 'Invalid signature'),
+])
+def test_bad_signature_is_rejected(client, conn, make_payment, signature,
+                                   message):
+    payload = {'event': 'charge.success', 'data': make_payment(1)}
+    response = _post_payment(client, payload, signature=signature)
+
+    assert response.status_code == 400
+    assert response.get_json()['message'] == message
+    assert _count(conn, 'payments') == 0
+    assert _count(conn, 'outbox') == 0
+
+
+@pytest.mark.parametrize('path', ['/payment_webhook', WEBHOOK_URL_PATH])
+def test_oversize_body_is_refused(client, conn, path):
+    body = b'{"pad": "' + b'x' * WEBHOOK_MAX_BODY + b'"}'
+    response = client.post(path, data=body,
+                           headers={'Content-Type': 'application/json'})
+
+    assert response.status_code == 413
+    assert _count(conn, 'payments') == 0
+
+
+def test_oversize_chunked_body_is_refused(client):
+    # No Content-Length, so only reading the stream can catch it. Servers
+    # that decode chunked bodies say so with wsgi.input_terminated.
+    body = io.BytesIO(b'x' * (WEBHOOK_MAX_BODY + 1024))
+    response = client.post(
+        WEBHOOK_URL_PATH,
+        input_stream=body,
+        headers={
+            'Content-Type': 'application/json',
+            'Transfer-Encoding': 'chunked'
+        },
+        environ_overrides={'wsgi.input_terminated': True})
+    assert response.status_code == 413
+
+
+@pytest.mark.parametrize('path', ['/payment_webhook', WEBHOOK_URL_PATH])
+def test_invalid_json_is_rejected(client, path):
+    body = b'[not json'
+    signature = hmac.new(PAYSTACK_SECRET_KEY.encode(), body,
+                         hashlib.sha512).hexdigest()
+    response = client.post(path, data=body,
+                           headers={
+                               'Content-Type': 'application/json',
+                               'X-Paystack-Signature': signature
+                           })
+
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Invalid JSON payload'
+
+
+@pytest.mark.parametrize('pending, inline', [(False, True), (True, False)])
+def test_inline_reply_waits_for_queued_replies(client, monkeypatch, pending,
+                                               inline):
+    queued = []
+    monkeypatch.setattr(update_dedupe, '_deduplicator',
+                        update_dedupe.UpdateDeduplicator())
+    monkeypatch.setattr(update_executor, 'get_executor', lambda: None)
+    monkeypatch.setattr(outbound, 'has_pending', lambda chat_id: pending)
+    monkeypatch.setattr(
+        outbound, 'enqueue_message',
+        lambda chat_id, text, *args: queued.append(chat_id) or True)
+    update = {
+        'update_id': 1,
+        'message': {
+            'message_id': 1,
+            'chat': {
+                'id': 7
+            },
+            'from': {
+                'id': 7,
+                'first_name': 'Ama'
+            },
+            'text': '/start'
+        }
+    }
+    response = client.post(WEBHOOK_URL_PATH, json=update)
+
+    assert response.status_code == 200
+    if inline:
+        assert response.get_json()['method'] == 'sendMessage'
+        assert queued == []
+    else:
+        # Queued behind the chat's earlier replies instead
+        assert response.get_json() == {'status': 'success'}
+        assert queued == [7]
@@ -0,0 +1,108 @@
+# update_dedupe.py
+"""Drop Telegram updates that were already accepted.
+
+Telegram redelivers an update when the webhook is slow or fails, and a
+restarted poller can fetch a batch again. Each update_id is checked against
+a per-worker LRU (UPDATE_DEDUPE_SIZE ids, UPDATE_DEDUPE_TTL seconds) and,
+with UPDATE_DEDUPE_SHARED, claimed in the ``seen_updates`` table so a retry
+that lands on another gunicorn worker is caught too.
+"""
+
+import logging
+import threading
+
+import storage
+from config import UPDATE_DEDUPE_SIZE, UPDATE_DEDUPE_TTL, UPDATE_DEDUPE_SHARED
+from seen_cache import SeenCache
+
+logger = logging.getLogger(__name__)
+
+# Shared claims older than the TTL are deleted every PRUNE_EVERY claims
+PRUNE_EVERY = 1000
+
+
+class UpdateDeduplicator:
+
+    def __init__(self,
+                 maxsize=UPDATE_DEDUPE_SIZE,
+                 ttl=UPDATE_DEDUPE_TTL,
+                 shared=UPDATE_DEDUPE_SHARED):
+        self.ttl = ttl
+        self.shared = shared
+        self._seen = SeenCache(maxsize, ttl)
+        self._lock = threading.Lock()
+        self._counters = {'accepted': 0, 'duplicates': 0, 'shared_hits': 0}
+        self._claims = 0
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def is_duplicate(self, update):
+        """Claim the update's id. Returns True if it was already claimed."""
+        update_id = update.get('update_id')
+        if update_id is None:
+            return False
+
+        if self._seen.check_and_add(update_id):
+            self._count('duplicates')
+            return True
+
+        if self.shared:
+            try:
+                conn = storage.get_connection()
+                claimed = storage.claim_update(conn, update_id)
+                self._maybe_prune(conn)
+            except Exception as e:
+                # Fall back to the local check rather than drop the update
+                logger.error("Shared update dedupe failed: %s", e)
+                claimed = True
+            if not claimed:
+                self._count('duplicates')
+                self._count('shared_hits')
+                return True
+
+        self._count('accepted')
+        return False
+
+    def release(self, update):
+        """Undo a claim for an update that was not processed after all"""
+        update_id = update.get('update_id')
+        if update_id is None:
+            return
+        self._seen.discard(update_id)
+        if self.shared:
+            try:
+                storage.release_update(storage.get_connection(), update_id)
+            except Exception as e:
+                logger.error("Failed to release update %s: %s", update_id, e)
+
+    def _maybe_prune(self, conn):
+        with self._lock:
+            self._claims += 1
+            if self._claims % PRUNE_EVERY:
+                return
+        removed = storage.prune_seen_updates(conn, self.ttl)
+        logger.debug("Pruned %s seen update ids", removed)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['shared'] = self.shared
+        stats['cache'] = self._seen.stats()
+        return stats
+
+
+_deduplicator = UpdateDeduplicator()
+
+
+def is_duplicate(update):
+    return _deduplicator.is_duplicate(update)
+
+
+def release(update):
+    _deduplicator.release(update)
+
+
+def dedupe_stats():
+    return _deduplicator.stats()
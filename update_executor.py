@@ -0,0 +1,187 @@
+# update_executor.py
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from bot_handlers import process_update, update_chat_id
+from config import UPDATE_WORKERS, UPDATE_QUEUE_SIZE, UPDATE_DRAIN_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ShardedExecutor:
+    """Run updates on a fixed set of worker threads, sharded by chat_id.
+
+    Each shard has one thread and a bounded queue, so updates for the same
+    chat always run in arrival order while different chats run in parallel.
+    When a shard's queue is full, submit() returns False and the caller can
+    shed load (the webhook answers 503 and Telegram redelivers later).
+    run_if_idle() lets the caller process an update on its own thread when
+    that chat's shard has nothing queued or running, without reordering it.
+    """
+
+    def __init__(self,
+                 process=process_update,
+                 shards=UPDATE_WORKERS,
+                 queue_size=UPDATE_QUEUE_SIZE):
+        self.process = process
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(shards)]
+        # Held by a shard's thread while it processes an update, and by
+        # run_if_idle while the caller processes one inline
+        self._busy = [threading.Lock() for _ in range(shards)]
+        self._threads = []
+        self._accepting = True
+        self._lock = threading.Lock()
+        self._counters = {
+            'submitted': 0,
+            'processed': 0,
+            'rejected': 0,
+            'inline': 0
+        }
+
+    def start(self):
+        for i, shard in enumerate(self._queues):
+            thread = threading.Thread(target=self._run,
+                                      args=(shard, self._busy[i]),
+                                      name=f"update-shard-{i}",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("Update executor started with %s shards",
+                    len(self._queues))
+
+    def _index_for(self, chat_id):
+        return hash(chat_id) % len(self._queues)
+
+    def _shard_for(self, chat_id):
+        return self._queues[self._index_for(chat_id)]
+
+    def submit(self, update, chat_id=None):
+        """Queue an update. Returns False if its shard is full or draining.
+
+        Pass `chat_id` when the caller already extracted it.
+        """
+        if not self._accepting:
+            return False
+        if chat_id is None:
+            chat_id = update_chat_id(update)
+        try:
+            self._shard_for(chat_id).put_nowait(update)
+        except queue.Full:
+            with self._lock:
+                self._counters['rejected'] += 1
+            return False
+        with self._lock:
+            self._counters['submitted'] += 1
+        return True
+
+    def run_if_idle(self, chat_id, func, *args):
+        """Call func(*args) on this thread if the chat's shard is idle.
+
+        Idle means no update is queued on the shard or being processed by
+        it, so nothing earlier for the chat is still pending. Returns
+        (True, result), or (False, None) if the caller should submit() the
+        update instead. Updates submitted meanwhile wait for it to finish.
+        """
+        index = self._index_for(chat_id)
+        busy = self._busy[index]
+        if not busy.acquire(blocking=False):
+            return False, None
+        try:
+            # unfinished_tasks also counts an update taken off the queue
+            # whose shard thread has not got the busy lock yet
+            if self._queues[index].unfinished_tasks:
+                return False, None
+            with self._lock:
+                self._counters['inline'] += 1
+            return True, func(*args)
+        finally:
+            busy.release()
+
+    def depth(self):
+        return sum(shard.qsize() for shard in self._queues)
+
+    def _run(self, shard, busy):
+        while True:
+            update = shard.get()
+            try:
+                if update is _STOP:
+                    return
+                with busy:
+                    self.process(update)
+            except Exception as e:
+                logger.error("Error processing queued update: %s", e)
+            finally:
+                shard.task_done()
+            with self._lock:
+                self._counters['processed'] += 1
+
+    def drain(self, timeout=UPDATE_DRAIN_TIMEOUT):
+        """Stop accepting work and wait up to `timeout` for queued updates"""
+        if not self._accepting:
+            return self.depth()
+        self._accepting = False
+        deadline = time.monotonic() + timeout
+        for shard in self._queues:
+            # Waits only while the shard is full; it empties as work finishes
+            try:
+                shard.put(_STOP, timeout=max(deadline - time.monotonic(), 0))
+            except queue.Full:
+                pass
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        remaining = self.depth()
+        if remaining:
+            logger.warning(
+                "Update executor stopped with %s updates unprocessed",
+                remaining)
+        return remaining
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['queue_depth'] = self.depth()
+        stats['shards'] = len(self._queues)
+        stats['shard_depths'] = [shard.qsize() for shard in self._queues]
+        return stats
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return this worker's executor, or None when UPDATE_WORKERS is 0"""
+    global _executor, _executor_pid
+
+    if UPDATE_WORKERS <= 0:
+        return None
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                executor = ShardedExecutor()
+                executor.start()
+                _executor = executor
+                _executor_pid = pid
+    return _executor
+
+
+def queue_depth():
+    """Updates waiting in this worker's executor, without starting one"""
+    if _executor is None or _executor_pid != os.getpid():
+        return 0
+    return _executor.depth()
+
+
+@atexit.register
+def _shutdown():
+    if _executor is not None and _executor_pid == os.getpid():
+        _executor.drain()